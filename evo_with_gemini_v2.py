@@ -4,16 +4,40 @@ import math
 import numpy as np
 import pickle # Для збереження/завантаження
 import time   # Для логування часу
+import argparse
+import contextlib
+import csv
+import gc
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import sys
+import tempfile
+import threading
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
+from collections.abc import MutableMapping
 from abc import ABC, abstractmethod # <--- Імпортуємо необхідне для абстрактних класів
 
 # --- Налаштування Pygame та Симуляції ---
-pygame.init()
+# Вікно та шрифти створюються лише в init_display(), тож модуль можна імпортувати
+# та запускати без дисплея (run_headless). Розмір світу (WIDTH x HEIGHT) не залежить від
+# розміру вікна (SCREEN_WIDTH x SCREEN_HEIGHT): видиму частину світу вибирає камера.
 WIDTH, HEIGHT = 1000, 750
-SCREEN = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Розширена Еволюційна Симуляція (Pygame)")
-CLOCK = pygame.time.Clock()
-FONT = pygame.font.SysFont(None, 26)
-INFO_FONT = pygame.font.SysFont(None, 22)
+SCREEN_WIDTH, SCREEN_HEIGHT = 1000, 750
+SCREEN = None
+CLOCK = None
+FONT = None
+INFO_FONT = None
+SIM_DT = 1 / 60 # Фіксований крок симуляції (с): результати не залежать від FPS
+SPEED_MULTIPLIERS = (1, 10, 100, None) # Темпи симуляції (клавіші 1-4); None - "макс"
+MAX_SUBSTEPS_PER_FRAME = 200 # Захист від "спіралі смерті", якщо CPU не встигає
+MAX_SPEED_FRAME_BUDGET = 1 / 30 # Частка реального часу кадру, яку "макс" віддає на кроки
 
 # --- Глобальні Параметри ---
 BG_COLOR = (10, 10, 20)
@@ -24,6 +48,33 @@ OBSTACLE_COLOR = (100, 100, 100)
 PREDATOR_COLOR = (255, 50, 50)
 FOOD_COLOR = (0, 255, 0)
 CREATURE_BASE_COLOR_G = 50 # <--- Визначено тут
+SENSE_HALO_ALPHA = 30
+SPRITE_CACHE_BYTES = 32 * 2**20 # Пам'ять попередньо намальованих спрайтів (LRU); вміщує видимі ореоли при найбільшому масштабі
+HALO_RADIUS_QUANTUM = 2 # Крок квантування радіуса ореолу (пікс.) для ключа кешу
+COLOR_QUANTUM = 8 # Крок квантування каналів кольору для ключа кешу
+MAX_DIRTY_RECTS = 2000 # Більше змінених прямокутників за кадр - оновлюємо весь екран
+DIRTY_AREA_FULL_UPDATE = 0.6 # Частка площі екрана, понад яку дешевше зробити flip()
+CAMERA_MAX_ZOOM = 4.0 # Найбільше збільшення; найменше - увесь світ у вікні
+CAMERA_ZOOM_STEP = 1.25 # Множник масштабу за один крок коліщатка миші
+CAMERA_PAN_SPEED = 800 # Швидкість прокрутки стрілками (пікс. екрана за секунду)
+# Рівні деталізації (LOD): 0 - спрайти з ореолами, 1 - без ореолів, 2 - пікселі, 3 - теплова карта
+LOD_THRESHOLDS = (1500, 6000, 30000) # Видимих агентів, понад які вмикається рівень 1 / 2 / 3
+LOD_TARGET_FPS = 60 # Регулятор підвищує рівень, якщо малювання не вкладається в частку кадру
+LOD_RENDER_SHARE = 0.5 # Частка кадру, яку може займати малювання (решта - кроки симуляції)
+LOD_SMOOTHING = 0.1 # Коефіцієнт експоненційного згладжування часу малювання
+LOD_HOLD_FRAMES = 30 # Кадрів без змін рівня після кожної зміни (час кадру встигає усталитися)
+LOD_RELAX_FRAMES = 120 # Кадрів зі значним запасом часу, після яких регулятор знижує рівень
+LOD_HEATMAP_CELL = 8 # Розмір клітинки теплової карти (пікс. екрана)
+LOD_HEATMAP_SATURATION = 50 # Агентів у клітинці для максимальної яскравості
+CHART_WIDTH = 240 # Ширина живих графіків (пікс.) = кількість останніх точок історії
+CHART_HEIGHT = 40 # Висота одного графіка (пікс.)
+CHART_TITLE_HEIGHT = 18 # Рядок підпису над кожним графіком
+PROFILE_WINDOW = 1.0 # Вікно усереднення профайлера (с реального часу): оверлей та рядок експорту
+# Фази кроку та кадру; render включає draw_agents та hud
+PROFILE_PHASES = ('index', 'engine', 'mating', 'creatures', 'predators', 'births', 'removal', 'add', 'cap',
+                  'lineage', 'food', 'stats', 'autosave', 'events', 'render', 'draw_agents', 'hud')
+PROFILE_COUNTERS = ('ticks', 'frames', 'creatures_updated', 'predators_updated', 'neighbor_checks',
+                    'agents_born', 'food_spawned', 'sprites_built', 'agents_drawn')
 
 # --- Параметри Істот ---
 INITIAL_CREATURES = 20
@@ -69,25 +120,53 @@ PREDATOR_RADIUS = 7 # <--- Визначено тут
 
 # --- Параметри Світу ---
 NUM_OBSTACLES = 5
+FOOD_RADIUS = 3
 OBSTACLE_MIN_SIZE = 25
 OBSTACLE_MAX_SIZE = 50
+GRID_CELL_SIZE = 50 # Розмір клітинки просторової сітки для пошуку сусідів
+AUTOSAVE_DIR = "autosave" # Каталог контрольних точок
+AUTOSAVE_INTERVAL = 60.0 # Секунди реального часу між автозбереженнями (0 - вимкнено)
+AUTOSAVE_FULL_EVERY = 5 # Кожна n-та контрольна точка повна, решта - дельти
+AUTOSAVE_KEEP = 3 # Скільки повних контрольних точок (з їхніми дельтами) зберігати
+OBSTACLE_MAP_CELL_SIZE = 8 # Розмір клітинки карти зайнятості перешкодами (пікс.)
+OBSTACLE_MAP_MAX_CELLS = 4_000_000 # Більше клітинок на карту - і клітинки стають більшими (дуже великі світи)
+MATE_MATCH_ROUNDS = 3 # Раундів підбору пар за крок (для тих, чий найближчий сусід уже зайнятий)
+
+# --- Параметри Рушія ---
+# True (--numpy-engine): стан агентів (позиція, напрямок, енергія, вік, кулдаун, покоління,
+# гени, цілі) зберігається у неперервних масивах NumPy для кожного виду, і весь крок -
+# старіння, енергія, смерть, пошук цілей, кермування, їжа, полювання та рух - рахується
+# векторизовано (engine_update_creatures / engine_update_predators).
+USE_NUMPY_ENGINE = False
+GENE_NAMES = ('speed', 'sense')
 
 # --- Відстеження Поколінь та Статистика ---
 max_creature_generation = 0
 max_predator_generation = 0
-history_time = []
-history_creature_pop = []
-history_predator_pop = []
-history_avg_creature_speed = []
-history_avg_creature_sense = []
-history_avg_predator_speed = []
-history_avg_predator_sense = []
+GENE_HIST_BINS = 32        # кошиків гістограми на ген (між мін. та макс. значенням гена)
+TELEMETRY_QUANTILES = (10, 50, 90) # перцентилі кожного гена в рядку статистики (ряди p10_creature_speed, ...)
+# Ряди статистики зберігаються у TelemetryStore (див. нижче): по одному рядку float64 на ряд.
+# Гістограма гена на кожному записі - GENE_HIST_BINS рядів лічильників hist_<вид>_<ген>_<кошик>
+TELEMETRY_HIST_SERIES = tuple(f'hist_{species}_{gene}_{b}' for species in ('creature', 'predator')
+                              for gene in GENE_NAMES for b in range(GENE_HIST_BINS))
+TELEMETRY_SERIES = ('time', 'creature_pop', 'predator_pop',
+                    'avg_creature_speed', 'avg_creature_sense',
+                    'avg_predator_speed', 'avg_predator_sense',
+                    'std_creature_speed', 'std_creature_sense',
+                    'std_predator_speed', 'std_predator_sense') + tuple(
+                    f'p{q}_{species}_{gene}' for species in ('creature', 'predator')
+                    for gene in GENE_NAMES for q in TELEMETRY_QUANTILES) + TELEMETRY_HIST_SERIES
+TELEMETRY_CAPACITY = 1024  # початкова місткість буфера (точок), далі подвоюється
+TELEMETRY_CHUNK = 4096     # розмір запечатаного сегмента на диску (точок)
+TELEMETRY_DIR = None       # каталог для сегментів .npy; None - усе в пам'яті
+LINEAGE_PRUNE_MIN = 4096   # записів родоводу, після яких вмикається обрізання
+LINEAGE_PRUNE_GROWTH = 2.0 # обрізати, коли записів стало в стільки разів більше, ніж після минулого
 simulation_time = 0.0
 log_interval = 1.0
 last_log_time = -log_interval
 
 # --- Допоміжні Функції ---
-# ... (distance_sq, normalize_vec, clamp, crossover_genes залишаються без змін) ...
+# ... (distance_sq, normalize_vec, clamp залишаються без змін) ...
 def distance_sq(p1, p2):
     return (p1 - p2).length_squared()
 
@@ -99,34 +178,1459 @@ def normalize_vec(vec):
              return pygame.Vector2(0, 0)
     return pygame.Vector2(0, 0)
 
+def normalize_rows(vectors):
+    # Векторизований normalize_vec для масиву (n, 2): нульові рядки лишаються нульовими
+    vectors = np.asarray(vectors, dtype=float)
+    length = np.hypot(vectors[:, 0], vectors[:, 1])
+    return np.divide(vectors, length[:, None], out=np.zeros_like(vectors), where=length[:, None] > 0)
+
 def clamp(value, min_val, max_val):
     return max(min_val, min(value, max_val))
 
-def crossover_genes(genes1, genes2):
-    child_genes = {}
-    child_genes['speed'] = genes1['speed'] if random.random() < 0.5 else genes2['speed']
-    child_genes['sense'] = genes1['sense'] if random.random() < 0.5 else genes2['sense']
-    return child_genes
+# --- Геном ---
+# Схема генів виду: межі, ймовірність та сила мутації кожного гена як масиви float у порядку
+# GENE_NAMES. Нащадки всього кроку отримують гени одним пакетом (resolve_births): схрещування
+# та мутація - операції NumPy над матрицями (нащадки x гени). Новий ген - це рядок у схемах
+# видів та ім'я в GENE_NAMES, конструктори агентів не змінюються.
+class GenomeSchema:
+    def __init__(self, spec):
+        # spec: ((ген, мін, макс, ймовірність мутації, сила мутації), ...)
+        self.names = tuple(row[0] for row in spec)
+        if self.names != GENE_NAMES:
+            raise ValueError(f"Гени схеми {self.names} не збігаються з GENE_NAMES {GENE_NAMES}")
+        self.low, self.high, self.rate, self.strength = (
+            np.array([row[i] for row in spec], dtype=float) for i in range(1, 5))
+        self.spec = tuple(spec)
+        # Атрибути min_<ген>/max_<ген>, які агент отримує від виду
+        self.bounds = {}
+        for name, low, high, _, _ in spec:
+            self.bounds['min_' + name], self.bounds['max_' + name] = low, high
+
+    def ranges(self):
+        return {name: (low, high) for name, low, high, _, _ in self.spec}
+
+    def random_genes(self):
+        # Випадкові гени засновника (рівномірно в межах виду)
+        return {name: random.uniform(low, high) for name, low, high, _, _ in self.spec}
+
+    def midpoint(self):
+        return (self.low + self.high) / 2
+
+    def crossover(self, genes1, genes2):
+        # Кожен ген нащадка - від одного з батьків з імовірністю 1/2
+        return np.where(np.random.random(genes1.shape) < 0.5, genes1, genes2)
+
+    def mutate(self, genes):
+        # Ген мутує з імовірністю rate на випадкову частку ±strength свого значення
+        hit = np.random.random(genes.shape) < self.rate
+        delta = (np.random.random(genes.shape) * 2 - 1) * self.strength * genes
+        return np.clip(np.where(hit, genes + delta, genes), self.low, self.high)
+
+_genome_schemas = {}
+
+def genome_schema(spec):
+    # Схеми кешуються за параметрами: перевизначення констант (sweep) дають нову схему
+    schema = _genome_schemas.get(spec)
+    if schema is None:
+        schema = _genome_schemas[spec] = GenomeSchema(spec)
+    return schema
+
+def creature_genome():
+    return genome_schema((
+        ('speed', CREATURE_MIN_SPEED, CREATURE_MAX_SPEED, CREATURE_MUTATION_RATE, CREATURE_MUTATION_STRENGTH),
+        ('sense', CREATURE_MIN_SENSE, CREATURE_MAX_SENSE, CREATURE_MUTATION_RATE, CREATURE_MUTATION_STRENGTH),
+    ))
+
+def predator_genome():
+    return genome_schema((
+        ('speed', PREDATOR_MIN_SPEED, PREDATOR_MAX_SPEED, PREDATOR_MUTATION_RATE, PREDATOR_MUTATION_STRENGTH),
+        ('sense', PREDATOR_MIN_SENSE, PREDATOR_MAX_SENSE, PREDATOR_MUTATION_RATE, PREDATOR_MUTATION_STRENGTH),
+    ))
+
+# --- Профілювання ---
+# Таймери фаз (perf_counter) та лічильники. Вимкнений профайлер коштує одну перевірку прапорця
+# на фазу. Раз на PROFILE_WINDOW секунд накопичене зводиться в підсумок вікна (для оверлея)
+# і, якщо задано файл, дописується рядком у .csv або перезаписує .json.
+class PhaseProfiler:
+    def __init__(self, phases=PROFILE_PHASES, counters=PROFILE_COUNTERS, window=PROFILE_WINDOW):
+        self.phases = phases
+        self.counter_names = counters
+        self.window = window
+        self.enabled = False
+        self.path = None
+        self.summary = None   # Підсумок останнього завершеного вікна
+        self.summary_seq = 0  # Зростає з кожним новим підсумком
+        self.total_ms = dict.fromkeys(phases, 0.0)
+        self.total_counts = dict.fromkeys(counters, 0)
+        self._reset_window()
+
+    def _reset_window(self):
+        self.times = dict.fromkeys(self.phases, 0.0)
+        self.calls = dict.fromkeys(self.phases, 0)
+        self.counts = dict.fromkeys(self.counter_names, 0)
+        self.window_start = time.perf_counter()
+
+    def enable(self, enabled=True, path=None):
+        if path is not None: self.path = path
+        if enabled and not self.enabled: self._reset_window()
+        self.enabled = enabled or self.path is not None
+
+    def lap(self, phase, start):
+        # Додає час від start до фази і повертає поточний момент - початок наступної фази
+        now = time.perf_counter()
+        self.times[phase] += now - start
+        self.calls[phase] += 1
+        return now
+
+    def count(self, name, n=1):
+        self.counts[name] += n
+
+    def maybe_flush(self):
+        if self.enabled and time.perf_counter() - self.window_start >= self.window:
+            self.flush()
+
+    def flush(self):
+        duration = max(time.perf_counter() - self.window_start, 1e-9)
+        self.summary = {
+            'wall_time': time.time(),
+            'sim_time': simulation_time,
+            'duration': duration,
+            'ms': {phase: t * 1000 for phase, t in self.times.items()},
+            'calls': dict(self.calls),
+            'counters': dict(self.counts),
+        }
+        self.summary_seq += 1
+        for phase, t in self.times.items(): self.total_ms[phase] += t * 1000
+        for name, n in self.counts.items(): self.total_counts[name] += n
+        if self.path: self.export()
+        self._reset_window()
+
+    def export(self):
+        summary = self.summary
+        if self.path.endswith('.csv'):
+            new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            with open(self.path, 'a', newline='') as f:
+                writer = csv.writer(f)
+                if new_file:
+                    writer.writerow(['wall_time', 'sim_time', 'duration']
+                                    + [f'ms.{p}' for p in self.phases] + [f'calls.{p}' for p in self.phases]
+                                    + list(self.counter_names))
+                writer.writerow([f"{summary['wall_time']:.3f}", f"{summary['sim_time']:.3f}", f"{summary['duration']:.4f}"]
+                                + [f"{summary['ms'][p]:.4f}" for p in self.phases]
+                                + [summary['calls'][p] for p in self.phases]
+                                + [summary['counters'][c] for c in self.counter_names])
+        else:
+            tmp_name = self.path + '.tmp'
+            with open(tmp_name, 'w', encoding='utf-8') as f:
+                json.dump({'window': summary, 'total_ms': self.total_ms, 'total_counters': self.total_counts}, f, indent=2)
+            os.replace(tmp_name, self.path)
+
+profiler = PhaseProfiler()
+
+# --- Просторовий Індекс (Рівномірна Сітка) ---
+# Замість перебору всіх об'єктів для кожного агента (O(n²) за кадр) об'єкти
+# розкладаються по клітинках сітки, а пошук сусідів переглядає лише клітинки поруч.
+class SpatialGrid:
+    # Ключ клітинки - одне ціле cy * KEY_ROW + cx, а не кортеж (cx, cy): ключі зберігаються
+    # для кожного об'єкта та кожної зайнятої клітинки, і для мільйонів об'єктів це суттєво
+    KEY_ROW = 1 << 20
+
+    def __init__(self, cell_size=GRID_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}    # ключ клітинки -> список об'єктів
+        self.cell_of = {}  # id(об'єкта) -> ключ клітинки, для інкрементального оновлення
+        self.checks = 0    # Переглянуто кандидатів з останнього rebuild (для профайлера)
+
+    def cell_key(self, pos):
+        return int(pos[1] // self.cell_size) * self.KEY_ROW + int(pos[0] // self.cell_size)
+
+    def rebuild(self, items):
+        self.cells = {}
+        self.cell_of = {}
+        self.checks = 0
+        for item in items:
+            if getattr(item, 'is_dead', False): continue
+            self.insert(item)
+
+    def insert(self, item):
+        key = self.cell_key(item.pos)
+        bucket = self.cells.get(key)
+        if bucket is None:
+            self.cells[key] = [item]
+        else:
+            bucket.append(item)
+        self.cell_of[id(item)] = key
+
+    def remove(self, item):
+        key = self.cell_of.pop(id(item), None)
+        if key is None: return
+        bucket = self.cells.get(key)
+        if bucket is not None:
+            try: bucket.remove(item)
+            except ValueError: pass
+            if not bucket: del self.cells[key]
+
+    def move(self, item):
+        # Викликається після зміни позиції: переносимо об'єкт, лише якщо він змінив клітинку
+        old_key = self.cell_of.get(id(item))
+        if old_key is None: return
+        if getattr(item, 'is_dead', False):
+            self.remove(item)
+            return
+        new_key = self.cell_key(item.pos)
+        if new_key != old_key:
+            self.remove(item)
+            self.insert(item)
+
+    def query_radius(self, pos, radius, exclude=None):
+        # Усі живі об'єкти в межах radius від pos (разом з квадратом відстані)
+        result = []
+        radius_sq = radius * radius
+        cs = self.cell_size
+        px, py = pos[0], pos[1]
+        cx0, cy0 = int((px - radius) // cs), int((py - radius) // cs)
+        cx1, cy1 = int((px + radius) // cs), int((py + radius) // cs)
+        cells, row = self.cells, self.KEY_ROW
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                bucket = cells.get(cy * row + cx)
+                if not bucket: continue
+                self.checks += len(bucket)
+                for item in bucket:
+                    if item is exclude or getattr(item, 'is_dead', False): continue
+                    item_pos = item.pos
+                    dx = item_pos[0] - px
+                    dy = item_pos[1] - py
+                    d_sq = dx * dx + dy * dy
+                    if d_sq < radius_sq:
+                        result.append((item, d_sq))
+        return result
+
+    def query_rect(self, x0, y0, x1, y1):
+        # Усі живі об'єкти з позицією в прямокутнику [x0, x1) x [y0, y1) - напр. видимі камерою.
+        # Якщо прямокутник накриває більше клітинок, ніж їх зайнято, перебираються зайняті.
+        cs = self.cell_size
+        cx0, cy0, cx1, cy1 = int(x0 // cs), int(y0 // cs), int(x1 // cs), int(y1 // cs)
+        row = self.KEY_ROW
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self.cells):
+            buckets = [bucket for key, bucket in self.cells.items()
+                       if cy0 <= key // row <= cy1 and cx0 <= key % row <= cx1]
+        else:
+            buckets = [self.cells[cy * row + cx] for cx, cy in itertools.product(range(cx0, cx1 + 1), range(cy0, cy1 + 1))
+                       if cy * row + cx in self.cells]
+        result = []
+        for bucket in buckets:
+            for item in bucket:
+                if getattr(item, 'is_dead', False): continue
+                x, y = item.pos
+                if x0 <= x < x1 and y0 <= y < y1:
+                    result.append(item)
+        return result
+
+    def find_closest(self, pos, radius_sq, exclude=None, predicate=None):
+        # Пошук кільцями навколо клітинки pos: зупиняємось, щойно наступне кільце
+        # гарантовано далі за вже знайденого кандидата
+        closest = None
+        min_dist_sq = radius_sq
+        if not self.cells: return None, radius_sq
+        cs = self.cell_size
+        px, py = pos[0], pos[1]
+        ccx, ccy = int(px // cs), int(py // cs)
+        max_ring = int(math.sqrt(radius_sq) // cs) + 1
+        cells, row = self.cells, self.KEY_ROW
+        for ring in range(max_ring + 1):
+            if ring > 0 and min_dist_sq <= ((ring - 1) * cs) ** 2:
+                break
+            for cx in range(ccx - ring, ccx + ring + 1):
+                edge_x = cx == ccx - ring or cx == ccx + ring
+                step = 1 if edge_x else 2 * ring
+                for cy in range(ccy - ring, ccy + ring + 1, max(step, 1)):
+                    bucket = cells.get(cy * row + cx)
+                    if not bucket: continue
+                    self.checks += len(bucket)
+                    for item in bucket:
+                        if item is exclude or getattr(item, 'is_dead', False): continue
+                        item_pos = item.pos
+                        dx = item_pos[0] - px
+                        dy = item_pos[1] - py
+                        d_sq = dx * dx + dy * dy
+                        if d_sq < min_dist_sq and (predicate is None or predicate(item)):
+                            min_dist_sq = d_sq
+                            closest = item
+        return closest, min_dist_sq
+
+class PointGrid:
+    # Незмінний масив точок, впорядкований за клітинками: запити сусідів одразу для масиву
+    # позицій (рушій NumPy) замість окремого виклику SpatialGrid на кожного агента
+    CHUNK = 16384 # Запитів за прохід: обмежує тимчасові масиви пар (запит, клітинка)
+
+    def __init__(self, points, cell_size=None):
+        self.points = points = np.asarray(points, dtype=float).reshape(-1, 2)
+        self.cell_size = cs = cell_size or GRID_CELL_SIZE
+        cells = (points // cs).astype(np.int64)
+        self.origin = cells.min(axis=0) if len(points) else np.zeros(2, np.int64)
+        cells -= self.origin
+        self.nx, self.ny = (cells.max(axis=0) + 1).tolist() if len(points) else (0, 0)
+        keys = cells[:, 1] * self.nx + cells[:, 0]
+        self.order = np.argsort(keys, kind='stable')
+        bounds = np.searchsorted(keys[self.order], np.arange(self.nx * self.ny + 1))
+        self.starts, self.counts = bounds[:-1], np.diff(bounds)
+
+    def pairs(self, queries, radius):
+        # Усі пари (запит, точка) на відстані < radius (скаляр або масив на запит):
+        # індекси запитів, індекси точок і квадрати відстаней
+        radius = np.broadcast_to(np.asarray(radius, dtype=float), len(queries))
+        found = [self._pairs(queries[start:start + self.CHUNK], radius[start:start + self.CHUNK], start)
+                 for start in range(0, len(queries) if len(self.points) else 0, self.CHUNK)]
+        if not found:
+            return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0)
+        return tuple(np.concatenate(parts) for parts in zip(*found))
+
+    def _pairs(self, queries, radius, offset):
+        # Клітинки, які перекриває квадрат навколо кожного запиту, - одним проходом для всіх запитів
+        cs = self.cell_size
+        lo = np.maximum((queries - radius[:, None]) // cs - self.origin, 0).astype(np.int64)
+        hi = np.minimum((queries + radius[:, None]) // cs - self.origin, (self.nx - 1, self.ny - 1)).astype(np.int64)
+        span = np.maximum(hi - lo + 1, 0)
+        wide, tall = int(span[:, 0].max()), int(span[:, 1].max())
+        covered = (span[:, None, None, 0] > np.arange(wide)) & (span[:, None, None, 1] > np.arange(tall)[:, None])
+        q, dy, dx = np.nonzero(covered)
+        keys = (lo[q, 1] + dy) * self.nx + lo[q, 0] + dx
+        counts = self.counts[keys]
+        total = int(counts.sum())
+        first = np.repeat(self.starts[keys] - (np.cumsum(counts) - counts), counts)
+        q = np.repeat(q, counts)
+        t = self.order[first + np.arange(total)]
+        diff = self.points[t] - queries[q]
+        d_sq = np.einsum('ij,ij->i', diff, diff)
+        near = d_sq < radius[q] ** 2
+        return q[near] + offset, t[near], d_sq[near]
+
+    def nearest(self, queries, radius, valid=None, exclude=None):
+        # Найближча точка для кожного запиту (-1 - немає ближче за radius) та квадрат відстані до неї.
+        # valid - маска допустимих точок, exclude - індекс точки, яку запит не бачить (сам агент)
+        q, t, d_sq = self.pairs(queries, radius)
+        keep = np.ones(len(q), dtype=bool)
+        if valid is not None: keep &= valid[t]
+        if exclude is not None: keep &= t != exclude[q]
+        q, t, d_sq = q[keep], t[keep], d_sq[keep]
+        order = np.lexsort((d_sq, q))
+        q, t, d_sq = q[order], t[order], d_sq[order]
+        first = np.ones(len(q), dtype=bool)
+        first[1:] = q[1:] != q[:-1]
+        closest = np.full(len(queries), -1, dtype=np.int64)
+        dist_sq = np.zeros(len(queries))
+        closest[q[first]] = t[first]
+        dist_sq[q[first]] = d_sq[first]
+        return closest, dist_sq
+
+    def separation(self, queries, radius, valid=None, exclude=None):
+        # Векторизований Agent.separation_from: сума (різниця / квадрат відстані) по сусідах
+        # у межах radius та їх кількість для кожного запиту
+        q, t, d_sq = self.pairs(queries, radius)
+        keep = d_sq > 0
+        if valid is not None: keep &= valid[t]
+        if exclude is not None: keep &= t != exclude[q]
+        q, t, d_sq = q[keep], t[keep], d_sq[keep]
+        weight = 1 / np.maximum(d_sq, 0.1)
+        diff = queries[q] - self.points[t]
+        n = len(queries)
+        vectors = np.stack([np.bincount(q, diff[:, 0] * weight, n), np.bincount(q, diff[:, 1] * weight, n)], axis=1)
+        return vectors, np.bincount(q, minlength=n)
+
+class WorldIndex:
+    # Сітки для всіх типів об'єктів; перебудовуються один раз на кадр
+    def __init__(self, cell_size=GRID_CELL_SIZE):
+        self.food = SpatialGrid(cell_size)
+        self.creatures = SpatialGrid(cell_size)
+        self.predators = SpatialGrid(cell_size)
+        self.stale = False
+
+    def rebuild(self, food_items, creature_items, predator_items):
+        self.food.rebuild(food_items)
+        self.creatures.rebuild(creature_items)
+        self.predators.rebuild(predator_items)
+        self.stale = False
+
+    def refresh(self):
+        # Рушію NumPy сітки об'єктів для кроку не потрібні (сприйняття - PointGrid): після кроку
+        # індекс лише позначається застарілим і перебудовується перед першим запитом рендерера чи кліку
+        if self.stale:
+            self.rebuild(food_list, creatures, predators)
+
+    def neighbor_checks(self):
+        return self.food.checks + self.creatures.checks + self.predators.checks
+
+# --- Карта Зайнятості Перешкодами ---
+# Для кожного радіуса об'єкта світ ділиться на клітинки: вільні, повністю зайняті та граничні.
+# Перевірка "чи заблоковано коло" - один доступ до масиву (лише граничні клітинки точно
+# перевіряють кілька прямокутників), а вільні позиції вибираються прямо зі списку вільних клітинок.
+class RadiusOccupancy:
+    FREE, BLOCKED, EDGE = 0, 1, 2
+
+    def __init__(self, obstacles, radius, cell_size):
+        self.cell_size = cs = cell_size
+        self.radius = radius
+        self.nx, self.ny = max(1, math.ceil(WIDTH / cs)), max(1, math.ceil(HEIGHT / cs))
+        self.state = np.zeros((self.ny, self.nx), dtype=np.int8)
+        self.edge_rects = {} # (cx, cy) -> розширені прямокутники, що частково покривають клітинку
+        r = radius
+        size = int(radius * 2)
+        for obs in obstacles:
+            # Квадрат агента - pygame.Rect(x - r, y - r, 2r, 2r), а pygame обрізає координати до цілих:
+            # лівий край int(x - r), тож перетин з перешкодою (при x, y >= r) - рівно тоді, коли центр
+            # лежить у напіввідкритому прямокутнику [left - size + 1 + r, right + r) (так само по y)
+            x1, y1 = obs.rect.left - size + 1 + r, obs.rect.top - size + 1 + r
+            x2, y2 = obs.rect.right + r, obs.rect.bottom + r
+            tx0, tx1 = max(0, int(x1 // cs)), min(self.nx, math.ceil(x2 / cs))
+            ty0, ty1 = max(0, int(y1 // cs)), min(self.ny, math.ceil(y2 / cs))
+            fx0, fx1 = max(0, math.ceil(x1 / cs)), min(self.nx, int(x2 // cs))
+            fy0, fy1 = max(0, math.ceil(y1 / cs)), min(self.ny, int(y2 // cs))
+            inflated = (x1, y1, x2, y2)
+            for cy in range(ty0, ty1):
+                inner_row = fy0 <= cy < fy1
+                for cx in range(tx0, tx1):
+                    if inner_row and fx0 <= cx < fx1: continue
+                    self.edge_rects.setdefault((cx, cy), []).append(inflated)
+            region = self.state[ty0:ty1, tx0:tx1]
+            region[region == self.FREE] = self.EDGE
+            if fx1 > fx0 and fy1 > fy0:
+                self.state[fy0:fy1, fx0:fx1] = self.BLOCKED
+        # Вільні клітинки, що перетинають допустиму область центрів [r, WIDTH - r] x [r, HEIGHT - r]
+        xs = np.arange(self.nx) * cs
+        ys = np.arange(self.ny) * cs
+        self.in_x = (xs + cs > r) & (xs < WIDTH - r)
+        in_y = (ys + cs > r) & (ys < HEIGHT - r)
+        # Лише кількість вільних клітинок наростаючим підсумком по рядках (а не список усіх
+        # вільних клітинок): пам'ять O(ny) замість O(nx * ny) для великих світів
+        free_rows = ((self.state == self.FREE) & self.in_x[None, :]).sum(axis=1) * in_y
+        self.free_ends = np.cumsum(free_rows)
+
+    def blocked(self, x, y):
+        cx, cy = int(x // self.cell_size), int(y // self.cell_size)
+        if not (0 <= cx < self.nx and 0 <= cy < self.ny): return False
+        state = self.state[cy, cx]
+        if state == self.FREE: return False
+        if state == self.BLOCKED: return True
+        for x1, y1, x2, y2 in self.edge_rects.get((cx, cy), ()):
+            if x1 <= x < x2 and y1 <= y < y2:
+                return True
+        return False
+
+    def blocked_points(self, pos):
+        # blocked для масиву центрів (n, 2): точно (прямокутниками) перевіряються лише граничні клітинки
+        cx = (pos[:, 0] // self.cell_size).astype(np.int64)
+        cy = (pos[:, 1] // self.cell_size).astype(np.int64)
+        inside = (cx >= 0) & (cx < self.nx) & (cy >= 0) & (cy < self.ny)
+        state = np.full(len(pos), self.FREE, dtype=np.int8)
+        state[inside] = self.state[cy[inside], cx[inside]]
+        blocked = state == self.BLOCKED
+        for i in np.flatnonzero(state == self.EDGE).tolist():
+            blocked[i] = self.blocked(pos[i, 0], pos[i, 1])
+        return blocked
+
+    def sample_free(self):
+        # Рівномірна точка у випадковій повністю вільній клітинці (None, якщо таких немає).
+        # k-та вільна клітинка в порядку рядків: рядок - бінарним пошуком, стовпчик - у його рядку
+        total = int(self.free_ends[-1])
+        if not total: return None
+        cs, r = self.cell_size, self.radius
+        k = random.randrange(total)
+        cy = int(np.searchsorted(self.free_ends, k, side='right'))
+        if cy: k -= int(self.free_ends[cy - 1])
+        cx = int(np.flatnonzero((self.state[cy] == self.FREE) & self.in_x)[k])
+        x = clamp(random.uniform(cx * cs, (cx + 1) * cs), r, WIDTH - r)
+        y = clamp(random.uniform(cy * cs, (cy + 1) * cs), r, HEIGHT - r)
+        return pygame.Vector2(x, y)
+
+class ObstacleMap:
+    # Карти зайнятості для поточного списку перешкод; карта для радіуса будується при першому запиті
+    def __init__(self, cell_size=OBSTACLE_MAP_CELL_SIZE):
+        self.base_cell_size = self.cell_size = cell_size
+        self.source = None
+        self.count = 0
+        self.by_radius = {}
+
+    def build(self, obstacles):
+        self.source = obstacles
+        self.count = len(obstacles)
+        # Пам'ять карти росте з площею світу: для дуже великих світів клітинки більші
+        self.cell_size = max(self.base_cell_size, math.ceil(math.sqrt(WIDTH * HEIGHT / OBSTACLE_MAP_MAX_CELLS)))
+        self.by_radius = {}
+
+    def covers(self, obstacles):
+        # Карта відповідає саме цьому списку (інакше - запасний повний перебір)
+        return obstacles is self.source and len(obstacles) == self.count
+
+    def for_radius(self, radius):
+        occupancy = self.by_radius.get(radius)
+        if occupancy is None:
+            occupancy = RadiusOccupancy(self.source, radius, self.cell_size)
+            self.by_radius[radius] = occupancy
+        return occupancy
+
+    def blocked(self, pos, radius):
+        return self.for_radius(radius).blocked(pos[0], pos[1])
+
+obstacle_map = ObstacleMap()
+
+def random_free_position(obstacles, radius):
+    # Випадкова позиція центру, де об'єкт радіуса radius не торкається перешкод
+    if obstacles and obstacle_map.covers(obstacles):
+        pos = obstacle_map.for_radius(radius).sample_free()
+        if pos is not None: return pos
+    while True:
+        pos = pygame.Vector2(random.randint(radius, WIDTH - radius), random.randint(radius, HEIGHT - radius))
+        rect = pygame.Rect(pos.x - radius, pos.y - radius, radius * 2, radius * 2)
+        if not obstacles or not any(obs.rect.colliderect(rect) for obs in obstacles):
+            return pos
+
+# --- Стабільні Дескриптори (Handles) ---
+# Кожна їжа/істота/хижак отримує ціле число: індекс слоту + лічильник поколінь слоту.
+# Після видалення об'єкта покоління слоту зростає, тож старий дескриптор більше не
+# розіменовується - ціль перевіряється за O(1) замість пошуку у списку.
+class HandleTable:
+    INDEX_BITS = 32
+    INDEX_MASK = (1 << INDEX_BITS) - 1
+
+    def __init__(self):
+        self.objects = []
+        self.generations = []
+        self.free = []
+
+    def register(self, obj):
+        if self.free:
+            index = self.free.pop()
+        else:
+            index = len(self.objects)
+            self.objects.append(None)
+            self.generations.append(0)
+        self.objects[index] = obj
+        return (self.generations[index] << self.INDEX_BITS) | index
+
+    def get(self, handle):
+        # Об'єкт за дескриптором або None, якщо його вже видалено
+        if handle is None: return None
+        index = handle & self.INDEX_MASK
+        if index >= len(self.objects) or self.generations[index] != handle >> self.INDEX_BITS:
+            return None
+        return self.objects[index]
+
+    def lookup(self, handles, targets):
+        # Для масиву дескрипторів - індекс кожного в масиві дескрипторів targets (-1: немає серед них
+        # або дескриптор застарів)
+        table = np.full(len(self.objects), -1, dtype=np.int64)
+        table[targets & self.INDEX_MASK] = np.arange(len(targets))
+        rows = np.full(len(handles), -1, dtype=np.int64)
+        known = (handles != NO_HANDLE) & ((handles & self.INDEX_MASK) < len(table))
+        rows[known] = table[handles[known] & self.INDEX_MASK]
+        found = rows >= 0
+        found[found] = targets[rows[found]] == handles[found]
+        rows[~found] = -1
+        return rows
+
+    def release(self, handle):
+        if self.get(handle) is None: return
+        index = handle & self.INDEX_MASK
+        self.objects[index] = None
+        self.generations[index] += 1
+        self.free.append(index)
+
+    def clear(self):
+        # Новий світ: нумерація починається заново, тож однаковий seed дає однакові дескриптори.
+        # Об'єкти старого світу недосяжні з нового, а знімки перепризначають посилання при завантаженні.
+        self.objects = []
+        self.generations = []
+        self.free = []
+
+    def export_state(self):
+        # Покоління слотів і список вільних слотів - для знімка
+        return np.array(self.generations, dtype=np.int64), np.array(self.free, dtype=np.int64)
+
+    def import_state(self, generations, free):
+        # Після цього об'єкти повертаються на свої збережені дескриптори через place()
+        self.generations = [int(g) for g in generations]
+        self.objects = [None] * len(self.generations)
+        self.free = [int(i) for i in free]
+
+    def place(self, handle, obj):
+        index = handle & self.INDEX_MASK
+        if self.generations[index] != handle >> self.INDEX_BITS:
+            raise ValueError(f"Дескриптор {handle} не відповідає таблиці")
+        self.objects[index] = obj
+        return handle
+
+    def place_many(self, handles, objects):
+        # Пакетний place() для масиву дескрипторів: покоління перевіряються одним порівнянням
+        index = handles & self.INDEX_MASK
+        if not np.array_equal(np.asarray(self.generations, dtype=np.int64)[index], handles >> self.INDEX_BITS):
+            raise ValueError("Дескриптори знімка не відповідають таблиці")
+        table = self.objects
+        for i, obj in zip(index.tolist(), objects): table[i] = obj
+
+    def __len__(self):
+        return len(self.objects) - len(self.free)
+
+entity_handles = HandleTable()
+
+def handle_ref(name):
+    # Атрибут-посилання на інший об'єкт: зберігається лише дескриптор (слот name + '_handle'),
+    # а читання повертає об'єкт або None, якщо його вже прибрано зі світу
+    key = name + '_handle'
+    def fget(self):
+        return entity_handles.get(getattr(self, key, None))
+    def fset(self, value):
+        setattr(self, key, value.handle if value is not None else None)
+    return property(fget, fset)
+
+class SpeciesConstant:
+    # Однакове для всього виду значення (радіус, колір) - атрибут класу замість копії в кожному
+    # об'єкті. Читається з глобального параметра при доступі, тож перевизначення (sweep) діють одразу
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, obj, owner=None):
+        return globals()[self.name]
+
+# --- Телеметрія (Ряди Статистики) ---
+# Усі ряди лежать в одному буфері NumPy (ряд x точка), тож кожен ряд - неперервний рядок,
+# а читач отримує його зріз без копіювання. Без каталогу буфер подвоюється при заповненні.
+# З каталогом заповнений блок з chunk точок запечатується у сегмент telemetry_NNNNNN.npy
+# і далі читається через memmap, а буфер починається спочатку - пам'ять не зростає.
+class TelemetryStore:
+    SEGMENT_FORMAT = "telemetry_{seq:06d}.npy"
+
+    def __init__(self, names, capacity=TELEMETRY_CAPACITY, chunk=TELEMETRY_CHUNK, directory=None):
+        self.names = tuple(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.initial_capacity = capacity
+        self.chunk = chunk
+        self.directory = None
+        self.segments = []  # memmap-масиви (ряд x chunk) запечатаних сегментів
+        self.buffer = np.empty((len(self.names), capacity))
+        self.size = 0
+        self.epoch = 0  # зростає при clear(): читачі бачать, що історія почалась заново
+        self.set_directory(directory)
+
+    def set_directory(self, directory):
+        # Змінювати каталог можна лише поки нічого не запечатано
+        if self.segments:
+            raise RuntimeError("Телеметрія вже має сегменти на диску")
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._reserve(self.chunk)
+
+    def _reserve(self, capacity):
+        if capacity > self.buffer.shape[1]:
+            grown = np.empty((len(self.names), capacity))
+            grown[:, :self.size] = self.buffer[:, :self.size]
+            self.buffer = grown
+
+    def _seal(self):
+        filename = os.path.join(self.directory, self.SEGMENT_FORMAT.format(seq=len(self.segments)))
+        np.save(filename, self.buffer[:, :self.size])
+        self.segments.append(np.load(filename, mmap_mode='r'))
+        self.size = 0
+
+    def append(self, **values):
+        if self.size == self.buffer.shape[1]:
+            if self.directory is not None: self._seal()
+            else: self._reserve(2 * self.size)
+        column = self.buffer[:, self.size]
+        for name, value in values.items():
+            column[self.index[name]] = value
+        self.size += 1
+
+    def extend(self, columns):
+        # Дописує цілі ряди однакової довжини (завантаження збережень)
+        total = len(next(iter(columns.values()), ()))
+        if self.directory is None: self._reserve(self.size + total)
+        done = 0
+        while done < total:
+            if self.size == self.buffer.shape[1]:
+                if self.directory is not None: self._seal()
+                else: self._reserve(2 * self.size)
+            n = min(total - done, self.buffer.shape[1] - self.size)
+            for name, values in columns.items():
+                self.buffer[self.index[name], self.size:self.size + n] = values[done:done + n]
+            self.size += n
+            done += n
+
+    def parts(self, name):
+        # Ряд частинами без копіювання: рядки сегментів (memmap) + зріз живого буфера
+        i = self.index[name]
+        return [seg[i] for seg in self.segments] + [self.buffer[i, :self.size]]
+
+    def series(self, name):
+        # Поки немає сегментів - це view буфера (дійсний до наступного append/clear)
+        if not self.segments:
+            return self.buffer[self.index[name], :self.size]
+        return np.concatenate(self.parts(name))
+
+    def tail(self, name, n):
+        # Останні n точок ряду; з сегментів читаються лише потрібні кінці
+        i = self.index[name]
+        parts = [self.buffer[i, max(0, self.size - n):self.size]]
+        need = n - len(parts[0])
+        for seg in reversed(self.segments):
+            if need <= 0: break
+            parts.insert(0, seg[i, max(0, seg.shape[1] - need):])
+            need -= len(parts[0])
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def last(self, name, default=None):
+        if self.size: return self.buffer[self.index[name], self.size - 1]
+        if self.segments: return self.segments[-1][self.index[name], -1]
+        return default
+
+    def __len__(self):
+        return sum(seg.shape[1] for seg in self.segments) + self.size
+
+    def clear(self):
+        # Новий світ: сегменти попереднього запуску видаляються з диска
+        for seq in range(len(self.segments)):
+            try: os.remove(os.path.join(self.directory, self.SEGMENT_FORMAT.format(seq=seq)))
+            except OSError: pass
+        self.segments = []
+        self.size = 0
+        self.epoch += 1
+        self.buffer = np.empty((len(self.names), self.chunk if self.directory is not None
+                                else self.initial_capacity))
+
+    def load_series(self, columns):
+        # Ряди, яких немає у старому збереженні, заповнюються NaN
+        self.clear()
+        length = len(columns.get(self.names[0], ()))
+        self.extend({name: np.asarray(columns[name], dtype=float) if name in columns else np.full(length, np.nan)
+                     for name in self.names})
+
+telemetry = TelemetryStore(TELEMETRY_SERIES)
+
+# --- Потокова Статистика Генів ---
+# Моменти (Велфорд) та гістограми генів оновлюються пачками при народженні та смерті агентів,
+# тож запис статистики раз на log_interval коштує O(1), а не прохід по всій популяції.
+# Пачки об'єднуються формулою Чана; видалення - обернене об'єднання. Квантилі наближені:
+# лінійна інтерполяція всередині кошика гістограми.
+class GeneStatistics:
+    def __init__(self, ranges, bins=GENE_HIST_BINS):
+        self.bins = bins
+        self.set_ranges(ranges)
+
+    def set_ranges(self, ranges):
+        # ranges: {ген: (мін, макс)} у порядку GENE_NAMES; гістограма починається спочатку
+        self.names = tuple(ranges)
+        self.low = np.array([ranges[g][0] for g in self.names], dtype=float)
+        self.high = np.array([ranges[g][1] for g in self.names], dtype=float)
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = np.zeros(len(self.names))
+        self.m2 = np.zeros(len(self.names))
+        self.hist = np.zeros((len(self.names), self.bins), dtype=np.int64)
+
+    def _bin_index(self, values):
+        scaled = (values - self.low) / (self.high - self.low) * self.bins
+        return np.clip(scaled.astype(np.int64), 0, self.bins - 1)
+
+    def _update_hist(self, values, sign):
+        index = self._bin_index(values)
+        for g in range(len(self.names)):
+            self.hist[g] += sign * np.bincount(index[:, g], minlength=self.bins)
+
+    def add(self, values):
+        # values: масив (n, кількість генів)
+        n = len(values)
+        if not n: return
+        batch_mean = values.mean(axis=0)
+        self.merge(n, batch_mean, ((values - batch_mean) ** 2).sum(axis=0))
+        self._update_hist(values, 1)
+
+    def merge(self, n, batch_mean, batch_m2, hist=None):
+        # Об'єднання з готовими моментами іншої вибірки (напр. тайлу іншого процесу)
+        if not n: return
+        total = self.count + n
+        delta = batch_mean - self.mean
+        self.mean = self.mean + delta * (n / total)
+        self.m2 = self.m2 + batch_m2 + delta ** 2 * (self.count * n / total)
+        self.count = total
+        if hist is not None: self.hist += hist
+
+    def remove(self, values):
+        n = len(values)
+        if not n: return
+        rest = self.count - n
+        if rest <= 0:
+            self.reset()
+            return
+        batch_mean = values.mean(axis=0)
+        batch_m2 = ((values - batch_mean) ** 2).sum(axis=0)
+        rest_mean = (self.mean * self.count - batch_mean * n) / rest
+        delta = batch_mean - rest_mean
+        self.m2 = np.maximum(self.m2 - batch_m2 - delta ** 2 * (rest * n / self.count), 0.0)
+        self.mean = rest_mean
+        self.count = rest
+        self._update_hist(values, -1)
+
+    def rebuild(self, values):
+        self.reset()
+        self.add(values)
+
+    def gene_mean(self, gene):
+        return float(self.mean[self.names.index(gene)]) if self.count else 0.0
+
+    def variance(self, gene):
+        return float(self.m2[self.names.index(gene)] / self.count) if self.count else 0.0
+
+    def std(self, gene):
+        return self.variance(gene) ** 0.5
+
+    def histogram(self, gene):
+        # Лічильники кошиків та межі кошиків
+        g = self.names.index(gene)
+        return self.hist[g], np.linspace(self.low[g], self.high[g], self.bins + 1)
+
+    def quantile(self, gene, q):
+        return float(self.quantiles([q])[self.names.index(gene), 0])
+
+    def quantiles(self, qs):
+        # Квантилі всіх генів одразу: масив (гени x len(qs))
+        qs = np.asarray(qs, dtype=float)
+        result = np.zeros((len(self.names), len(qs)))
+        if not self.count: return result
+        cumulative = np.cumsum(self.hist, axis=1)
+        target = qs * self.count
+        width = (self.high - self.low) / self.bins
+        for g in range(len(self.names)):
+            b = np.minimum(np.searchsorted(cumulative[g], target), self.bins - 1)
+            before = np.where(b > 0, cumulative[g][b - 1], 0)
+            counts = self.hist[g][b]
+            fraction = np.divide(target - before, counts, out=np.zeros(len(qs)), where=counts > 0)
+            result[g] = self.low[g] + (b + fraction) * width[g]
+        return result
+
+creature_gene_stats = GeneStatistics(creature_genome().ranges())
+predator_gene_stats = GeneStatistics(predator_genome().ranges())
+
+# --- Родовід (Lineage) ---
+# Кожне народження отримує id (зростаючий) і рядок у таблиці: батьки, корінь клади (засновник
+# по лінії першого батька), вид, час народження/смерті та гени. id рядків відсортовані, тож
+# пошук рядка - searchsorted. Записи без живих нащадків періодично обрізаються: лишаються
+# живі та їхні предки, тож пам'ять обмежена живою популяцією та її родоводом.
+NO_LINEAGE = -1
+
+class LineageTracker:
+    SPECIES = ('creature', 'predator')
+
+    # ім'я поля -> (ширина рядка або 0 для скаляра, тип)
+    FIELDS = {
+        'id': (0, np.int64),
+        'parents': (2, np.int64),
+        'root': (0, np.int64),
+        'species': (0, np.int8),
+        'born': (0, float),
+        'died': (0, float), # NaN - живий
+        'genes': (len(GENE_NAMES), float),
+    }
+
+    def __init__(self, capacity=1024, id_base=0):
+        self.initial_capacity = capacity
+        self.id_base = id_base # Перший ідентифікатор; тайли отримують неперетинні діапазони
+        self.clear()
+
+    def clear(self):
+        self.count = 0
+        self.next_id = self.id_base
+        self.kept_after_prune = 0
+        self.capacity = 0
+        self._allocate(self.initial_capacity)
+
+    def _allocate(self, capacity):
+        for name, (width, dtype) in self.FIELDS.items():
+            arr = np.zeros((capacity, width) if width else capacity, dtype=dtype)
+            if self.count:
+                arr[:self.count] = getattr(self, name)[:self.count]
+            setattr(self, name, arr)
+        self.capacity = capacity
+
+    def __len__(self):
+        return self.count
+
+    def rows(self, ids):
+        # Рядки за id; -1 для відсутніх (обрізаних або NO_LINEAGE)
+        ids = np.asarray(ids, dtype=np.int64)
+        if not self.count: return np.full(ids.shape, -1, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(self.id[:self.count], ids), self.count - 1)
+        return np.where(self.id[rows] == ids, rows, -1)
+
+    def birth(self, species, genes, parent1=NO_LINEAGE, parent2=NO_LINEAGE, time=0.0):
+        if self.count == self.capacity:
+            self._allocate(self.capacity * 2)
+        row, lineage_id = self.count, self.next_id
+        parent_row = self.rows(parent1) if parent1 != NO_LINEAGE else -1
+        self.id[row] = lineage_id
+        self.parents[row] = (parent1, parent2)
+        self.root[row] = self.root[parent_row] if parent_row >= 0 else lineage_id
+        self.species[row] = self.SPECIES.index(species)
+        self.born[row] = time
+        self.died[row] = np.nan
+        self.genes[row] = genes
+        self.count += 1
+        self.next_id += 1
+        return lineage_id
+
+    def found(self, species, genes, time=0.0):
+        # Пачка засновників без батьків (початковий світ); повертає їхні id
+        return self._append(species, genes, NO_LINEAGE, None, time)
+
+    def arrive(self, species, genes, previous, roots, born):
+        # Агенти, що прийшли з іншого тайлу: новий рядок з локальним id, батько - їхній рядок у
+        # попередньому тайлі, клада та час народження переносяться. Нащадки, народжені тут,
+        # належать тій самій кладі. Повертає нові id
+        return self._append(species, genes, previous, roots, born)
+
+    def _append(self, species, genes, parent, roots, born):
+        n = len(genes)
+        capacity = self.capacity
+        while self.count + n > capacity: capacity *= 2
+        if capacity != self.capacity: self._allocate(capacity)
+        rows = slice(self.count, self.count + n)
+        ids = np.arange(self.next_id, self.next_id + n, dtype=np.int64)
+        self.id[rows] = ids
+        self.parents[rows] = NO_LINEAGE
+        self.parents[rows, 0] = parent
+        self.root[rows] = ids if roots is None else np.where(np.asarray(roots) == NO_LINEAGE, ids, roots)
+        self.species[rows] = self.SPECIES.index(species)
+        self.born[rows] = born
+        self.died[rows] = np.nan
+        self.genes[rows] = genes
+        self.count += n
+        self.next_id += n
+        return ids
+
+    def die(self, ids, time):
+        rows = self.rows(ids)
+        self.died[rows[rows >= 0]] = time
+
+    def alive_rows(self):
+        return np.flatnonzero(np.isnan(self.died[:self.count]))
+
+    def _walk_up(self, rows, max_depth=None):
+        # Предки рядків rows по поколіннях (обидва батьки): список масивів рядків, найближчі першими
+        seen = np.zeros(self.count, dtype=bool)
+        levels = []
+        frontier = rows
+        while len(frontier) and (max_depth is None or len(levels) < max_depth):
+            parents = self.parents[frontier].ravel()
+            found = self.rows(parents[parents != NO_LINEAGE])
+            found = np.unique(found[found >= 0])
+            frontier = found[~seen[found]]
+            seen[frontier] = True
+            if len(frontier): levels.append(frontier)
+        return levels
+
+    def ancestry(self, lineage_id, max_depth=None):
+        # id предків агента: спершу батьки, потім діди і т.д.
+        rows = self.rows([lineage_id])
+        levels = self._walk_up(rows[rows >= 0], max_depth)
+        return self.id[np.concatenate(levels)] if levels else np.empty(0, dtype=np.int64)
+
+    def surviving_clades(self, species=None):
+        # Клади (id засновника) з живими нащадками та кількість живих, найбільші першими
+        rows = self.alive_rows()
+        if species is not None:
+            rows = rows[self.species[rows] == self.SPECIES.index(species)]
+        roots, counts = np.unique(self.root[rows], return_counts=True)
+        order = np.argsort(-counts, kind='stable')
+        return roots[order], counts[order]
+
+    def prune(self):
+        # Лишаються живі та всі їхні предки; порядок (і сортування за id) зберігається
+        alive = self.alive_rows()
+        keep = np.zeros(self.count, dtype=bool)
+        keep[alive] = True
+        for level in self._walk_up(alive):
+            keep[level] = True
+        kept = np.flatnonzero(keep)
+        for name in self.FIELDS:
+            arr = getattr(self, name)
+            arr[:len(kept)] = arr[kept]
+        removed = self.count - len(kept)
+        self.count = len(kept)
+        self.kept_after_prune = self.count
+        return removed
+
+    def maybe_prune(self):
+        if self.count >= max(LINEAGE_PRUNE_MIN, LINEAGE_PRUNE_GROWTH * self.kept_after_prune):
+            return self.prune()
+        return 0
+
+    def export_state(self):
+        data = {'lineage.' + name: getattr(self, name)[:self.count].copy() for name in self.FIELDS}
+        data['lineage.next_id'] = np.array(self.next_id)
+        return data
+
+    def import_state(self, data):
+        self.clear()
+        n = len(data['lineage.id'])
+        capacity = self.capacity
+        while n > capacity: capacity *= 2
+        self._allocate(capacity)
+        for name in self.FIELDS:
+            getattr(self, name)[:n] = data['lineage.' + name]
+        self.count = self.kept_after_prune = n
+        self.next_id = int(data['lineage.next_id'])
+
+lineage = LineageTracker()
+
+# --- Кеш Спрайтів ---
+# Ореол чутливості та тіло агента малюються один раз на (квантований радіус, колір)
+# і потім лише блітяться, замість створення нової Surface для кожного агента щокадру.
+def quantize_color(color):
+    return tuple(min(255, int(round(ch / COLOR_QUANTUM)) * COLOR_QUANTUM) for ch in color[:3])
+
+class SpriteCache:
+    # Обмеження - у байтах поверхонь, а не в кількості: спрайт ореолу росте з квадратом масштабу
+    def __init__(self, max_bytes=SPRITE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.sprites = OrderedDict()
+
+    def _get(self, key, factory):
+        sprite = self.sprites.get(key)
+        if sprite is not None:
+            self.sprites.move_to_end(key)
+            return sprite
+        sprite = factory()
+        profiler.count('sprites_built')
+        if pygame.display.get_surface() is not None:
+            sprite = sprite.convert_alpha()
+        self.sprites[key] = sprite
+        self.bytes += self.sprite_bytes(sprite)
+        # Щойно побудований спрайт лишається, навіть якщо сам більший за ліміт
+        while self.bytes > self.max_bytes and len(self.sprites) > 1:
+            _, old = self.sprites.popitem(last=False)
+            self.bytes -= self.sprite_bytes(old)
+        return sprite
+
+    @staticmethod
+    def sprite_bytes(sprite):
+        return sprite.get_pitch() * sprite.get_height()
+
+    @staticmethod
+    def _circle_sprite(radius, color):
+        # Коло з центром (radius + 1, radius + 1) на прозорому тлі
+        size = radius * 2 + 2
+        sprite = pygame.Surface((size, size), pygame.SRCALPHA)
+        pygame.draw.circle(sprite, color, (radius + 1, radius + 1), radius)
+        return sprite
+
+    def halo(self, sense_radius, color):
+        radius = max(1, int(round(sense_radius / HALO_RADIUS_QUANTUM)) * HALO_RADIUS_QUANTUM)
+        rgb = quantize_color(color)
+        return self._get(('halo', radius, rgb),
+                         lambda: self._circle_sprite(radius, (*rgb, SENSE_HALO_ALPHA)))
+
+    def body(self, radius, color):
+        radius = int(radius)
+        rgb = quantize_color(color)
+        return self._get(('body', radius, rgb), lambda: self._circle_sprite(radius, rgb))
+
+sprite_cache = SpriteCache()
+
+# --- Камера ---
+# Видима область світу та масштаб. Рендерер перетворює координати світу в екранні лише для
+# об'єктів, які просторовий індекс знаходить у видимій області, тож вартість кадру залежить
+# від того, що видно, а не від розміру світу.
+class Camera:
+    def __init__(self):
+        self.x, self.y = 0.0, 0.0 # Точка світу в лівому верхньому куті вікна
+        self.zoom = 1.0
+        self.version = 0 # Змінюється з кожним рухом камери - шари рендерера будуються заново
+
+    def min_zoom(self):
+        return min(1.0, SCREEN_WIDTH / WIDTH, SCREEN_HEIGHT / HEIGHT)
+
+    def set(self, x, y, zoom):
+        # Видима область не виходить за межі світу; світ, менший за вікно, - по центру
+        zoom = clamp(zoom, self.min_zoom(), CAMERA_MAX_ZOOM)
+        view_w, view_h = SCREEN_WIDTH / zoom, SCREEN_HEIGHT / zoom
+        x = (WIDTH - view_w) / 2 if view_w >= WIDTH else clamp(x, 0, WIDTH - view_w)
+        y = (HEIGHT - view_h) / 2 if view_h >= HEIGHT else clamp(y, 0, HEIGHT - view_h)
+        if (x, y, zoom) != (self.x, self.y, self.zoom):
+            self.x, self.y, self.zoom = x, y, zoom
+            self.version += 1
+
+    def reset(self):
+        self.set(0.0, 0.0, 1.0)
+
+    def fit(self):
+        # Увесь світ у вікні
+        self.set(0.0, 0.0, self.min_zoom())
+
+    def pan(self, dx, dy):
+        # Зсув у пікселях екрана
+        self.set(self.x + dx / self.zoom, self.y + dy / self.zoom, self.zoom)
+
+    def zoom_at(self, factor, screen_pos):
+        # Точка світу під курсором лишається на місці
+        wx, wy = self.to_world(screen_pos)
+        zoom = clamp(self.zoom * factor, self.min_zoom(), CAMERA_MAX_ZOOM)
+        self.set(wx - screen_pos[0] / zoom, wy - screen_pos[1] / zoom, zoom)
+
+    def to_world(self, screen_pos):
+        return pygame.Vector2(self.x + screen_pos[0] / self.zoom, self.y + screen_pos[1] / self.zoom)
+
+    def to_screen(self, pos):
+        return ((pos[0] - self.x) * self.zoom, (pos[1] - self.y) * self.zoom)
+
+    def rect_to_screen(self, rect):
+        z = self.zoom
+        x0, y0 = round((rect.left - self.x) * z), round((rect.top - self.y) * z)
+        x1, y1 = round((rect.right - self.x) * z), round((rect.bottom - self.y) * z)
+        return pygame.Rect(x0, y0, max(1, x1 - x0), max(1, y1 - y0))
+
+    def visible_bounds(self, margin=0):
+        # Видима область світу (x0, y0, x1, y1), розширена на margin одиниць світу
+        return (self.x - margin, self.y - margin,
+                self.x + SCREEN_WIDTH / self.zoom + margin, self.y + SCREEN_HEIGHT / self.zoom + margin)
+
+    def visible_rect(self):
+        x0, y0, x1, y1 = self.visible_bounds()
+        return pygame.Rect(math.floor(x0), math.floor(y0), math.ceil(x1 - x0) + 1, math.ceil(y1 - y0) + 1)
+
+camera = Camera()
+
+# --- Шари Рендерингу ---
+# Перешкоди запікаються у статичне тло, їжа живе на окремому шарі, що перемальовується
+# лише після поїдання/появи їжі, а на екран виводяться тільки змінені прямокутники
+# (pygame.display.update(rects)) - вартість кадру залежить від активності, а не від розміру вікна.
+class HudTextCache:
+    # Відрендерений текст для кожного слоту HUD; FONT.render викликається лише при зміні тексту
+    def __init__(self):
+        self.slots = {}
+
+    def render(self, slot, font, text, color):
+        cached = self.slots.get(slot)
+        if cached is not None and cached[0] == (text, color):
+            return cached[1]
+        surface = font.render(text, True, color)
+        self.slots[slot] = ((text, color), surface)
+        return surface
+
+    def clear(self):
+        self.slots = {}
+
+class LayeredRenderer:
+    def __init__(self):
+        self.background = None # Тло + перешкоди
+        self.food_layer = None # Тло + перешкоди + їжа
+        self.food_dirty = True
+        self.food_rects = []   # Області, де з'явилась/зникла їжа з останнього кадру
+        self.prev_rects = []   # Що було намальовано поверх шару їжі минулого кадру
+        self.full_update = True
+        self.camera_version = None # Положення камери, для якого побудовано шари
+        self.food_lod = None # Рівень деталізації, з яким намальовано шар їжі
+
+    def invalidate(self):
+        # Новий світ або завантаження: тло та шар їжі будуються заново
+        self.background = None
+        self.food_layer = None
+        self.food_dirty = True
+        self.food_rects = []
+        self.full_update = True
+
+    def request_full_update(self):
+        # Напр., вікно було перекрите: наступний кадр виводиться повністю
+        self.full_update = True
+
+    def mark_food(self, item):
+        # Викликається, коли їжа з'їдена або з'явилась. Поки шарів немає (headless), нічого не робить.
+        if self.food_layer is None: return
+        self.food_dirty = True
+        if self.full_update: return
+        if len(self.food_rects) < MAX_DIRTY_RECTS:
+            self.food_rects.append(camera.rect_to_screen(item.rect).inflate(4, 4))
+        else:
+            self.full_update = True
+
+    def _build_background(self, surface):
+        background = pygame.Surface(surface.get_size())
+        if pygame.display.get_surface() is not None:
+            background = background.convert()
+        background.fill(BG_COLOR)
+        visible = camera.visible_rect()
+        for obs in obstacles:
+            if obs.rect.colliderect(visible): obs.draw(background, camera)
+        self.background = background
+        self.camera_version = camera.version
+        self.food_layer = background.copy()
+        self.food_dirty = True
+
+    def _refresh_food_layer(self):
+        # Лише їжа у видимій області (з просторового індексу), а не весь список;
+        # з рівня деталізації "пікселі" - по пікселю на одиницю їжі
+        self.food_layer.blit(self.background, (0, 0))
+        world_index.refresh()
+        visible = world_index.food.query_rect(*camera.visible_bounds(FOOD_RADIUS))
+        if lod.level >= LOD_PIXELS:
+            draw_pixels(self.food_layer, [positions(visible)], [FOOD_COLOR])
+        else:
+            for f in visible: f.draw(self.food_layer, camera)
+        self.food_dirty = False
+        self.food_lod = lod.level
+
+    def render(self, surface, draw_overlays):
+        # draw_overlays(surface) малює агентів та HUD і повертає список змінених прямокутників
+        if (self.background is None or self.background.get_size() != surface.get_size()
+                or self.camera_version != camera.version):
+            self._build_background(surface)
+            self.full_update = True
+        if self.food_dirty or self.food_lod != lod.level:
+            if self.food_lod != lod.level: self.full_update = True
+            self._refresh_food_layer()
+
+        full = self.full_update
+        food_layer = self.food_layer
+        if full:
+            surface.blit(food_layer, (0, 0))
+            erased = []
+        else:
+            # Стираємо минулий кадр і зміни їжі, відновлюючи ці області з шару їжі
+            erased = self.prev_rects + self.food_rects
+            surface.blits([(food_layer, r, r) for r in erased], doreturn=False)
+
+        drawn = draw_overlays(surface)
+        self.prev_rects = drawn
+        self.food_rects = []
+        self.full_update = False
+
+        if not full:
+            dirty = erased + drawn
+            area = sum(r.width * r.height for r in dirty)
+            full = len(dirty) > MAX_DIRTY_RECTS or area > surface.get_width() * surface.get_height() * DIRTY_AREA_FULL_UPDATE
+        if full:
+            pygame.display.flip()
+        else:
+            pygame.display.update(dirty)
+
+# --- Рівні Деталізації (LOD) ---
+# Рівень вибирається за кількістю видимих агентів (LOD_THRESHOLDS), а регулятор часу кадру
+# піднімає нижню межу рівня, якщо малювання не вкладається в бюджет LOD_TARGET_FPS, і
+# поступово опускає її, коли запас часу великий. Клавіша V фіксує рівень вручну.
+LOD_FULL, LOD_NO_HALO, LOD_PIXELS, LOD_HEATMAP = range(4)
+LOD_NAMES = ("повна", "без ореолів", "пікселі", "теплова карта")
+
+class LevelOfDetail:
+    def __init__(self):
+        self.forced = None # None - автоматично, інакше рівень, вибраний клавішею V
+        self.pressure = LOD_FULL # Нижня межа рівня від регулятора часу кадру
+        self.level = LOD_FULL
+        self.render_ms = 0.0 # Згладжений час малювання кадру
+        self.hold = 0
+        self.calm = 0
+
+    def choose(self, visible_count):
+        if self.forced is not None:
+            self.level = self.forced
+        else:
+            density = sum(visible_count > threshold for threshold in LOD_THRESHOLDS)
+            self.level = max(density, self.pressure)
+        return self.level
+
+    def cycle(self):
+        # авто -> 0 -> 1 -> 2 -> 3 -> авто
+        self.forced = None if self.forced == LOD_HEATMAP else (0 if self.forced is None else self.forced + 1)
+
+    def observe(self, seconds):
+        # Регулятор: викликається з тривалістю малювання кожного кадру
+        self.render_ms += LOD_SMOOTHING * (seconds * 1000 - self.render_ms)
+        if self.forced is not None: return # Рівень зафіксовано вручну - регулятор не втручається
+        if self.hold:
+            self.hold -= 1
+            return
+        budget = 1000 / LOD_TARGET_FPS * LOD_RENDER_SHARE
+        if self.render_ms > budget and self.pressure < LOD_HEATMAP:
+            self.pressure += 1
+            self.hold, self.calm = LOD_HOLD_FRAMES, 0
+        elif self.render_ms < budget / 2 and self.pressure > LOD_FULL:
+            self.calm += 1
+            if self.calm >= LOD_RELAX_FRAMES:
+                self.pressure -= 1
+                self.hold, self.calm = LOD_HOLD_FRAMES, 0
+        else:
+            self.calm = 0
+
+lod = LevelOfDetail()
+
+def screen_points(surface, points, cell=1):
+    # Позиції світу -> цілі координати екрана (у клітинках розміру cell), лише в межах поверхні
+    w, h = surface.get_size()
+    xs = np.floor((points[:, 0] - camera.x) * (camera.zoom / cell)).astype(np.int64)
+    ys = np.floor((points[:, 1] - camera.y) * (camera.zoom / cell)).astype(np.int64)
+    inside = (xs >= 0) & (xs < math.ceil(w / cell)) & (ys >= 0) & (ys < math.ceil(h / cell))
+    return xs[inside], ys[inside]
+
+def draw_pixels(surface, point_groups, colors):
+    # Кожна позиція - один піксель, записаний прямо в пам'ять поверхні (pygame.surfarray).
+    # Повертає прямокутник, що охоплює намальоване
+    pixels = pygame.surfarray.pixels2d(surface)
+    x0 = y0 = math.inf
+    x1 = y1 = -1
+    for points, color in zip(point_groups, colors):
+        xs, ys = screen_points(surface, points)
+        if not len(xs): continue
+        pixels[xs, ys] = surface.map_rgb(color)
+        x0, x1 = min(x0, int(xs.min())), max(x1, int(xs.max()))
+        y0, y1 = min(y0, int(ys.min())), max(y1, int(ys.max()))
+    del pixels # Знімає блокування поверхні
+    return [pygame.Rect(x0, y0, x1 - x0 + 1, y1 - y0 + 1)] if x1 >= 0 else []
+
+def draw_heatmap(surface, point_groups, channels):
+    # Щільність агентів по клітинках LOD_HEATMAP_CELL: кожен вид - свій канал кольору,
+    # яскравість логарифмічна від кількості; порожні клітинки прозорі
+    cell = LOD_HEATMAP_CELL
+    w, h = surface.get_size()
+    cw, ch = math.ceil(w / cell), math.ceil(h / cell)
+    rgb = np.zeros((cw, ch, 3), dtype=np.uint8)
+    for points, channel in zip(point_groups, channels):
+        xs, ys = screen_points(surface, points, cell)
+        counts = np.bincount(xs * ch + ys, minlength=cw * ch).reshape(cw, ch)
+        rgb[..., channel] = np.minimum(255, np.log1p(counts) / math.log1p(LOD_HEATMAP_SATURATION) * 255)
+    heat = pygame.surfarray.make_surface(rgb)
+    heat.set_colorkey((0, 0, 0))
+    return [surface.blit(pygame.transform.scale(heat, (cw * cell, ch * cell)), (0, 0))]
+
+# --- Живі Графіки ---
+# Спарклайни популяцій та середніх генів малюються з буферів телеметрії на кешованій поверхні:
+# з новою точкою поверхня зсувається на піксель вліво і домальовується лише правий стовпчик,
+# тож вартість кадру не залежить від довжини історії. Повна перемальовка (лише останні
+# CHART_WIDTH точок) - тільки після очищення/завантаження історії.
+class LiveCharts:
+    def __init__(self):
+        # (підпис, [(ряд, колір, мін, макс)]) - кожен ряд масштабується у свій діапазон
+        self.charts = [
+            ("Популяція", [('creature_pop', (50, 200, 50), 0, MAX_CREATURES),
+                           ('predator_pop', PREDATOR_COLOR, 0, MAX_PREDATORS)]),
+            ("Швидкість", [('avg_creature_speed', (0, 255, 255), CREATURE_MIN_SPEED, CREATURE_MAX_SPEED),
+                           ('avg_predator_speed', (255, 0, 255), PREDATOR_MIN_SPEED, PREDATOR_MAX_SPEED)]),
+            ("Чутливість", [('avg_creature_sense', (173, 216, 230), CREATURE_MIN_SENSE, CREATURE_MAX_SENSE),
+                            ('avg_predator_sense', (255, 192, 203), PREDATOR_MIN_SENSE, PREDATOR_MAX_SENSE)]),
+        ]
+        self.surface = None
+        self.epoch = None
+        self.consumed = 0 # Скільки точок історії вже намальовано
+        self.last_y = {}  # Остання намальована висота кожного ряду (для з'єднання відрізком)
+
+    def _y(self, chart_index, value, low, high):
+        if value != value: return None # NaN - пропуск
+        top = chart_index * (CHART_HEIGHT + CHART_TITLE_HEIGHT) + CHART_TITLE_HEIGHT
+        fraction = min(1.0, max(0.0, (value - low) / (high - low)))
+        return top + int(round((1 - fraction) * (CHART_HEIGHT - 1)))
+
+    def _draw_columns(self, count):
+        # Малює останні count точок у праві count стовпчиків поверхні
+        x0 = CHART_WIDTH - count
+        for chart_index, (_, lines) in enumerate(self.charts):
+            for name, color, low, high in lines:
+                prev = self.last_y.get(name)
+                for k, value in enumerate(telemetry.tail(name, count)):
+                    y = self._y(chart_index, float(value), low, high)
+                    x = x0 + k
+                    if y is not None:
+                        if prev is not None and x > 0: pygame.draw.line(self.surface, color, (x - 1, prev), (x, y))
+                        else: self.surface.set_at((x, y), color)
+                    prev = y
+                self.last_y[name] = prev
+
+    def update(self):
+        height = len(self.charts) * (CHART_HEIGHT + CHART_TITLE_HEIGHT)
+        if self.surface is None:
+            self.surface = pygame.Surface((CHART_WIDTH, height))
+            self.epoch = None
+        available = len(telemetry)
+        new = available - self.consumed
+        if self.epoch != telemetry.epoch or new < 0 or new >= CHART_WIDTH:
+            # Історія почалась заново або відстали більше ніж на ширину - перемальовуємо все
+            self.surface.fill(INFO_PANEL_COLOR)
+            self.last_y = {}
+            self.epoch = telemetry.epoch
+            self._draw_columns(min(available, CHART_WIDTH))
+        elif new:
+            self.surface.scroll(-new, 0)
+            self.surface.fill(INFO_PANEL_COLOR, (CHART_WIDTH - new, 0, new, height))
+            self._draw_columns(new)
+        self.consumed = available
+
+    def draw(self, surface, x, y):
+        # Повертає змінені прямокутники (для LayeredRenderer)
+        self.update()
+        rects = [surface.blit(self.surface, (x, y))]
+        for chart_index, (title, lines) in enumerate(self.charts):
+            values = " / ".join(f"{telemetry.last(name, 0):.{0 if name.endswith('_pop') else 1}f}"
+                                for name, _, _, _ in lines)
+            label = hud_text_cache.render(('chart', chart_index), INFO_FONT, f"{title}: {values}", INFO_TEXT_COLOR)
+            rects.append(surface.blit(label, (x + 4, y + chart_index * (CHART_HEIGHT + CHART_TITLE_HEIGHT) + 2)))
+        return rects
+
+renderer = LayeredRenderer()
+hud_text_cache = HudTextCache()
+live_charts = LiveCharts()
 
 # --- Класи ---
 
+# Сутності світу мають __slots__ (без __dict__ на кожен об'єкт): константи виду - атрибути
+# класу (SpeciesConstant), rect обчислюється з pos на вимогу. Звіт про пам'ять - memory_report.
+
+def circle_rect(pos, radius):
+    return pygame.Rect(pos[0] - radius, pos[1] - radius, radius * 2, radius * 2)
+
+def restore_slots(obj, state):
+    # __setstate__ для старих збережень (.pkl): об'єкти там мають стан-словник (до __slots__).
+    # Переносимо лише те, що лишилось слотами; radius, rect, obstacles тепер на класі
+    if isinstance(state, tuple): state = {**(state[0] or {}), **(state[1] or {})}
+    for name, value in state.items():
+        try: setattr(obj, name, value)
+        except AttributeError: pass
+
 class Food:
-    def __init__(self, obstacles):
-        self.radius = 3
-        while True:
-            # Використовуємо глобальні константи
-            self.pos = pygame.Vector2(random.randint(self.radius, WIDTH - self.radius),
-                                      random.randint(self.radius, HEIGHT - self.radius))
-            self.rect = pygame.Rect(self.pos.x - self.radius, self.pos.y - self.radius,
-                                      self.radius * 2, self.radius * 2)
-            if not obstacles or not any(obs.rect.colliderect(self.rect) for obs in obstacles):
-                break
-        self.color = FOOD_COLOR
+    __slots__ = ('pos', 'is_dead', 'handle')
+    radius = SpeciesConstant('FOOD_RADIUS')
+    color = SpeciesConstant('FOOD_COLOR')
+    __setstate__ = restore_slots
 
-    def draw(self, surface):
-        pygame.draw.circle(surface, self.color, self.pos, self.radius)
+    def __init__(self, obstacles):
+        self.is_dead = False # Позначається при поїданні; сам об'єкт прибирається наприкінці кроку
+        self.handle = entity_handles.register(self)
+        self.pos = random_free_position(obstacles, self.radius)
+
+    @classmethod
+    def restore(cls, x, y, handle=None):
+        # Відновлення зі знімка без випадкового розміщення, на збережений дескриптор
+        # (без дескриптора - новий, як для їжі, що прийшла з іншого тайлу)
+        food = cls.__new__(cls)
+        food.is_dead = False
+        food.handle = entity_handles.register(food) if handle is None else entity_handles.place(handle, food)
+        food.pos = pygame.Vector2(x, y)
+        return food
+
+    @property
+    def rect(self):
+        return circle_rect(self.pos, self.radius)
+
+    def draw(self, surface, camera=None):
+        if camera is None:
+            pygame.draw.circle(surface, self.color, self.pos, self.radius)
+        else:
+            pygame.draw.circle(surface, self.color, camera.to_screen(self.pos), max(1, round(self.radius * camera.zoom)))
 
 class Obstacle:
+    __slots__ = ('rect', 'color')
+    __setstate__ = restore_slots
+
     def __init__(self):
         size = random.randint(OBSTACLE_MIN_SIZE, OBSTACLE_MAX_SIZE)
         # Використовуємо глобальні константи
@@ -135,34 +1639,49 @@ class Obstacle:
         self.rect = pygame.Rect(x, y, size, size)
         self.color = OBSTACLE_COLOR
 
-    def draw(self, surface):
-        pygame.draw.rect(surface, self.color, self.rect)
+    @classmethod
+    def from_rect(cls, rect):
+        obs = cls.__new__(cls)
+        obs.rect = pygame.Rect(rect)
+        obs.color = OBSTACLE_COLOR
+        return obs
+
+    def draw(self, surface, camera=None):
+        pygame.draw.rect(surface, self.color, self.rect if camera is None else camera.rect_to_screen(self.rect))
 
 # --- БАЗОВИЙ КЛАС АГЕНТА ---
 class Agent(ABC): # <--- Успадковуємо від ABC
-    def __init__(self, x, y, radius, color, initial_energy, max_age, min_speed, max_speed, min_sense, max_sense, generation=0):
+    # Радіус - константа виду на класі (radius = SpeciesConstant(...)), межі генів - у схемі геному
+    __slots__ = ('pos', 'direction', 'color', 'energy', 'max_age', 'age', 'generation', 'is_dead',
+                 'handle', 'genes', 'ready_to_mate', 'mating_cooldown_timer', 'lineage_id')
+    __setstate__ = restore_slots
+
+    def __init__(self, x, y, color, initial_energy, max_age, generation=0):
         self.pos = pygame.Vector2(x, y)
-        self.radius = radius
         self.color = color
         self.energy = initial_energy
         self.max_age = max_age
         self.age = 0.0
         self.generation = generation
         self.is_dead = False
-        # Використовуємо self.radius, який вже встановлено
-        self.rect = pygame.Rect(self.pos.x - self.radius, self.pos.y - self.radius, self.radius * 2, self.radius * 2)
+        self.handle = entity_handles.register(self)
+        self.lineage_id = NO_LINEAGE # Запис у родоводі; призначається при народженні (lineage)
         self.direction = normalize_vec(pygame.Vector2(random.uniform(-1, 1), random.uniform(-1, 1)))
 
-        self.genes = {
-            'speed': random.uniform(min_speed, max_speed),
-            'sense': random.uniform(min_sense, max_sense)
-        }
-        self.min_speed, self.max_speed = min_speed, max_speed
-        self.min_sense, self.max_sense = min_sense, max_sense
+        self.genes = self.genome().random_genes()
 
         self.ready_to_mate = False
         self.mating_cooldown_timer = 0.0
 
+    @property
+    def rect(self):
+        return circle_rect(self.pos, self.radius)
+
+    @property
+    def obstacles(self):
+        # Спільний список перешкод світу - не зберігається в кожному агенті
+        return obstacles
+
     def update_basic_state(self, dt):
         if self.is_dead: return True
         self.age += dt
@@ -184,8 +1703,14 @@ class Agent(ABC): # <--- Успадковуємо від ABC
     def check_obstacle_collision(self, obstacles):
         if self.is_dead: return False
         if not obstacles: return False # Додано перевірку на випадок відсутності перешкод
+        if obstacle_map.covers(obstacles):
+            if obstacle_map.blocked(self.pos, self.radius):
+                self.is_dead = True
+                return True
+            return False
+        rect = self.rect
         for obs in obstacles:
-            if self.rect.colliderect(obs.rect):
+            if rect.colliderect(obs.rect):
                 self.is_dead = True
                 return True
         return False
@@ -195,17 +1720,31 @@ class Agent(ABC): # <--- Успадковуємо від ABC
 
         move_vector = move_direction * current_speed * dt * 50
         self.pos += move_vector
-        # Використовуємо self.radius
-        self.rect.center = self.pos
 
         # Використовуємо глобальні константи
         self.pos.x = clamp(self.pos.x, self.radius, WIDTH - self.radius)
         self.pos.y = clamp(self.pos.y, self.radius, HEIGHT - self.radius)
-        self.rect.center = self.pos
 
         energy_cost = self.get_move_cost() * current_speed * energy_cost_multiplier * dt
         self.energy -= energy_cost
 
+    def separation_from(self, neighbors, separation_radius):
+        # neighbors - список або SpatialGrid того ж виду
+        separation_vector = pygame.Vector2(0, 0)
+        neighbors_count = 0
+        if isinstance(neighbors, SpatialGrid):
+            candidates = neighbors.query_radius(self.pos, separation_radius, exclude=self)
+        else:
+            candidates = [(other, distance_sq(self.pos, other.pos)) for other in neighbors
+                          if other != self and not other.is_dead]
+        for other, dist_sq in candidates:
+            if 0 < dist_sq < separation_radius**2:
+                diff = self.pos - other.pos
+                # Вага обернено пропорційна квадрату відстані
+                separation_vector += diff / max(dist_sq, 0.1) # Уникаємо ділення на нуль
+                neighbors_count += 1
+        return separation_vector, neighbors_count
+
     # --- Використання @abstractmethod ---
     @abstractmethod
     def get_energy_decay_rate(self):
@@ -220,21 +1759,39 @@ class Agent(ABC): # <--- Успадковуємо від ABC
         pass # Видалено недійсне ключове слово 'abstract'
     # -----------------------------------
 
-    def draw(self, surface, is_selected=False):
-        if self.is_dead: return
-        sense_radius_val = self.genes['sense']
+    def sprite_blits(self, camera=None, halo=True):
+        # Пари (спрайт, позиція) для пакетного Surface.blits: спершу ореол, потім тіло.
+        # З камерою позиція та радіуси переводяться в екранні координати
+        if self.is_dead: return []
+        if camera is None:
+            x, y = self.pos
+            zoom = 1.0
+        else:
+            x, y = camera.to_screen(self.pos)
+            zoom = camera.zoom
+        blits = []
+        sense_radius_val = self.genes['sense'] * zoom
         # Запобігання помилки, якщо радіус = 0
-        if sense_radius_val > 0:
-            sense_surface = pygame.Surface((sense_radius_val * 2, sense_radius_val * 2), pygame.SRCALPHA)
-            pygame.draw.circle(sense_surface, (*self.color[:3], 30), (sense_radius_val, sense_radius_val), int(sense_radius_val)) # Використовуємо перші 3 компоненти кольору
-            try:
-                surface.blit(sense_surface, self.pos - pygame.Vector2(sense_radius_val, sense_radius_val))
-            except TypeError: # Може виникнути, якщо pos має невірний тип під час ініціалізації
-                 pass
-
-        pygame.draw.circle(surface, self.color, self.pos, self.radius)
+        if halo and sense_radius_val > 0:
+            halo_sprite = sprite_cache.halo(sense_radius_val, self.color)
+            offset = halo_sprite.get_width() // 2
+            blits.append((halo_sprite, (x - offset, y - offset)))
+        body = sprite_cache.body(max(1, self.radius * zoom), self.color)
+        offset = body.get_width() // 2
+        blits.append((body, (x - offset, y - offset)))
+        return blits
+
+    def draw_selection(self, surface, camera=None):
+        radius = self.radius + 2 + (self.radius // 3)
+        if camera is None:
+            return pygame.draw.circle(surface, SELECTION_COLOR, self.pos, radius, 2)
+        return pygame.draw.circle(surface, SELECTION_COLOR, camera.to_screen(self.pos), max(2, radius * camera.zoom), 2)
+
+    def draw(self, surface, is_selected=False, camera=None):
+        if self.is_dead: return
+        surface.blits(self.sprite_blits(camera), doreturn=False)
         if is_selected:
-            pygame.draw.circle(surface, SELECTION_COLOR, self.pos, self.radius + 2 + (self.radius // 3), 2)
+            self.draw_selection(surface, camera)
 
     def is_clicked(self, mouse_pos):
         # Додано перевірку на тип mouse_pos
@@ -246,41 +1803,28 @@ class Agent(ABC): # <--- Успадковуємо від ABC
 
 # --- КЛАС ІСТОТИ ---
 class Creature(Agent):
+    __slots__ = ('target_food_obj_handle', 'target_partner_handle', 'mating_partner_handle')
+    radius = SpeciesConstant('CREATURE_RADIUS')
+    target_food_obj = handle_ref('target_food_obj')
+    target_partner = handle_ref('target_partner')
+    mating_partner = handle_ref('mating_partner')
+
     def __init__(self, obstacles, pos=None, genes=None, parent_generation=None):
         # Використовуємо глобальні константи
         super().__init__(pos.x if pos else random.uniform(CREATURE_RADIUS, WIDTH - CREATURE_RADIUS),
                          pos.y if pos else random.uniform(CREATURE_RADIUS, HEIGHT - CREATURE_RADIUS),
-                         CREATURE_RADIUS, # Передаємо радіус
                          (0,0,0), # Тимчасовий колір
                          CREATURE_INITIAL_ENERGY, CREATURE_MAX_AGE,
-                         CREATURE_MIN_SPEED, CREATURE_MAX_SPEED,
-                         CREATURE_MIN_SENSE, CREATURE_MAX_SENSE,
                          parent_generation + 1 if parent_generation is not None else 0)
 
-        self.obstacles = obstacles
-
-        if genes:
+        if genes: # Гени нащадка вже схрещені та мутовані (resolve_births)
             self.genes = genes
-            if random.random() < CREATURE_MUTATION_RATE:
-                mutation = (random.random() * 2 - 1) * CREATURE_MUTATION_STRENGTH * self.genes['speed']
-                self.genes['speed'] = clamp(self.genes['speed'] + mutation, self.min_speed, self.max_speed)
-            if random.random() < CREATURE_MUTATION_RATE:
-                 mutation = (random.random() * 2 - 1) * CREATURE_MUTATION_STRENGTH * self.genes['sense']
-                 self.genes['sense'] = clamp(self.genes['sense'] + mutation, self.min_sense, self.max_sense)
 
         if pos is None:
-             while True:
-                # Використовуємо self.radius, встановлений у super().__init__
-                self.pos = pygame.Vector2(random.randint(self.radius, WIDTH - self.radius),
-                                          random.randint(self.radius, HEIGHT - self.radius))
-                self.rect.center = self.pos
-                if not obstacles or not any(obs.rect.colliderect(self.rect) for obs in self.obstacles):
-                    break
+             self.pos = random_free_position(obstacles, self.radius)
         else:
-             self.pos = pygame.Vector2(pos.x + random.uniform(-10, 10), pos.y + random.uniform(-10, 10))
-             self.pos.x = clamp(self.pos.x, self.radius, WIDTH - self.radius)
-             self.pos.y = clamp(self.pos.y, self.radius, HEIGHT - self.radius)
-             self.rect.center = self.pos
+             self.pos = pygame.Vector2(clamp(pos.x + random.uniform(-10, 10), self.radius, WIDTH - self.radius),
+                                       clamp(pos.y + random.uniform(-10, 10), self.radius, HEIGHT - self.radius))
 
         self.update_color()
 
@@ -288,9 +1832,25 @@ class Creature(Agent):
         self.target_partner = None
         self.mating_partner = None
 
+    @staticmethod
+    def species_constants():
+        return {'color': (0, 0, 0)}
+
+    @staticmethod
+    def genome():
+        return creature_genome()
+
+    @staticmethod
+    def colors_for(speed, sense):
+        # Векторизований аналог update_color для масивів генів
+        r = np.interp(speed, [CREATURE_MIN_SPEED, CREATURE_MAX_SPEED], [50, 255]).astype(int)
+        b = np.interp(sense, [CREATURE_MIN_SENSE, CREATURE_MAX_SENSE], [50, 255]).astype(int)
+        return [(int(ri), CREATURE_BASE_COLOR_G, int(bi)) for ri, bi in zip(r, b)]
+
     def update_color(self):
-        r = int(np.interp(self.genes['speed'], [self.min_speed, self.max_speed], [50, 255]))
-        b = int(np.interp(self.genes['sense'], [self.min_sense, self.max_sense], [50, 255]))
+        bounds = self.genome().bounds
+        r = int(np.interp(self.genes['speed'], [bounds['min_speed'], bounds['max_speed']], [50, 255]))
+        b = int(np.interp(self.genes['sense'], [bounds['min_sense'], bounds['max_sense']], [50, 255]))
         # Використовуємо глобальну константу CREATURE_BASE_COLOR_G
         self.color = (clamp(r,0,255), CREATURE_BASE_COLOR_G, clamp(b,0,255))
 
@@ -300,7 +1860,8 @@ class Creature(Agent):
     def get_reproduction_ready_threshold(self): return CREATURE_REPRODUCTION_READY_THRESHOLD
     # ------------------------------------
 
-    def update(self, dt, food_list, creature_list, predator_list):
+    def update(self, dt, food_list, creature_list, predator_list, index=None):
+        # index (WorldIndex) - просторові сітки; без нього пошук іде повним перебором списків
         if self.update_basic_state(dt): return
         if self.check_obstacle_collision(self.obstacles): return
 
@@ -312,7 +1873,7 @@ class Creature(Agent):
         mating_attempt = False
 
         # 1. Ухилення від хижаків
-        closest_predator, predator_dist_sq = self.find_closest_agent(predator_list, sense_radius_sq)
+        closest_predator, predator_dist_sq = self.find_closest_agent(index.predators if index else predator_list, sense_radius_sq)
         if closest_predator:
             evade_vector = self.pos - closest_predator.pos
             if evade_vector.length_squared() > 0:
@@ -324,60 +1885,50 @@ class Creature(Agent):
                 self.target_partner = None
                 self.mating_partner = None
 
-        # 2. Пошук партнера / Спарювання
+        # 2. Спарювання з партнером, призначеним на цьому кроці match_mates
         if not evading and self.ready_to_mate:
-            if self.mating_partner and not self.mating_partner.is_dead and self.mating_partner.ready_to_mate:
-                 partner_dist_sq = distance_sq(self.pos, self.mating_partner.pos)
+            partner = self.mating_partner
+            if partner and not partner.is_dead and partner.ready_to_mate and partner.mating_partner is self:
+                 partner_dist_sq = distance_sq(self.pos, partner.pos)
                  if partner_dist_sq < CREATURE_MATING_RANGE**2:
-                     if id(self) < id(self.mating_partner):
-                        child_genes = crossover_genes(self.genes, self.mating_partner.genes)
-                        request_reproduction(self, self.mating_partner, child_genes)
-                     self.mating_cooldown_timer = CREATURE_MATING_COOLDOWN
-                     self.mating_partner.mating_cooldown_timer = CREATURE_MATING_COOLDOWN
-                     self.ready_to_mate = False
-                     self.mating_partner.ready_to_mate = False
-                     self.mating_partner.mating_partner = None
+                     # Спарювання завершує той з пари, хто оновлюється першим: дитина запитується
+                     # рівно один раз, батьки - у порядку дескрипторів (не залежить від порядку оновлення)
+                     if population_has_room(self):
+                        first, second = (self, partner) if self.handle < partner.handle else (partner, self)
+                        request_reproduction(first, second)
+                        self.mating_cooldown_timer = CREATURE_MATING_COOLDOWN
+                        partner.mating_cooldown_timer = CREATURE_MATING_COOLDOWN
+                        self.ready_to_mate = False
+                        partner.ready_to_mate = False
+                     # Без місця під лімітом пара розпадається, але кулдаун не витрачається
+                     partner.mating_partner = None
+                     partner.target_partner = None
                      self.mating_partner = None
+                     self.target_partner = None
                      mating_attempt = True
                      move_direction = pygame.Vector2(0, 0)
                  elif partner_dist_sq < sense_radius_sq:
-                      target_vector = self.mating_partner.pos - self.pos
+                      target_vector = partner.pos - self.pos
                       move_direction = normalize_vec(target_vector)
                       mating_attempt = True
                  else:
                       self.mating_partner = None
+                      self.target_partner = None
             else:
                 self.mating_partner = None
-                # Шукаємо лише серед тих, хто теж шукає або не має партнера
-                potential_partners = [c for c in creature_list if c != self and c.ready_to_mate and (not c.mating_partner or c.mating_partner == self)]
-                closest_partner, partner_dist_sq = self.find_closest_agent(potential_partners, sense_radius_sq)
-
-                if closest_partner:
-                    self.target_partner = closest_partner
-                    # Спробуємо "домовитись" про спарювання
-                    # Якщо інший теж шукає або не має цілі кращої
-                    if not closest_partner.mating_partner or closest_partner.target_partner == self:
-                         self.mating_partner = closest_partner
-                         closest_partner.mating_partner = self # Взаємне призначення
-                         target_vector = self.target_partner.pos - self.pos
-                         move_direction = normalize_vec(target_vector)
-                         mating_attempt = True
-                    else: # Партнер зайнятий
-                        self.target_partner = None
-
-                else:
-                    self.target_partner = None
+                self.target_partner = None
 
         # 3. Пошук їжі
         if not evading and not mating_attempt:
-            if self.target_food_obj and self.target_food_obj in food_list:
-                food_dist_sq = distance_sq(self.pos, self.target_food_obj.pos)
+            target_food = self.target_food_obj
+            if target_food and not target_food.is_dead:
+                food_dist_sq = distance_sq(self.pos, target_food.pos)
                 # Використовуємо радіус поточного агента self.radius
-                if food_dist_sq < (self.radius + self.target_food_obj.radius)**2:
-                    self.eat(self.target_food_obj)
+                if food_dist_sq < (self.radius + target_food.radius)**2:
+                    self.eat(target_food)
                     self.target_food_obj = None
                 elif food_dist_sq < sense_radius_sq:
-                     target_vector = self.target_food_obj.pos - self.pos
+                     target_vector = target_food.pos - self.pos
                      move_direction = normalize_vec(target_vector)
                 else:
                     self.target_food_obj = None
@@ -385,24 +1936,15 @@ class Creature(Agent):
                 self.target_food_obj = None
                 # Перевіряємо, чи список їжі не порожній
                 if food_list:
-                     closest_food, food_dist_sq = self.find_closest_agent(food_list, sense_radius_sq)
+                     closest_food, food_dist_sq = self.find_closest_agent(index.food if index else food_list, sense_radius_sq)
                      if closest_food:
                          self.target_food_obj = closest_food
                          target_vector = self.target_food_obj.pos - self.pos
                          move_direction = normalize_vec(target_vector)
 
         # 4. Уникнення скупчення (Separation)
-        separation_vector = pygame.Vector2(0, 0)
-        neighbors_count = 0
-        if creature_list: # Перевіряємо, чи список істот не порожній
-             for other in creature_list:
-                 if other != self and not other.is_dead:
-                     dist_sq = distance_sq(self.pos, other.pos)
-                     if 0 < dist_sq < CREATURE_SEPARATION_RADIUS**2:
-                         diff = self.pos - other.pos
-                         # Вага обернено пропорційна квадрату відстані
-                         separation_vector += diff / max(dist_sq, 0.1) # Уникаємо ділення на нуль
-                         neighbors_count += 1
+        separation_vector, neighbors_count = self.separation_from(
+            index.creatures if index else creature_list, CREATURE_SEPARATION_RADIUS)
         if neighbors_count > 0:
              separation_vector /= neighbors_count
              separation_vector = normalize_vec(separation_vector)
@@ -426,6 +1968,8 @@ class Creature(Agent):
     def find_closest_agent(self, agent_list, sense_radius_sq):
         closest_agent = None
         min_dist_sq = sense_radius_sq
+        if isinstance(agent_list, SpatialGrid):
+            return agent_list.find_closest(self.pos, sense_radius_sq, exclude=self)
         if not agent_list: return None, sense_radius_sq # Повертаємо None, якщо список порожній
 
         for agent in agent_list:
@@ -438,60 +1982,58 @@ class Creature(Agent):
         return closest_agent, min_dist_sq
 
     def eat(self, food_item):
-        if not self.is_dead:
+        # food_item.is_dead - їжу вже з'їли цього кроку, вдруге енергії вона не дає
+        if not self.is_dead and not food_item.is_dead:
             self.energy += FOOD_ENERGY
-            if food_item not in food_to_remove_global:
-                 food_to_remove_global.append(food_item)
-            if self.target_food_obj == food_item:
+            food_item.is_dead = True
+            food_to_remove_global.add(food_item)
+        if self.target_food_obj == food_item:
                 self.target_food_obj = None
 
 # --- КЛАС ХИЖАКА ---
 class Predator(Agent):
+    __slots__ = ('target_creature_handle',)
+    radius = SpeciesConstant('PREDATOR_RADIUS')
+    target_creature = handle_ref('target_creature')
+
     def __init__(self, obstacles, pos=None, genes=None, parent_generation=None):
          # Використовуємо глобальні константи
          super().__init__(pos.x if pos else random.uniform(PREDATOR_RADIUS, WIDTH - PREDATOR_RADIUS),
                          pos.y if pos else random.uniform(PREDATOR_RADIUS, HEIGHT - PREDATOR_RADIUS),
-                         PREDATOR_RADIUS, # Передаємо радіус
                          PREDATOR_COLOR,
                          PREDATOR_INITIAL_ENERGY, PREDATOR_MAX_AGE,
-                         PREDATOR_MIN_SPEED, PREDATOR_MAX_SPEED,
-                         PREDATOR_MIN_SENSE, PREDATOR_MAX_SENSE,
                          parent_generation + 1 if parent_generation is not None else 0)
 
-         self.obstacles = obstacles
-
-         if genes:
+         if genes: # Гени нащадка вже мутовані (resolve_births)
             self.genes = genes
-            if random.random() < PREDATOR_MUTATION_RATE:
-                mutation = (random.random() * 2 - 1) * PREDATOR_MUTATION_STRENGTH * self.genes['speed']
-                self.genes['speed'] = clamp(self.genes['speed'] + mutation, self.min_speed, self.max_speed)
-            if random.random() < PREDATOR_MUTATION_RATE:
-                 mutation = (random.random() * 2 - 1) * PREDATOR_MUTATION_STRENGTH * self.genes['sense']
-                 self.genes['sense'] = clamp(self.genes['sense'] + mutation, self.min_sense, self.max_sense)
 
          if pos is None:
-              while True:
-                 # Використовуємо self.radius, встановлений у super().__init__
-                 self.pos = pygame.Vector2(random.randint(self.radius, WIDTH - self.radius),
-                                           random.randint(self.radius, HEIGHT - self.radius))
-                 self.rect.center = self.pos
-                 if not obstacles or not any(obs.rect.colliderect(self.rect) for obs in self.obstacles):
-                     break
+              self.pos = random_free_position(obstacles, self.radius)
          else:
-             self.pos = pygame.Vector2(pos.x + random.uniform(-10, 10), pos.y + random.uniform(-10, 10))
-             self.pos.x = clamp(self.pos.x, self.radius, WIDTH - self.radius)
-             self.pos.y = clamp(self.pos.y, self.radius, HEIGHT - self.radius)
-             self.rect.center = self.pos
+             self.pos = pygame.Vector2(clamp(pos.x + random.uniform(-10, 10), self.radius, WIDTH - self.radius),
+                                       clamp(pos.y + random.uniform(-10, 10), self.radius, HEIGHT - self.radius))
 
          self.target_creature = None
 
+    @staticmethod
+    def species_constants():
+        return {'color': PREDATOR_COLOR}
+
+    @staticmethod
+    def genome():
+        return predator_genome()
+
+    @staticmethod
+    def colors_for(speed, sense):
+        return None # Колір хижака не залежить від генів
+
     # --- Реалізація абстрактних методів ---
     def get_energy_decay_rate(self): return PREDATOR_ENERGY_DECAY
     def get_move_cost(self): return PREDATOR_MOVE_COST
     def get_reproduction_ready_threshold(self): return PREDATOR_REPRODUCTION_READY_THRESHOLD
     # ------------------------------------
 
-    def update(self, dt, creature_list, predator_list):
+    def update(self, dt, creature_list, predator_list, index=None):
         if self.update_basic_state(dt): return
         if self.check_obstacle_collision(self.obstacles): return
 
@@ -502,7 +2044,7 @@ class Predator(Agent):
 
         # 1. Пошук здобичі
         current_target_valid = False
-        if self.target_creature and self.target_creature in creature_list and not self.target_creature.is_dead:
+        if self.target_creature and not self.target_creature.is_dead:
              dist_sq = distance_sq(self.pos, self.target_creature.pos)
              if dist_sq < sense_radius_sq:
                  target_vector = self.target_creature.pos - self.pos
@@ -524,7 +2066,7 @@ class Predator(Agent):
              # Шукаємо нову здобич, тільки якщо список істот не порожній
              if creature_list:
                  closest_prey, prey_dist_sq = self.find_closest_agent(
-                     [c for c in creature_list if not c.is_dead],
+                     index.creatures if index else [c for c in creature_list if not c.is_dead],
                      sense_radius_sq
                  )
                  if closest_prey:
@@ -534,16 +2076,8 @@ class Predator(Agent):
                      prey_found = True
 
         # 2. Уникнення скупчення хижаків
-        separation_vector = pygame.Vector2(0, 0)
-        neighbors_count = 0
-        if predator_list: # Перевірка, чи список не порожній
-             for other in predator_list:
-                 if other != self and not other.is_dead:
-                     dist_sq = distance_sq(self.pos, other.pos)
-                     if 0 < dist_sq < PREDATOR_SEPARATION_RADIUS**2:
-                         diff = self.pos - other.pos
-                         separation_vector += diff / max(dist_sq, 0.1)
-                         neighbors_count += 1
+        separation_vector, neighbors_count = self.separation_from(
+            index.predators if index else predator_list, PREDATOR_SEPARATION_RADIUS)
         if neighbors_count > 0:
              separation_vector /= neighbors_count
              separation_vector = normalize_vec(separation_vector)
@@ -564,10 +2098,9 @@ class Predator(Agent):
         self.apply_movement(dt, move_direction, current_speed)
 
         # Розмноження Хижаків (Асексуальне)
-        if self.ready_to_mate and len(predators) < MAX_PREDATORS: # Використовуємо ready_to_mate, хоч і асексуальне
+        if self.ready_to_mate and population_has_room(self): # Використовуємо ready_to_mate, хоч і асексуальне
             self.energy -= PREDATOR_REPRODUCTION_COST
-            child_genes = {'speed': self.genes['speed'], 'sense': self.genes['sense']}
-            request_reproduction(self, None, child_genes)
+            request_reproduction(self, None)
             self.mating_cooldown_timer = PREDATOR_MATING_COOLDOWN
             self.ready_to_mate = False
 
@@ -575,6 +2108,8 @@ class Predator(Agent):
     def find_closest_agent(self, agent_list, sense_radius_sq):
         closest_agent = None
         min_dist_sq = sense_radius_sq
+        if isinstance(agent_list, SpatialGrid):
+            return agent_list.find_closest(self.pos, sense_radius_sq)
         if not agent_list: return None, sense_radius_sq
 
         for agent in agent_list:
@@ -590,11 +2125,630 @@ class Predator(Agent):
         if not self.is_dead and not prey.is_dead:
             prey.is_dead = True
             self.energy += PREDATOR_HUNT_ENERGY_GAIN
-            if prey not in creatures_to_remove_global:
-                 creatures_to_remove_global.append(prey)
+            creatures_to_remove_global.add(prey)
             # print(f"Хижак {id(self)} полював на істоту {id(prey)}")
 
 
+# --- РУШІЙ NUMPY (Structure of Arrays) ---
+class SpeciesArrays:
+    # Неперервні масиви стану для одного виду. Слоти щільні: [0, count) - зайняті, у тому ж
+    # порядку, що й список виду (видалення ущільнює масиви зі збереженням порядку): векторизований
+    # крок вирішує конфлікти та бере випадкові числа в порядку слотів, тож після завантаження
+    # знімка (слоти в порядку списку) симуляція продовжується так само.
+    def __init__(self, capacity=64):
+        self.count = 0
+        self.views = [] # слот -> агент-представлення
+        self._allocate(capacity)
+
+    # ім'я поля -> (ширина рядка або 0 для скаляра, тип)
+    FIELDS = {
+        'pos': (2, float),
+        'direction': (2, float),
+        'energy': (0, float),
+        'age': (0, float),
+        'max_age': (0, float),
+        'cooldown': (0, float),
+        'generation': (0, np.int64),
+        'genes': (len(GENE_NAMES), float),
+        'ready': (0, bool),
+        'dead': (0, bool),
+        # Намір руху, який агент виставляє під час update, а застосовує apply_movement
+        'move_dir': (2, float),
+        'move_speed': (0, float),
+        'move_mult': (0, float),
+        # Дескриптори цілей (NO_HANDLE - немає): їжа/здобич, партнер для спарювання та ціль руху до нього
+        'target': (0, np.int64),
+        'partner': (0, np.int64),
+        'partner_target': (0, np.int64),
+        # Власний дескриптор агента та його запис у родоводі
+        'handle': (0, np.int64),
+        'lineage': (0, np.int64),
+    }
+    # Поля, де -1 означає "немає" (NO_HANDLE / NO_LINEAGE), а не нуль
+    UNSET_FIELDS = ('target', 'partner', 'partner_target', 'handle', 'lineage')
+
+    def _allocate(self, capacity):
+        for name, (width, dtype) in self.FIELDS.items():
+            arr = np.zeros((capacity, width) if width else capacity, dtype=dtype)
+            if self.count:
+                arr[:self.count] = getattr(self, name)[:self.count]
+            setattr(self, name, arr)
+        self.capacity = capacity
+
+    def add(self, view):
+        if self.count == self.capacity:
+            self._allocate(self.capacity * 2)
+        slot = self.count
+        for name in self.FIELDS:
+            getattr(self, name)[slot] = -1 if name in self.UNSET_FIELDS else 0
+        self.views.append(view)
+        self.count += 1
+        return slot
+
+    def remove(self, slots):
+        # Пакетне видалення слотів; решта зсувається вперед зі збереженням порядку
+        keep = np.ones(self.count, dtype=bool)
+        keep[slots] = False
+        kept = np.flatnonzero(keep)
+        for name in self.FIELDS:
+            arr = getattr(self, name)
+            arr[:len(kept)] = arr[kept]
+        first = int(np.min(slots))
+        self.views[first:] = [self.views[slot] for slot in kept[first:].tolist()] if first < len(kept) else []
+        for slot in range(first, len(kept)):
+            self.views[slot]._slot = slot
+        self.count = len(kept)
+
+    def clear(self):
+        for view in self.views:
+            view.detach(release=False)
+        self.views = []
+        self.count = 0
+
+    def load_columns(self, columns, n):
+        # Масове заповнення слотів [0, n) колонками знімка (представлення додаються окремо)
+        if n > self.capacity:
+            self._allocate(n)
+        for name in self.FIELDS:
+            arr = getattr(self, name)
+            arr[:n] = columns[name] if name in columns else -1 if name in self.UNSET_FIELDS else 0
+        self.count = n
+
+    def step_basic(self, dt, energy_decay, ready_threshold):
+        # Векторизований аналог Agent.update_basic_state для всього виду
+        n = self.count
+        if n == 0: return
+        alive = ~self.dead[:n]
+        age, energy, cooldown = self.age[:n], self.energy[:n], self.cooldown[:n]
+        age[alive] += dt
+        energy[alive] -= energy_decay * dt
+        cooling = alive & (cooldown > 0)
+        cooldown[cooling] -= dt
+        self.ready[:n] = np.where(alive, ~cooling & (energy >= ready_threshold), self.ready[:n])
+        self.dead[:n] |= alive & ((energy <= 0) | (age >= self.max_age[:n]))
+
+    def apply_movement(self, dt, move_cost, radius):
+        # Векторизований аналог Agent.apply_movement: рух, обмеження межами світу, витрата енергії
+        n = self.count
+        if n == 0: return
+        move_dir = self.move_dir[:n]
+        moving = ~self.dead[:n] & ((move_dir[:, 0] != 0) | (move_dir[:, 1] != 0))
+        speed = self.move_speed[:n][moving]
+        pos = self.pos[:n]
+        pos[moving] += move_dir[moving] * (speed * dt * 50)[:, None]
+        np.clip(pos[:, 0], radius, WIDTH - radius, out=pos[:, 0])
+        np.clip(pos[:, 1], radius, HEIGHT - radius, out=pos[:, 1])
+        self.energy[:n][moving] -= move_cost * speed * self.move_mult[:n][moving] * dt
+        move_dir[:] = 0
+
+class GeneView(MutableMapping):
+    # Словникоподібний доступ до рядка генів агента в масиві виду
+    __slots__ = ('_agent',)
+
+    def __init__(self, agent):
+        self._agent = agent
+
+    def __getitem__(self, key):
+        agent = self._agent
+        if agent._slot < 0: return agent._detached['genes'][key]
+        return float(agent._arrays.genes[agent._slot, GENE_NAMES.index(key)])
+
+    def __setitem__(self, key, value):
+        agent = self._agent
+        if agent._slot < 0:
+            agent._detached['genes'][key] = value
+        else:
+            agent._arrays.genes[agent._slot, GENE_NAMES.index(key)] = value
+
+    def __delitem__(self, key):
+        raise TypeError("Гени агента не можна видаляти")
+
+    def __iter__(self):
+        return iter(GENE_NAMES)
+
+    def __len__(self):
+        return len(GENE_NAMES)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+def _array_field(field):
+    # item() одразу дає скаляр Python потрібного типу (float/int/bool)
+    def fget(self):
+        if self._slot < 0: return self._detached[field]
+        return getattr(self._arrays, field).item(self._slot)
+    def fset(self, value):
+        if self._slot < 0: self._detached[field] = value
+        else: getattr(self._arrays, field)[self._slot] = value
+    return property(fget, fset)
+
+def _array_vector(field):
+    # Новий Vector2 з рядка масиву на кожне читання: крок рушія працює з масивами напряму,
+    # тож вектори представлень читають лише рендерер, інспектор та збереження
+    def fget(self):
+        if self._slot < 0: return pygame.Vector2(self._detached[field])
+        row = getattr(self._arrays, field)[self._slot]
+        return pygame.Vector2(row[0], row[1])
+    def fset(self, value):
+        if self._slot < 0: self._detached[field] = pygame.Vector2(value)
+        else: getattr(self._arrays, field)[self._slot] = (value[0], value[1])
+    return property(fget, fset)
+
+def _array_handle(field):
+    # Дескриптор цілі (слот '<ціль>_handle' для handle_ref): у масиві NO_HANDLE, назовні - None
+    def fget(self):
+        if self._slot < 0: return self._detached.get(field)
+        value = getattr(self._arrays, field).item(self._slot)
+        return None if value == NO_HANDLE else value
+    def fset(self, value):
+        if self._slot < 0: self._detached[field] = value
+        else: getattr(self._arrays, field)[self._slot] = NO_HANDLE if value is None else value
+    return property(fget, fset)
+
+class ArrayAgentView:
+    # Тонке представлення агента: атрибути стану читаються/пишуться у масиви SpeciesArrays,
+    # тож інспектор, інфо-панель, збереження та рендерер працюють без змін (крок виду рахують
+    # векторизовані engine_update_creatures / engine_update_predators).
+    # Слоти _arrays/_slot/_detached оголошує конкретний клас (CreatureView, PredatorView):
+    # два базові класи з непорожніми __slots__ несумісні
+    __slots__ = ()
+    ARRAY_SCALARS = {'energy': ('energy', float), 'age': ('age', float), 'max_age': ('max_age', float),
+                     'mating_cooldown_timer': ('cooldown', float), 'generation': ('generation', int),
+                     'ready_to_mate': ('ready', bool), 'is_dead': ('dead', bool),
+                     'handle': ('handle', int), 'lineage_id': ('lineage', int)}
+
+    energy = _array_field('energy')
+    age = _array_field('age')
+    max_age = _array_field('max_age')
+    mating_cooldown_timer = _array_field('cooldown')
+    generation = _array_field('generation')
+    ready_to_mate = _array_field('ready')
+    is_dead = _array_field('dead')
+    handle = _array_field('handle')
+    lineage_id = _array_field('lineage')
+    pos = _array_vector('pos')
+    direction = _array_vector('direction')
+
+    def __init__(self, arrays, *args, **kwargs):
+        self.bind(arrays, arrays.add(self))
+        super().__init__(*args, **kwargs)
+
+    def bind(self, arrays, slot):
+        self._arrays, self._slot, self._detached = arrays, slot, None
+
+    @property
+    def genes(self):
+        return GeneView(self)
+
+    @genes.setter
+    def genes(self, value):
+        for name in GENE_NAMES:
+            GeneView(self)[name] = value[name]
+
+    @property
+    def color(self):
+        # Колір від генів рахується при першому читанні: завантаження знімка не перебирає кольори
+        # всіх агентів, а рендерер читає лише видимих. Значення зберігається у слоті Agent.color
+        try:
+            return Agent.color.__get__(self)
+        except AttributeError:
+            colors = self.colors_for(np.array([self.genes['speed']]), np.array([self.genes['sense']]))
+            self.color = colors[0] if colors else self.species_constants()['color']
+            return Agent.color.__get__(self)
+
+    @color.setter
+    def color(self, value):
+        Agent.color.__set__(self, value)
+
+    @property
+    def rect(self):
+        if self._slot < 0:
+            return circle_rect(self._detached['pos'], self.radius)
+        return circle_rect(self._arrays.pos[self._slot], self.radius)
+
+    def update_basic_state(self, dt):
+        # Старіння/енергія/готовність уже пораховані SpeciesArrays.step_basic
+        return self.is_dead
+
+    def apply_movement(self, dt, move_direction, current_speed, energy_cost_multiplier=1.0):
+        # Лише записуємо намір; рух для всього виду виконує SpeciesArrays.apply_movement
+        if self.is_dead or move_direction.length_squared() == 0: return
+        arrays, slot = self._arrays, self._slot
+        arrays.move_dir[slot] = (move_direction.x, move_direction.y)
+        arrays.move_speed[slot] = current_speed
+        arrays.move_mult[slot] = energy_cost_multiplier
+
+    def detach(self, release=True):
+        # Знімок стану у звичайний словник: агент більше не займає слот, але лишається читабельним
+        if self._slot < 0: return
+        detached = {field: getattr(self, name) for name, (field, cast) in self.ARRAY_SCALARS.items()}
+        detached['dead'] = True
+        detached['pos'] = self.pos
+        detached['direction'] = self.direction
+        detached['genes'] = dict(self.genes)
+        for name, field in self.ARRAY_HANDLES.items():
+            detached[field] = getattr(self, name)
+        if release:
+            self._arrays.remove([self._slot])
+        self._slot = -1
+        self._detached = detached
+
+class CreatureView(ArrayAgentView, Creature):
+    __slots__ = ('_arrays', '_slot', '_detached')
+    ARRAY_HANDLES = {'target_food_obj_handle': 'target', 'mating_partner_handle': 'partner',
+                     'target_partner_handle': 'partner_target'}
+    target_food_obj_handle = _array_handle('target')
+    mating_partner_handle = _array_handle('partner')
+    target_partner_handle = _array_handle('partner_target')
+
+    def __init__(self, obstacles, pos=None, genes=None, parent_generation=None):
+        super().__init__(creature_arrays, obstacles, pos=pos, genes=genes, parent_generation=parent_generation)
+
+class PredatorView(ArrayAgentView, Predator):
+    __slots__ = ('_arrays', '_slot', '_detached')
+    ARRAY_HANDLES = {'target_creature_handle': 'target'}
+    target_creature_handle = _array_handle('target')
+
+    def __init__(self, obstacles, pos=None, genes=None, parent_generation=None):
+        super().__init__(predator_arrays, obstacles, pos=pos, genes=genes, parent_generation=parent_generation)
+
+creature_arrays = SpeciesArrays()
+predator_arrays = SpeciesArrays()
+
+def make_creature(obstacles, pos=None, genes=None, parent_generation=None):
+    cls = CreatureView if USE_NUMPY_ENGINE else Creature
+    return cls(obstacles, pos=pos, genes=genes, parent_generation=parent_generation)
+
+def make_predator(obstacles, pos=None, genes=None, parent_generation=None):
+    cls = PredatorView if USE_NUMPY_ENGINE else Predator
+    return cls(obstacles, pos=pos, genes=genes, parent_generation=parent_generation)
+
+def release_agents(agents):
+    # Агенти покидають світ: дескриптори стають недійсними, слоти в масивах виду звільняються
+    # одним ущільненням на масив, а не зсувом хвоста для кожного агента
+    slots = {}
+    for agent in agents:
+        entity_handles.release(agent.handle)
+        if isinstance(agent, ArrayAgentView) and agent._slot >= 0:
+            slots.setdefault(agent._arrays, []).append(agent._slot)
+            agent.detach(release=False)
+    for arrays, removed in slots.items():
+        arrays.remove(removed)
+
+def gene_matrix(agents):
+    # Гени агентів як масив (n, кількість генів) у порядку GENE_NAMES
+    n = len(agents)
+    if n and all(isinstance(a, ArrayAgentView) and a._slot >= 0 for a in agents):
+        return agents[0]._arrays.genes[np.fromiter((a._slot for a in agents), np.int64, n)]
+    return np.array([[a.genes[g] for g in GENE_NAMES] for a in agents],
+                    dtype=float).reshape(n, len(GENE_NAMES))
+
+def agent_energies(agents):
+    # Енергія агентів як масив (n,) у порядку списку
+    n = len(agents)
+    if n and all(isinstance(a, ArrayAgentView) and a._slot >= 0 for a in agents):
+        return agents[0]._arrays.energy[np.fromiter((a._slot for a in agents), np.int64, n)]
+    return np.fromiter((a.energy for a in agents), float, n)
+
+def positions(items):
+    # Позиції об'єктів як масив (n, 2)
+    n = len(items)
+    if n and all(isinstance(a, ArrayAgentView) and a._slot >= 0 for a in items):
+        return items[0]._arrays.pos[np.fromiter((a._slot for a in items), np.int64, n)]
+    return np.array([(item.pos.x, item.pos.y) for item in items], dtype=float).reshape(len(items), 2)
+
+def lineage_ids(agents):
+    n = len(agents)
+    if n and all(isinstance(a, ArrayAgentView) and a._slot >= 0 for a in agents):
+        return agents[0]._arrays.lineage[np.fromiter((a._slot for a in agents), np.int64, n)]
+    return np.fromiter((a.lineage_id for a in agents), np.int64, n)
+
+def found_lineages(agents, species):
+    # Агенти без батьків (початковий світ, додані вручну) стають засновниками власних клад
+    for agent, lineage_id in zip(agents, lineage.found(species, gene_matrix(agents), simulation_time)):
+        agent.lineage_id = int(lineage_id)
+
+def lineage_root(lineage_id):
+    row = int(lineage.rows([lineage_id])[0])
+    return int(lineage.root[row]) if row >= 0 else NO_LINEAGE
+
+def reset_lineage():
+    lineage.clear()
+    found_lineages(creatures, 'creature')
+    found_lineages(predators, 'predator')
+
+def reset_gene_ranges():
+    # Межі гістограм - з поточних схем геному: параметри могли бути перевизначені (sweep)
+    creature_gene_stats.set_ranges(creature_genome().ranges())
+    predator_gene_stats.set_ranges(predator_genome().ranges())
+
+def rebuild_gene_statistics():
+    # Після створення або завантаження світу - повний перерахунок, далі лише пачки змін
+    reset_gene_ranges()
+    creature_gene_stats.rebuild(gene_matrix(creatures))
+    predator_gene_stats.rebuild(gene_matrix(predators))
+
+def engine_step_basic(dt):
+    creature_arrays.step_basic(dt, CREATURE_ENERGY_DECAY, CREATURE_REPRODUCTION_READY_THRESHOLD)
+    predator_arrays.step_basic(dt, PREDATOR_ENERGY_DECAY, PREDATOR_REPRODUCTION_READY_THRESHOLD)
+
+def engine_apply_movement(dt):
+    creature_arrays.apply_movement(dt, CREATURE_MOVE_COST, CREATURE_RADIUS)
+    predator_arrays.apply_movement(dt, PREDATOR_MOVE_COST, PREDATOR_RADIUS)
+
+# --- Поведінка Агентів у Рушії NumPy ---
+# Векторизовані аналоги Creature.update / Predator.update: сприйняття - запити PointGrid для всього
+# виду, рішення - маски над масивами. Позиції протягом кроку не змінюються (рух застосовує
+# engine_apply_movement), тож усі агенти бачать світ на початок кроку. У Python лишаються лише
+# поодинокі події: з'їдена їжа, вполювана здобич, запити на народження. Конфлікти (двоє їдять одну
+# їжу, двоє хижаків кусають одну здобич) вирішуються на користь меншого слота.
+def random_directions(count):
+    return normalize_rows(np.random.uniform(-1, 1, (count, 2)))
+
+def engine_collide(arrays, radius):
+    # Векторизований check_obstacle_collision: агенти, що торкаються перешкод, гинуть
+    alive = np.flatnonzero(~arrays.dead[:arrays.count])
+    if not obstacles or not len(alive): return
+    if obstacle_map.covers(obstacles):
+        hit = obstacle_map.for_radius(radius).blocked_points(arrays.pos[alive])
+        arrays.dead[alive[hit]] = True
+    else:
+        for slot in alive.tolist(): arrays.views[slot].check_obstacle_collision(obstacles)
+
+def engine_separate(arrays, alive, move, ghosts, radius, force):
+    # Уникнення скупчення: середній вектор відштовхування змішується з наміром руху
+    slots = np.flatnonzero(alive)
+    pos = arrays.pos[slots]
+    grid = PointGrid(np.concatenate([pos, positions(ghosts)]))
+    vectors, counts = grid.separation(pos, radius, exclude=np.arange(len(slots)))
+    crowded = counts > 0
+    slots, away = slots[crowded], normalize_rows(vectors[crowded])
+    current = move[slots]
+    moving = (current[:, 0] != 0) | (current[:, 1] != 0)
+    move[slots] = np.where(moving[:, None], normalize_rows(current * 0.8 + away * force * 0.5), away)
+
+def engine_wander(arrays, wander, move):
+    # Випадковий рух: зрідка новий напрямок, інакше - той самий
+    slots = np.flatnonzero(wander)
+    direction = arrays.direction
+    turn = np.random.random(len(slots)) < 0.05
+    still = (direction[slots, 0] == 0) & (direction[slots, 1] == 0)
+    turned = slots[turn | still]
+    if len(turned):
+        direction[turned] = random_directions(len(turned))
+    move[slots] = direction[slots]
+
+def engine_store_movement(arrays, alive, move, speed, mult):
+    n = arrays.count
+    arrays.move_dir[:n] = np.where(alive[:, None], move, 0)
+    arrays.move_speed[:n] = speed
+    arrays.move_mult[:n] = mult
+
+def engine_match_mates(rounds=None):
+    # Векторизований match_mates: у кожному раунді пару утворюють взаємно найближчі вільні істоти
+    if rounds is None: rounds = MATE_MATCH_ROUNDS
+    arrays = creature_arrays
+    n = arrays.count
+    ready = ~arrays.dead[:n] & arrays.ready[:n]
+    handles = arrays.handle[:n]
+    partner, partner_target = arrays.partner[:n], arrays.partner_target[:n]
+    # Пара з минулих кроків ще прямує одне до одного (has_valid_mate)
+    mates = entity_handles.lookup(np.where(ready, partner, NO_HANDLE), handles)
+    kept = mates >= 0
+    kept[kept] = ready[mates[kept]] & (partner[mates[kept]] == handles[kept])
+    free = np.flatnonzero(ready & ~kept)
+    partner[free] = partner_target[free] = NO_HANDLE
+    sense = arrays.genes[:n, GENE_NAMES.index('sense')]
+
+    pairs = 0
+    for _ in range(rounds):
+        if len(free) < 2: break
+        pos = arrays.pos[free]
+        nearest, _ = PointGrid(pos).nearest(pos, sense[free], exclude=np.arange(len(free)))
+        mutual = nearest >= 0
+        mutual[mutual] = nearest[nearest[mutual]] == np.flatnonzero(mutual)
+        if not mutual.any(): break
+        chosen = free[mutual]
+        partner[chosen] = partner_target[chosen] = handles[free[nearest[mutual]]]
+        pairs += len(chosen) // 2
+        # Наступний раунд - для тих, чий найближчий сусід уже в парі
+        free = free[~mutual]
+    return pairs
+
+def engine_update_creatures(ghosts):
+    ghost_food, ghost_creatures, ghost_predators = ghosts
+    arrays = creature_arrays
+    n = arrays.count
+    if n == 0: return
+    engine_collide(arrays, CREATURE_RADIUS)
+    alive = ~arrays.dead[:n]
+    pos = arrays.pos[:n]
+    sense = arrays.genes[:n, GENE_NAMES.index('sense')]
+    speed = arrays.genes[:n, GENE_NAMES.index('speed')].copy()
+    mult = np.ones(n)
+    move = np.zeros((n, 2))
+    handles = arrays.handle[:n]
+    target, partner, partner_target = arrays.target[:n], arrays.partner[:n], arrays.partner_target[:n]
+
+    # 1. Ухилення від хижаків
+    hunters = predator_arrays
+    hunter_pos = np.concatenate([hunters.pos[:hunters.count][~hunters.dead[:hunters.count]], positions(ghost_predators)])
+    slots = np.flatnonzero(alive)
+    closest, _ = PointGrid(hunter_pos).nearest(pos[slots], sense[slots])
+    slots, closest = slots[closest >= 0], closest[closest >= 0]
+    away = pos[slots] - hunter_pos[closest]
+    slots, away = slots[(away != 0).any(axis=1)], away[(away != 0).any(axis=1)]
+    evading = np.zeros(n, dtype=bool)
+    evading[slots] = True
+    move[slots] = normalize_rows(away)
+    speed[slots] *= 1.2
+    mult[slots] = 1.5
+    target[slots] = partner[slots] = partner_target[slots] = NO_HANDLE
+
+    # 2. Спарювання з партнером, призначеним на цьому кроці match_mates
+    seeking = alive & ~evading & arrays.ready[:n]
+    mates = entity_handles.lookup(np.where(seeking, partner, NO_HANDLE), handles)
+    paired = np.flatnonzero(mates >= 0)
+    other = mates[paired]
+    valid = alive[other] & arrays.ready[other] & (partner[other] == handles[paired])
+    paired, other = paired[valid], other[valid]
+    dist_sq = np.einsum('ij,ij->i', pos[other] - pos[paired], pos[other] - pos[paired])
+    close = dist_sq < CREATURE_MATING_RANGE ** 2
+    approach = ~close & (dist_sq < sense[paired] ** 2)
+    mating = np.zeros(n, dtype=bool)
+    mating[paired[close | approach]] = True
+    move[paired[approach]] = normalize_rows(pos[other[approach]] - pos[paired[approach]])
+    # Пара поруч: нащадка запитує менший слот пари, поки є місце під лімітом
+    first = paired[close & (paired < other)]
+    second = mates[first]
+    room = MAX_CREATURES - len(creatures) - len(creatures_to_add_global) - len(creature_births)
+    first, second = first[:max(room, 0)], second[:max(room, 0)]
+    views = arrays.views
+    for a, b in zip(first.tolist(), second.tolist()):
+        parent1, parent2 = (views[a], views[b]) if handles[a] < handles[b] else (views[b], views[a])
+        request_reproduction(parent1, parent2)
+    for couple in (first, second):
+        arrays.cooldown[couple] = CREATURE_MATING_COOLDOWN
+        arrays.ready[couple] = False
+    # Без місця під лімітом пара розпадається, але кулдаун не витрачається; втрачені партнери скидаються
+    lost = seeking.copy()
+    lost[paired[approach]] = False
+    partner[lost] = partner_target[lost] = NO_HANDLE
+
+    # 3. Пошук їжі
+    feeding = alive & ~evading & ~mating
+    food_items = food_list + list(ghost_food)
+    food_pos = positions(food_items)
+    food_handles = np.fromiter((item.handle for item in food_items), np.int64, len(food_items))
+    food_alive = np.fromiter((not item.is_dead for item in food_items), bool, len(food_items))
+    rows = entity_handles.lookup(np.where(feeding, target, NO_HANDLE), food_handles)
+    slots = np.flatnonzero(rows >= 0)
+    rows = rows[slots]
+    slots, rows = slots[food_alive[rows]], rows[food_alive[rows]]
+    dist_sq = np.einsum('ij,ij->i', food_pos[rows] - pos[slots], food_pos[rows] - pos[slots])
+    eat = dist_sq < (CREATURE_RADIUS + FOOD_RADIUS) ** 2
+    follow = ~eat & (dist_sq < sense[slots] ** 2)
+    keep = np.zeros(n, dtype=bool)
+    keep[slots[follow]] = True
+    target[feeding & ~keep] = NO_HANDLE
+    move[slots[follow]] = normalize_rows(food_pos[rows[follow]] - pos[slots[follow]])
+    eaten, winners = np.unique(rows[eat], return_index=True)
+    arrays.energy[slots[eat][winners]] += FOOD_ENERGY
+    for row in eaten.tolist():
+        food_items[row].is_dead = True
+        food_to_remove_global.add(food_items[row])
+    food_alive[eaten] = False
+    # Нову ціль шукають ті, хто не мав живої цілі або програв їжу іншому
+    searching = feeding.copy()
+    searching[slots[~eat]] = False
+    searching[slots[eat][winners]] = False
+    if food_list:
+        slots = np.flatnonzero(searching)
+        closest, _ = PointGrid(food_pos).nearest(pos[slots], sense[slots], valid=food_alive)
+        slots, closest = slots[closest >= 0], closest[closest >= 0]
+        target[slots] = food_handles[closest]
+        move[slots] = normalize_rows(food_pos[closest] - pos[slots])
+
+    # 4. Уникнення скупчення (Separation)
+    engine_separate(arrays, alive, move, ghost_creatures, CREATURE_SEPARATION_RADIUS, CREATURE_SEPARATION_FORCE)
+
+    # 5. Випадковий рух
+    idle = (move[:, 0] == 0) & (move[:, 1] == 0)
+    engine_wander(arrays, alive & ~evading & ~mating & (target == NO_HANDLE) & idle, move)
+    engine_store_movement(arrays, alive, move, speed, mult)
+
+def engine_update_predators(ghosts):
+    ghost_food, ghost_creatures, ghost_predators = ghosts
+    arrays = predator_arrays
+    n = arrays.count
+    if n == 0: return
+    engine_collide(arrays, PREDATOR_RADIUS)
+    alive = ~arrays.dead[:n]
+    pos = arrays.pos[:n]
+    sense = arrays.genes[:n, GENE_NAMES.index('sense')]
+    speed = arrays.genes[:n, GENE_NAMES.index('speed')]
+    move = np.zeros((n, 2))
+    target = arrays.target[:n]
+
+    # 1. Пошук здобичі: здобич - живі істоти цього тайлу та копії з сусідніх
+    prey = creature_arrays
+    prey_count = prey.count
+    prey_pos = np.concatenate([prey.pos[:prey_count], positions(ghost_creatures)])
+    prey_handles = np.concatenate([prey.handle[:prey_count], np.fromiter((g.handle for g in ghost_creatures), np.int64, len(ghost_creatures))])
+    prey_alive = np.concatenate([~prey.dead[:prey_count], np.fromiter((not g.is_dead for g in ghost_creatures), bool, len(ghost_creatures))])
+    rows = entity_handles.lookup(np.where(alive, target, NO_HANDLE), prey_handles)
+    slots = np.flatnonzero(rows >= 0)
+    rows = rows[slots]
+    slots, rows = slots[prey_alive[rows]], rows[prey_alive[rows]]
+    dist_sq = np.einsum('ij,ij->i', prey_pos[rows] - pos[slots], prey_pos[rows] - pos[slots])
+    seen = dist_sq < sense[slots] ** 2
+    slots, rows, dist_sq = slots[seen], rows[seen], dist_sq[seen]
+    bite = dist_sq < (PREDATOR_RADIUS + CREATURE_RADIUS) ** 2
+    chasing = np.zeros(n, dtype=bool)
+    chasing[slots[~bite]] = True
+    target[alive & ~chasing] = NO_HANDLE
+    move[slots[~bite]] = normalize_rows(prey_pos[rows[~bite]] - pos[slots[~bite]])
+    caught, winners = np.unique(rows[bite], return_index=True)
+    arrays.energy[slots[bite][winners]] += PREDATOR_HUNT_ENERGY_GAIN
+    for row in caught.tolist():
+        victim = prey.views[row] if row < prey_count else ghost_creatures[row - prey_count]
+        victim.is_dead = True
+        creatures_to_remove_global.add(victim)
+    prey_alive[caught] = False
+    # Нову здобич шукають усі, хто не переслідує (і ті, хто щойно вполював)
+    if creatures:
+        slots = np.flatnonzero(alive & ~chasing)
+        closest, _ = PointGrid(prey_pos).nearest(pos[slots], sense[slots], valid=prey_alive)
+        slots, closest = slots[closest >= 0], closest[closest >= 0]
+        target[slots] = prey_handles[closest]
+        chasing[slots] = True
+        move[slots] = normalize_rows(prey_pos[closest] - pos[slots])
+
+    # 2. Уникнення скупчення хижаків
+    engine_separate(arrays, alive, move, ghost_predators, PREDATOR_SEPARATION_RADIUS, PREDATOR_SEPARATION_FORCE)
+
+    # 3. Випадковий рух
+    idle = (move[:, 0] == 0) & (move[:, 1] == 0)
+    engine_wander(arrays, alive & ~chasing & idle, move)
+    engine_store_movement(arrays, alive, move, speed, np.ones(n))
+
+    # Розмноження хижаків (асексуальне), поки є місце під лімітом
+    parents = np.flatnonzero(alive & arrays.ready[:n])
+    room = MAX_PREDATORS - len(predators) - len(predators_to_add_global) - len(predator_births)
+    parents = parents[:max(room, 0)]
+    arrays.energy[parents] -= PREDATOR_REPRODUCTION_COST
+    arrays.cooldown[parents] = PREDATOR_MATING_COOLDOWN
+    arrays.ready[parents] = False
+    for slot in parents.tolist(): request_reproduction(arrays.views[slot], None)
+
+def reset_engine_arrays():
+    # Новий світ отримує нові масиви; представлення старого світу лишаються прив'язаними
+    # до своїх (незмінних) масивів і читабельними - без O(n) від'єднання кожного агента
+    global creature_arrays, predator_arrays
+    creature_arrays = SpeciesArrays()
+    predator_arrays = SpeciesArrays()
+
+
 # --- Глобальні Списки та Об'єкти ---
 # Ініціалізуємо порожніми перед спробою завантаження
 obstacles = []
@@ -602,81 +2756,318 @@ creatures = []
 predators = []
 food_list = []
 
-creatures_to_remove_global = []
-predators_to_remove_global = []
-food_to_remove_global = []
+# Множини: перевірка "вже позначено" та видалення не сканують списки
+creatures_to_remove_global = set()
+predators_to_remove_global = set()
+food_to_remove_global = set()
 creatures_to_add_global = []
 predators_to_add_global = []
+# Запити на розмноження за крок: (батько, партнер або None, місце народження); гени
+# нащадків обчислюються пакетом у resolve_births
+creature_births = []
+predator_births = []
+
+world_index = WorldIndex()
 
 selected_agent = None
 running = True
 paused = False
+show_charts = True
+show_profile = False
+speed_index = 0 # Індекс у SPEED_MULTIPLIERS
 
 # --- Функція для Запиту на Розмноження ---
-def request_reproduction(parent1, parent2, child_genes):
+def population_has_room(parent):
+    # Чи є місце під лімітом виду з урахуванням запитів цього кроку та тих, що будуть додані.
+    # Перевіряється до витрати енергії, щоб зайві нащадки не створювались узагалі
+    if isinstance(parent, Creature):
+        return len(creatures) + len(creatures_to_add_global) + len(creature_births) < MAX_CREATURES
+    return len(predators) + len(predators_to_add_global) + len(predator_births) < MAX_PREDATORS
+
+def request_reproduction(parent1, parent2=None):
+    # Нащадок з'явиться на місці батька в resolve_births наприкінці оновлення
+    if not population_has_room(parent1): return
+    births = creature_births if isinstance(parent1, Creature) else predator_births
+    births.append((parent1, parent2, pygame.Vector2(parent1.pos)))
+
+def resolve_births():
+    # Гени всіх нащадків кроку - одним пакетом на вид: схрещування (якщо є партнер) та мутація
+    # як операції над матрицями генів батьків, потім лише створення агентів з готовими генами
     global max_creature_generation, max_predator_generation
-
-    if isinstance(parent1, Creature):
-        # Перевіряємо ліміт з урахуванням тих, що будуть додані
-        if len(creatures) + len(creatures_to_add_global) < MAX_CREATURES:
-            parent_gen = parent1.generation
-            # Передаємо obstacles при створенні
-            new_creature = Creature(obstacles, pos=parent1.pos, genes=child_genes, parent_generation=parent_gen)
-            creatures_to_add_global.append(new_creature)
-            max_creature_generation = max(max_creature_generation, new_creature.generation)
-    elif isinstance(parent1, Predator):
-         if len(predators) + len(predators_to_add_global) < MAX_PREDATORS:
-            parent_gen = parent1.generation
-            # Передаємо obstacles при створенні
-            new_predator = Predator(obstacles, pos=parent1.pos, genes=child_genes, parent_generation=parent_gen)
-            predators_to_add_global.append(new_predator)
-            max_predator_generation = max(max_predator_generation, new_predator.generation)
+    for births, kind, make, genome, added in [
+            (creature_births, 'creature', make_creature, creature_genome(), creatures_to_add_global),
+            (predator_births, 'predator', make_predator, predator_genome(), predators_to_add_global)]:
+        if not births: continue
+        parents = [parent1 for parent1, _, _ in births]
+        genes = gene_matrix(parents)
+        if any(parent2 is not None for _, parent2, _ in births):
+            partners = [parent2 if parent2 is not None else parent1 for parent1, parent2, _ in births]
+            genes = genome.crossover(genes, gene_matrix(partners))
+        genes = genome.mutate(genes)
+        children = []
+        for (parent1, parent2, pos), row in zip(births, genes.tolist()):
+            child = make(obstacles, pos=pos, genes=dict(zip(GENE_NAMES, row)),
+                         parent_generation=parent1.generation)
+            child.lineage_id = lineage.birth(kind, row, parent1.lineage_id,
+                                             parent2.lineage_id if parent2 is not None else NO_LINEAGE,
+                                             simulation_time)
+            children.append(child)
+        added.extend(children)
+        top = max(child.generation for child in children)
+        if kind == 'creature': max_creature_generation = max(max_creature_generation, top)
+        else: max_predator_generation = max(max_predator_generation, top)
+        births.clear()
+
+def spawn_food():
+    # Нова їжа у світі; шар їжі рендерера оновиться лише в цій області
+    item = Food(obstacles)
+    food_list.append(item)
+    world_index.food.insert(item) # Видима рендереру ще до наступної перебудови індексу
+    profiler.count('food_spawned')
+    renderer.mark_food(item)
+    return item
 
 
 # --- Функції Збереження/Завантаження ---
-# ... (залишаються практично без змін, але тепер використовують vars()) ...
-def save_simulation_state(filename="evolution_sim_save.pkl"):
-    # Додамо try-except для vars, якщо об'єкт ще не повністю ініціалізований
-    def get_vars_safe(obj):
-        try: return vars(obj)
-        except TypeError: return {}
-
-    state_data = {
-        'creatures': [get_vars_safe(c) for c in creatures],
-        'predators': [get_vars_safe(p) for p in predators],
-        'food_list': [get_vars_safe(f) for f in food_list],
-        'obstacles_rects': [obs.rect for obs in obstacles if hasattr(obs, 'rect')],
-        'max_creature_generation': max_creature_generation,
-        'max_predator_generation': max_predator_generation,
-        'simulation_time': simulation_time,
-        'history_time': history_time,
-        'history_creature_pop': history_creature_pop,
-        'history_predator_pop': history_predator_pop,
-        'history_avg_creature_speed': history_avg_creature_speed,
-        'history_avg_creature_sense': history_avg_creature_sense,
-        'history_avg_predator_speed': history_avg_predator_speed,
-        'history_avg_predator_sense': history_avg_predator_sense,
-        'last_log_time': last_log_time,
+# Знімок - версіонований .npz: типізовані колонки для кожного виду (позиції, енергія, гени,
+# дескриптори та посилання на цілі) плюс ряди історії. Збереження не серіалізує об'єкти,
+# а завантаження не викликає конструкторів і не розміщує агентів випадково.
+SNAPSHOT_VERSION = 2
+DEFAULT_SAVE_FILE = "evolution_sim_save.npz"
+NO_HANDLE = -1
+# колонка знімка -> атрибут агента (ті самі імена, що й поля SpeciesArrays)
+AGENT_COLUMNS = {'pos': 'pos', 'direction': 'direction', 'energy': 'energy', 'age': 'age',
+                 'max_age': 'max_age', 'cooldown': 'mating_cooldown_timer', 'generation': 'generation',
+                 'ready': 'ready_to_mate', 'dead': 'is_dead'}
+AGENT_COLUMN_TYPES = {'pos': float, 'direction': float, 'energy': float, 'age': float, 'max_age': float,
+                      'cooldown': float, 'generation': np.int64, 'ready': bool, 'dead': bool}
+SPECIES_REFS = {'creatures': ('target_food_obj', 'target_partner', 'mating_partner'),
+                'predators': ('target_creature',)}
+
+def agent_columns(agents, refs):
+    n = len(agents)
+    if n and all(isinstance(a, ArrayAgentView) and a._slot >= 0 for a in agents):
+        # Рушій NumPy: колонки - це вибірка рядків масивів виду в порядку списку
+        arrays = agents[0]._arrays
+        slots = np.fromiter((a._slot for a in agents), np.int64, n)
+        columns = {name: getattr(arrays, name)[slots] for name in list(AGENT_COLUMNS) + ['genes', 'handle', 'lineage']}
+        fields = type(agents[0]).ARRAY_HANDLES
+        for ref in refs:
+            columns['ref.' + ref] = getattr(arrays, fields[ref + '_handle'])[slots]
+        return columns
+    columns = {}
+    for column, attr in AGENT_COLUMNS.items():
+        if column in ('pos', 'direction'):
+            vectors = [getattr(a, attr) for a in agents]
+            columns[column] = np.array([(v.x, v.y) for v in vectors], dtype=float).reshape(n, 2)
+        else:
+            columns[column] = np.fromiter((getattr(a, attr) for a in agents), AGENT_COLUMN_TYPES[column], n)
+    columns['genes'] = gene_matrix(agents)
+    columns['handle'] = np.fromiter((a.handle for a in agents), np.int64, n)
+    columns['lineage'] = lineage_ids(agents)
+    for ref in refs:
+        key = ref + '_handle'
+        columns['ref.' + ref] = np.fromiter(
+            (NO_HANDLE if h is None else h for h in (getattr(a, key, None) for a in agents)), np.int64, n)
+    return columns
+
+def snapshot_arrays():
+    # Увесь стан світу як словник масивів (ключ "група.поле")
+    data = {
+        'meta.version': np.array(SNAPSHOT_VERSION),
+        'meta.gene_names': np.array(GENE_NAMES),
+        'meta.simulation_time': np.array(simulation_time),
+        'meta.last_log_time': np.array(last_log_time),
+        'meta.max_creature_generation': np.array(max_creature_generation),
+        'meta.max_predator_generation': np.array(max_predator_generation),
+        'meta.world_size': np.array((WIDTH, HEIGHT)),
+        'obstacles.rects': np.array([tuple(obs.rect) for obs in obstacles], dtype=np.int32).reshape(len(obstacles), 4),
+        'food.pos': np.array([(f.pos.x, f.pos.y) for f in food_list], dtype=float).reshape(len(food_list), 2),
+        'food.handle': np.fromiter((f.handle for f in food_list), np.int64, len(food_list)),
     }
+    data['handles.generations'], data['handles.free'] = entity_handles.export_state()
+    data.update(lineage.export_state())
+    for species, agents in (('creatures', creatures), ('predators', predators)):
+        for name, column in agent_columns(agents, SPECIES_REFS[species]).items():
+            data[f'{species}.{name}'] = column
+    for name in telemetry.names:
+        data['history.' + name] = np.array(telemetry.series(name))
+    return data
+
+def write_snapshot_atomic(filename, data):
+    # Запис у тимчасовий файл + fsync + os.replace: на диску завжди або старий, або новий знімок
+    tmp_name = filename + '.tmp'
+    with open(tmp_name, 'wb') as f:
+        np.savez(f, **data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_name, filename)
+    try: # fsync каталогу, щоб перейменування пережило збій (не на всіх ОС)
+        dir_fd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+        try: os.fsync(dir_fd)
+        finally: os.close(dir_fd)
+    except OSError:
+        pass
+
+def save_simulation_state(filename=DEFAULT_SAVE_FILE):
     try:
-        with open(filename, 'wb') as f:
-            pickle.dump(state_data, f)
+        write_snapshot_atomic(filename, snapshot_arrays())
         print(f"Стан симуляції збережено у {filename}")
     except Exception as e:
         print(f"Помилка збереження стану: {e}")
 
-def load_simulation_state(filename="evolution_sim_save.pkl"):
+def restore_agents(cls, view_cls, arrays, columns, saved_gene_names, refs):
+    # Агенти виду з колонок знімка: без конструкторів, випадкових позицій та мутацій
+    n = len(columns['energy'])
+    midpoint = cls.genome().midpoint()
+    genes = np.empty((n, len(GENE_NAMES)))
+    for i, name in enumerate(GENE_NAMES):
+        if name in saved_gene_names:
+            genes[:, i] = columns['genes'][:, saved_gene_names.index(name)]
+        else: # Ген, якого не було під час збереження - середина діапазону виду
+            genes[:, i] = midpoint[i]
+
+    if USE_NUMPY_ENGINE:
+        # Колонки (разом з посиланнями на цілі) пишуться прямо в масиви виду; представлення -
+        # лише оболонки зі слотом, колір кожне рахує при першому читанні
+        loaded = dict(columns, genes=genes)
+        for ref in refs:
+            loaded[view_cls.ARRAY_HANDLES[ref + '_handle']] = columns['ref.' + ref]
+        arrays.load_columns(loaded, n)
+        agents = [view_cls.__new__(view_cls) for _ in range(n)]
+        for slot, view in enumerate(agents): view.bind(arrays, slot)
+        arrays.views = list(agents)
+        entity_handles.place_many(columns['handle'], agents)
+        return agents
+
+    # Рушій об'єктів: кожен агент - окремий об'єкт з векторами та словником генів, тож
+    # завантаження лишається циклом Python, лінійним за кількістю агентів (див. README)
+    constants = cls.species_constants()
+    colors = cls.colors_for(*(genes[:, GENE_NAMES.index(g)] for g in ('speed', 'sense'))) or [constants['color']] * n
+    # Знімки без родоводу: агенти стають засновниками після відновлення (restore_snapshot)
+    lineages = columns['lineage'].tolist() if 'lineage' in columns else [NO_LINEAGE] * n
+    refs = {ref: [None if h == NO_HANDLE else h for h in columns['ref.' + ref].tolist()] for ref in refs}
+    ref_keys = [(ref + '_handle', values) for ref, values in refs.items()]
+    handles = columns['handle'].tolist()
+
+    agents = []
+    pos, direction = columns['pos'].tolist(), columns['direction'].tolist()
+    scalars = [(attr, columns[column].tolist()) for column, attr in AGENT_COLUMNS.items()
+               if column not in ('pos', 'direction')]
+    gene_rows = genes.tolist()
+    for i in range(n):
+        agent = cls.__new__(cls)
+        for attr, values in scalars: setattr(agent, attr, values[i])
+        for key, values in ref_keys: setattr(agent, key, values[i])
+        agent.pos = pygame.Vector2(pos[i])
+        agent.direction = pygame.Vector2(direction[i])
+        agent.genes = dict(zip(GENE_NAMES, gene_rows[i]))
+        agent.lineage_id = lineages[i]
+        agent.color = colors[i]
+        agent.handle = handles[i]
+        agents.append(agent)
+    entity_handles.place_many(columns['handle'], agents)
+    return agents
+
+@contextlib.contextmanager
+def gc_paused():
+    # Масове створення об'єктів без проходів циклічного збирача сміття: кожен прохід обходить
+    # усі живі об'єкти, тож на 100 тис. агентів збирач займав більшу частину завантаження
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled: gc.enable()
+
+def restore_snapshot(data):
+    global creatures, predators, food_list, obstacles, WIDTH, HEIGHT
+    global max_creature_generation, max_predator_generation, simulation_time, last_log_time
+    global selected_agent
+    version = int(data['meta.version'])
+    if version > SNAPSHOT_VERSION:
+        raise ValueError(f"Знімок версії {version} новіший за підтримувану ({SNAPSHOT_VERSION})")
+
+    reset_engine_arrays()
+    # Таблиця дескрипторів відновлюється повністю: об'єкти повертаються на свої дескриптори,
+    # тож посилання на цілі не потребують перепризначення, а подальший хід симуляції не змінюється
+    entity_handles.import_state(data['handles.generations'], data['handles.free'])
+    if 'meta.world_size' in data: # Старіші знімки - світ розміром з вікно за замовчуванням
+        WIDTH, HEIGHT = (int(v) for v in data['meta.world_size'])
+        camera.reset()
+    obstacles = [Obstacle.from_rect(rect) for rect in data['obstacles.rects'].tolist()]
+    obstacle_map.build(obstacles)
+    saved_gene_names = [str(g) for g in data['meta.gene_names']]
+    species_lists = {}
+    with gc_paused():
+        food_list = [Food.restore(x, y, h) for (x, y), h in zip(data['food.pos'].tolist(), data['food.handle'].tolist())]
+        for species, cls, view_cls, arrays in (('creatures', Creature, CreatureView, creature_arrays),
+                                               ('predators', Predator, PredatorView, predator_arrays)):
+            prefix = species + '.'
+            columns = {k[len(prefix):]: v for k, v in data.items() if k.startswith(prefix)}
+            species_lists[species] = restore_agents(cls, view_cls, arrays, columns, saved_gene_names, SPECIES_REFS[species])
+    creatures = species_lists['creatures']
+    predators = species_lists['predators']
+
+    # Версія 1 зберігала ряди під іменами глобальних списків (history.history_time, ...)
+    history_prefix = 'history.' if version >= 2 else 'history.history_'
+    telemetry.load_series({name: data[history_prefix + name] for name in telemetry.names
+                           if history_prefix + name in data})
+    simulation_time = float(data['meta.simulation_time'])
+    last_log_time = float(data['meta.last_log_time'])
+    max_creature_generation = int(data['meta.max_creature_generation'])
+    max_predator_generation = int(data['meta.max_predator_generation'])
+    rebuild_gene_statistics()
+    if 'lineage.id' in data: lineage.import_state(data)
+    else: reset_lineage()
+
+    creatures_to_remove_global.clear()
+    predators_to_remove_global.clear()
+    food_to_remove_global.clear()
+    creatures_to_add_global.clear()
+    predators_to_add_global.clear()
+    creature_births.clear()
+    predator_births.clear()
+    selected_agent = None
+    world_index.stale = True # Перебудується перед першим кроком, кадром чи кліком
+    renderer.invalidate()
+
+def load_simulation_state(filename=DEFAULT_SAVE_FILE):
+    # Знімок .npz (zip-архів) або збереження старого формату (pickle словників vars())
+    print(f"Спроба завантаження стану з {filename}...")
+    try:
+        with open(filename, 'rb') as f:
+            is_snapshot = f.read(2) == b'PK'
+        if not is_snapshot:
+            return load_pickle_state(filename)
+        with np.load(filename, allow_pickle=False) as archive:
+            restore_snapshot({key: archive[key] for key in archive.files})
+        print(f"Стан симуляції успішно завантажено з {filename}: істот {len(creatures)}, "
+              f"хижаків {len(predators)}, їжі {len(food_list)}")
+        return True
+    except FileNotFoundError:
+        print(f"Файл збереження {filename} не знайдено. Початок нової симуляції.")
+        init_new_world()
+        return False
+    except Exception as e:
+        print(f"Критична помилка завантаження стану: {e}")
+        init_new_world()
+        return False
+
+def load_pickle_state(filename):
+    # Завантаження збережень старого формату (.pkl) - лише для сумісності
     global creatures, predators, food_list, obstacles
     global max_creature_generation, max_predator_generation, simulation_time
-    global history_time, history_creature_pop, history_predator_pop
-    global history_avg_creature_speed, history_avg_creature_sense
-    global history_avg_predator_speed, history_avg_predator_sense, last_log_time
-
-    print(f"Спроба завантаження стану з {filename}...") # Відлагодження
+    global last_log_time
 
     try:
         with open(filename, 'rb') as f:
             state_data = pickle.load(f)
+        reset_engine_arrays()
+        entity_handles.clear()
+        # Збережений дескриптор -> відновлений об'єкт; посилання (*_handle) перепризначаються в кінці
+        restored_by_handle = {}
+        handle_refs = []
 
         # --- Відновлення Об'єктів ---
         print("Відновлення перешкод...")
@@ -695,6 +3086,7 @@ def load_simulation_state(filename="evolution_sim_save.pkl"):
              print("  Перешкоди не знайдено у збереженні, створення стандартних...")
              obstacles = [Obstacle() for _ in range(NUM_OBSTACLES)]
         print(f"  Відновлено/Створено {len(obstacles)} перешкод.")
+        obstacle_map.build(obstacles)
 
 
         print("Відновлення їжі...")
@@ -708,8 +3100,8 @@ def load_simulation_state(filename="evolution_sim_save.pkl"):
                 pos_data = food_data.get('pos', (0,0))
                 if isinstance(pos_data, (tuple, list, pygame.Vector2)):
                      f.pos = pygame.Vector2(pos_data)
-                     f.rect.center = f.pos # Оновлюємо rect
                      food_list.append(f)
+                     if food_data.get('handle') is not None: restored_by_handle[food_data['handle']] = f
                 else: print(f"  Пропущено невірні дані позиції для їжі {i}: {pos_data}")
             except Exception as e: print(f"  Помилка відновлення їжі {i}: {e}")
         print(f"  Відновлено {len(food_list)} одиниць їжі.")
@@ -721,7 +3113,7 @@ def load_simulation_state(filename="evolution_sim_save.pkl"):
         for i, creature_data in enumerate(saved_creatures):
             try:
                 # 1. Створюємо об'єкт (конструктор встановить випадкову позицію)
-                c = Creature(obstacles)
+                c = make_creature(obstacles)
                 final_pos = None # Для збереження відновленої позиції
 
                 # 2. Встановлюємо атрибути зі збережених даних
@@ -734,7 +3126,11 @@ def load_simulation_state(filename="evolution_sim_save.pkl"):
                         else: print(f"  Істота {i}: Невірний тип для 'pos': {value}")
                     elif key == 'direction':
                          setattr(c, key, pygame.Vector2(value) if isinstance(value, (tuple, list, pygame.Vector2)) else pygame.Vector2(0,0) )
-                    elif key in ['rect', 'obstacles', 'target_food_obj', 'target_partner', 'mating_partner']:
+                    elif key == 'handle':
+                         restored_by_handle[value] = c
+                    elif key.endswith('_handle'):
+                         handle_refs.append((c, key, value))
+                    elif key in ['rect', 'obstacles', 'radius', 'target_food_obj', 'target_partner', 'mating_partner']:
                          # Ігноруємо атрибути, які не потрібно/не можна відновлювати напряму
                          pass
                     elif hasattr(c, key):
@@ -750,8 +3146,7 @@ def load_simulation_state(filename="evolution_sim_save.pkl"):
                     # але виводимо попередження
                     print(f"  ПОПЕРЕДЖЕННЯ: Істота {i}: Позиція не завантажена, використано випадкову: {c.pos}")
 
-                # 4. Оновлюємо rect та колір на основі фінальних даних
-                c.rect.center = c.pos
+                # 4. Оновлюємо колір на основі фінальних даних (rect виводиться з pos)
                 c.update_color()
                 creatures.append(c)
             except Exception as e: print(f"  Критична помилка відновлення істоти {i}: {e}")
@@ -764,7 +3159,7 @@ def load_simulation_state(filename="evolution_sim_save.pkl"):
         saved_predators = state_data.get('predators', [])
         for i, predator_data in enumerate(saved_predators):
              try:
-                 p = Predator(obstacles)
+                 p = make_predator(obstacles)
                  final_pos = None
                  for key, value in predator_data.items():
                      if key == 'pos':
@@ -773,7 +3168,9 @@ def load_simulation_state(filename="evolution_sim_save.pkl"):
                           else: print(f"  Хижак {i}: Невірний тип для 'pos': {value}")
                      elif key == 'direction':
                           setattr(p, key, pygame.Vector2(value) if isinstance(value, (tuple, list, pygame.Vector2)) else pygame.Vector2(0,0) )
-                     elif key in ['rect', 'obstacles', 'target_creature']: pass
+                     elif key == 'handle': restored_by_handle[value] = p
+                     elif key.endswith('_handle'): handle_refs.append((p, key, value))
+                     elif key in ['rect', 'obstacles', 'radius', 'target_creature']: pass
                      elif hasattr(p, key):
                           try: setattr(p, key, value)
                           except Exception as e_set: print(f"  Хижак {i}: Помилка setattr для {key}={value}: {e_set}")
@@ -783,24 +3180,23 @@ def load_simulation_state(filename="evolution_sim_save.pkl"):
                  else:
                      print(f"  ПОПЕРЕДЖЕННЯ: Хижак {i}: Позиція не завантажена, використано випадкову: {p.pos}")
 
-                 p.rect.center = p.pos
                  predators.append(p)
              except Exception as e: print(f"  Критична помилка відновлення хижака {i}: {e}")
         print(f"  Відновлено {len(predators)} хижаків.")
 
+        # Цілі та партнери: старі дескриптори -> дескриптори відновлених об'єктів
+        for obj, key, old_handle in handle_refs:
+            target = restored_by_handle.get(old_handle)
+            setattr(obj, key, target.handle if target is not None else None)
+
 
         # Відновлення глобальних змінних та історії
         print("Відновлення глобальних параметрів та історії...")
         max_creature_generation = state_data.get('max_creature_generation', 0)
         max_predator_generation = state_data.get('max_predator_generation', 0)
         simulation_time = state_data.get('simulation_time', 0.0)
-        history_time = state_data.get('history_time', [])
-        history_creature_pop = state_data.get('history_creature_pop', [])
-        history_predator_pop = state_data.get('history_predator_pop', [])
-        history_avg_creature_speed = state_data.get('history_avg_creature_speed', [])
-        history_avg_creature_sense = state_data.get('history_avg_creature_sense', [])
-        history_avg_predator_speed = state_data.get('history_avg_predator_speed', [])
-        history_avg_predator_sense = state_data.get('history_avg_predator_sense', [])
+        telemetry.load_series({name: state_data['history_' + name] for name in telemetry.names
+                               if 'history_' + name in state_data})
         last_log_time = state_data.get('last_log_time', -log_interval)
         print("  Глобальні параметри та історія відновлені.")
 
@@ -811,67 +3207,265 @@ def load_simulation_state(filename="evolution_sim_save.pkl"):
         food_to_remove_global.clear()
         creatures_to_add_global.clear()
         predators_to_add_global.clear()
+        creature_births.clear()
+        predator_births.clear()
         # Скидаємо вибір
         global selected_agent
         selected_agent = None
+        rebuild_gene_statistics()
+        reset_lineage()
+        world_index.rebuild(food_list, creatures, predators)
+        renderer.invalidate()
 
         return True
 
     except FileNotFoundError:
         print(f"Файл збереження {filename} не знайдено. Початок нової симуляції.")
-        # Ініціалізуємо стандартні значення
-        obstacles = [Obstacle() for _ in range(NUM_OBSTACLES)]
-        creatures = [Creature(obstacles) for _ in range(INITIAL_CREATURES)]
-        predators = [Predator(obstacles) for _ in range(INITIAL_PREDATORS)]
-        food_list = [Food(obstacles) for _ in range(FOOD_COUNT)]
-        max_creature_generation = 0
-        max_predator_generation = 0
-        simulation_time = 0.0
-        history_time.clear(); history_creature_pop.clear(); history_predator_pop.clear()
-        history_avg_creature_speed.clear(); history_avg_creature_sense.clear()
-        history_avg_predator_speed.clear(); history_avg_predator_sense.clear()
-        last_log_time = -log_interval
-        selected_agent = None
+        init_new_world()
         return False
     except Exception as e:
         print(f"Критична помилка завантаження стану: {e}")
         # Скидаємо до стандартних значень
-        obstacles = [Obstacle() for _ in range(NUM_OBSTACLES)]
-        creatures = [Creature(obstacles) for _ in range(INITIAL_CREATURES)]
-        predators = [Predator(obstacles) for _ in range(INITIAL_PREDATORS)]
-        food_list = [Food(obstacles) for _ in range(FOOD_COUNT)]
-        # Скинути інші глобальні змінні...
-        max_creature_generation = 0; max_predator_generation = 0; simulation_time = 0.0; last_log_time = -log_interval; history_time.clear(); # і т.д.
-        selected_agent = None
+        init_new_world()
+        return False
+
+# --- Автозбереження ---
+# Головний цикл лише знімає копію стану (snapshot_arrays), а стиснення різниці, запис, fsync
+# та ротацію виконує фоновий потік. Кожна AUTOSAVE_FULL_EVERY-та контрольна точка повна,
+# між ними пишуться дельти: лише масиви, що змінилися відносно останньої повної точки,
+# а для рядів історії - тільки нові значення.
+def checkpoint_delta(data, base, base_seq):
+    delta = {'delta.base_seq': np.array(base_seq)}
+    for key, arr in data.items():
+        old = base.get(key)
+        if key.startswith('meta.') or old is None:
+            delta[key] = arr
+        elif old.shape == arr.shape and old.dtype == arr.dtype and np.array_equal(old, arr):
+            continue
+        elif key.startswith('history.') and len(arr) >= len(old) and np.array_equal(arr[:len(old)], old):
+            delta['tail.' + key] = arr[len(old):]
+        else:
+            delta[key] = arr
+    return delta
+
+def apply_checkpoint_delta(base, delta):
+    data = dict(base)
+    for key, arr in delta.items():
+        if key.startswith('tail.'):
+            name = key[len('tail.'):]
+            data[name] = np.concatenate([base[name], arr])
+        elif not key.startswith('delta.'):
+            data[key] = arr
+    return data
+
+class Autosaver:
+    FILE_FORMAT = "checkpoint_{seq:06d}_{kind}.npz"
+
+    def __init__(self, directory=AUTOSAVE_DIR, interval=AUTOSAVE_INTERVAL,
+                 full_every=AUTOSAVE_FULL_EVERY, keep=AUTOSAVE_KEEP):
+        self.directory = directory
+        self.interval = interval # секунди реального часу; 0 або None - вимкнено
+        self.full_every = max(1, full_every)
+        self.keep = max(1, keep)
+        self.last_save = time.monotonic()
+        self.seq = None
+        self.since_full = 0
+        self.base = None # Масиви останньої повної точки (для дельт), живуть лише у фоновому потоці
+        self.base_seq = None
+        self.jobs = queue.Queue()
+        self.worker = None
+
+    @property
+    def busy(self):
+        # Запис у черзі або триває. Лічильник черги збільшує put() і зменшує task_done() лише після
+        # запису, обидва під замком черги: окремий прапорець, який потік скидав після task_done(),
+        # міг скинутись між busy.set() і put() наступної точки
+        return self.jobs.unfinished_tasks > 0
+
+    def _ensure_worker(self):
+        if self.worker is None or not self.worker.is_alive():
+            self.worker = threading.Thread(target=self._run, name="autosave", daemon=True)
+            self.worker.start()
+
+    def _next_seq(self):
+        if self.seq is None:
+            # Продовжуємо нумерацію файлів, що вже є в каталозі
+            self.seq = max((seq for seq, _, _ in list_checkpoints(self.directory)), default=0)
+        self.seq += 1
+        return self.seq
+
+    def tick(self):
+        # Викликається раз на кадр/крок; зберігає, коли минув інтервал і попередній запис завершено
+        if not self.interval or time.monotonic() - self.last_save < self.interval: return False
+        if self.busy: return False # Фоновий запис ще триває - спробуємо пізніше
+        self.checkpoint()
+        return True
+
+    def checkpoint(self):
+        full = self.base is None or self.since_full + 1 >= self.full_every
+        self.since_full = 0 if full else self.since_full + 1
+        self._submit(('full' if full else 'delta', self._next_seq(), snapshot_arrays()))
+
+    def save_async(self, filename):
+        # Ручне збереження (клавіша S) без зупинки кадру
+        self._submit(('file', filename, snapshot_arrays()))
+
+    def _submit(self, job):
+        self.last_save = time.monotonic()
+        self._ensure_worker()
+        self.jobs.put(job)
+
+    def _run(self):
+        while True:
+            kind, target, data = self.jobs.get()
+            try:
+                if kind == 'file':
+                    write_snapshot_atomic(target, data)
+                    print(f"Стан симуляції збережено у {target}")
+                else:
+                    self._write_checkpoint(kind, target, data)
+            except Exception as e:
+                print(f"Помилка автозбереження: {e}")
+                if kind == 'delta': self.base = None # Наступна точка буде повною
+            finally:
+                self.jobs.task_done()
+
+    def _write_checkpoint(self, kind, seq, data):
+        os.makedirs(self.directory, exist_ok=True)
+        if kind == 'delta' and self.base is not None:
+            payload = checkpoint_delta(data, self.base, self.base_seq)
+        else:
+            kind, payload = 'full', data
+        write_snapshot_atomic(os.path.join(self.directory, self.FILE_FORMAT.format(seq=seq, kind=kind)), payload)
+        if kind == 'full':
+            self.base, self.base_seq = data, seq
+            self._rotate()
+
+    def _rotate(self):
+        # Лишаємо keep останніх повних точок і дельти, що спираються на них
+        checkpoints = list_checkpoints(self.directory)
+        fulls = [seq for seq, kind, _ in checkpoints if kind == 'full']
+        if len(fulls) <= self.keep: return
+        oldest_kept = fulls[-self.keep]
+        for seq, kind, path in checkpoints:
+            if seq < oldest_kept:
+                try: os.remove(path)
+                except OSError: pass
+
+    def wait(self):
+        # Дочекатися завершення всіх записів (перед завантаженням або виходом)
+        if self.worker is not None and self.worker.is_alive():
+            self.jobs.join()
+
+def list_checkpoints(directory=AUTOSAVE_DIR):
+    # [(номер, 'full'|'delta', шлях)] за зростанням номера
+    checkpoints = []
+    if not os.path.isdir(directory): return checkpoints
+    for name in os.listdir(directory):
+        parts = name[:-len('.npz')].split('_') if name.endswith('.npz') else []
+        if len(parts) == 3 and parts[0] == 'checkpoint' and parts[1].isdigit() and parts[2] in ('full', 'delta'):
+            checkpoints.append((int(parts[1]), parts[2], os.path.join(directory, name)))
+    return sorted(checkpoints)
+
+def read_checkpoint_data(directory=AUTOSAVE_DIR):
+    # Масиви найновішої точки, яку вдається прочитати (дельта застосовується до своєї повної точки)
+    def read(path):
+        with np.load(path, allow_pickle=False) as archive:
+            return {key: archive[key] for key in archive.files}
+    checkpoints = list_checkpoints(directory)
+    fulls = {seq: path for seq, kind, path in checkpoints if kind == 'full'}
+    for seq, kind, path in reversed(checkpoints):
+        try:
+            data = read(path)
+            if kind == 'delta':
+                data = apply_checkpoint_delta(read(fulls[int(data['delta.base_seq'])]), data)
+            return path, data
+        except Exception as e:
+            print(f"Пропущено пошкоджену контрольну точку {path}: {e}")
+    return None, None
+
+def load_checkpoint(directory=AUTOSAVE_DIR):
+    path, data = read_checkpoint_data(directory)
+    if data is None:
+        print(f"У {directory} немає контрольних точок. Початок нової симуляції.")
+        init_new_world()
         return False
+    restore_snapshot(data)
+    print(f"Відновлено з контрольної точки {path} (час {simulation_time:.1f}с)")
+    return True
+
+autosaver = Autosaver()
+
+def init_new_world(obstacle_rects=None):
+    # Новий світ зі стандартними параметрами (без завантаження збереження).
+    # obstacle_rects - готове розташування перешкод (тайли спільного світу), інакше випадкове
+    global creatures, predators, food_list, obstacles
+    global max_creature_generation, max_predator_generation, simulation_time
+    global last_log_time, selected_agent
+    reset_engine_arrays()
+    entity_handles.clear()
+    if obstacle_rects is None:
+        obstacles = [Obstacle() for _ in range(NUM_OBSTACLES)]
+    else:
+        obstacles = [Obstacle.from_rect(rect) for rect in obstacle_rects]
+    obstacle_map.build(obstacles)
+    creatures = [make_creature(obstacles) for _ in range(INITIAL_CREATURES)]
+    predators = [make_predator(obstacles) for _ in range(INITIAL_PREDATORS)]
+    food_list = [Food(obstacles) for _ in range(FOOD_COUNT)]
+    max_creature_generation = 0
+    max_predator_generation = 0
+    simulation_time = 0.0
+    telemetry.clear()
+    rebuild_gene_statistics()
+    reset_lineage()
+    last_log_time = -log_interval
+    selected_agent = None
+    world_index.rebuild(food_list, creatures, predators)
+    renderer.invalidate()
+    creatures_to_remove_global.clear()
+    predators_to_remove_global.clear()
+    food_to_remove_global.clear()
+    creatures_to_add_global.clear()
+    predators_to_add_global.clear()
+    creature_births.clear()
+    predator_births.clear()
 
 # --- Функція Побудови Графіків ---
 # ... (залишається без змін) ...
 def plot_simulation_data():
-    if not history_time:
+    if not len(telemetry):
         print("Немає даних для побудови графіків.")
         return
     try:
         import matplotlib.pyplot as plt
 
+        series = telemetry.series
+        history_time = series('time')
+
+        def plot_gene(ax, name, label, color):
+            # Середнє значення гена та смуга +-1 стандартне відхилення
+            mean, std = series('avg_' + name), series('std_' + name)
+            ax.plot(history_time, mean, label=label, color=color)
+            ax.fill_between(history_time, mean - std, mean + std, color=color, alpha=0.2)
+
         fig, axs = plt.subplots(3, 1, figsize=(12, 10), sharex=True)
 
-        axs[0].plot(history_time, history_creature_pop, label="Істоти", color='blue')
-        axs[0].plot(history_time, history_predator_pop, label="Хижаки", color='red')
+        axs[0].plot(history_time, series('creature_pop'), label="Істоти", color='blue')
+        axs[0].plot(history_time, series('predator_pop'), label="Хижаки", color='red')
         axs[0].set_ylabel("Популяція")
         axs[0].set_title("Динаміка Популяцій")
         axs[0].legend()
         axs[0].grid(True)
 
-        axs[1].plot(history_time, history_avg_creature_speed, label="Ср. Шв. Істот", color='cyan')
-        axs[1].plot(history_time, history_avg_predator_speed, label="Ср. Шв. Хижаків", color='magenta')
+        plot_gene(axs[1], 'creature_speed', "Ср. Шв. Істот", 'cyan')
+        plot_gene(axs[1], 'predator_speed', "Ср. Шв. Хижаків", 'magenta')
         axs[1].set_ylabel("Середня Швидкість")
         axs[1].set_title("Динаміка Середньої Швидкості")
         axs[1].legend()
         axs[1].grid(True)
 
-        axs[2].plot(history_time, history_avg_creature_sense, label="Ср. Чут. Істот", color='lightblue')
-        axs[2].plot(history_time, history_avg_predator_sense, label="Ср. Чут. Хижаків", color='pink')
+        plot_gene(axs[2], 'creature_sense', "Ср. Чут. Істот", 'lightblue')
+        plot_gene(axs[2], 'predator_sense', "Ср. Чут. Хижаків", 'pink')
         axs[2].set_xlabel("Час Симуляції (с)")
         axs[2].set_ylabel("Середня Чутливість")
         axs[2].set_title("Динаміка Середньої Чутливості")
@@ -887,50 +3481,75 @@ def plot_simulation_data():
     except Exception as e:
         print(f"\nПомилка при побудові графіків: {e}")
 
-# --- ГОЛОВНИЙ ЦИКЛ ---
-load_simulation_state() # Спробувати завантажити стан на початку
-
-while running:
-    # ... (решта головного циклу залишається практично без змін) ...
-    dt = CLOCK.tick(60) / 1000.0
-    dt = clamp(dt, 0.005, 0.1)
-    mouse_pos_tuple = pygame.mouse.get_pos() # Отримуємо як кортеж
-    try:
-        # Конвертуємо в Vector2 для використання у функціях
-        mouse_pos = pygame.Vector2(mouse_pos_tuple)
-    except TypeError:
-         mouse_pos = pygame.Vector2(0,0) # За замовчуванням, якщо позиція некоректна
-
-    # --- Обробка Подій ---
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-        if event.type == pygame.KEYDOWN:
-            if event.key == pygame.K_SPACE: paused = not paused
-            if event.key == pygame.K_f:
-                 for _ in range(20):
-                     if len(food_list) < FOOD_COUNT * 2: food_list.append(Food(obstacles))
-            if event.key == pygame.K_c:
-                 for _ in range(5):
-                     if len(creatures) < MAX_CREATURES: creatures.append(Creature(obstacles))
-            if event.key == pygame.K_p:
-                 if len(predators) < MAX_PREDATORS: predators.append(Predator(obstacles))
-            if event.key == pygame.K_s: save_simulation_state()
-            if event.key == pygame.K_l: load_simulation_state()
-
-        if event.type == pygame.MOUSEBUTTONDOWN:
-            if event.button == 1:
-                clicked_agent = None
-                # Спочатку перевіряємо хижаків
-                for agent in reversed(predators): # reversed може не працювати з пустим списком напряму
-                    if agent.is_clicked(mouse_pos):
-                        clicked_agent = agent; break
-                # Потім істот
-                if not clicked_agent:
-                    for agent in reversed(creatures):
-                         if agent.is_clicked(mouse_pos):
-                             clicked_agent = agent; break
-                selected_agent = clicked_agent
+# --- Ініціалізація Дисплея ---
+def init_display():
+    global SCREEN, CLOCK, FONT, INFO_FONT
+    pygame.init()
+    SCREEN = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    camera.reset()
+    pygame.display.set_caption("Розширена Еволюційна Симуляція (Pygame)")
+    CLOCK = pygame.time.Clock()
+    FONT = pygame.font.SysFont(None, 26)
+    INFO_FONT = pygame.font.SysFont(None, 22)
+
+# --- Підбір Пар ---
+# Один етап на крок замість пошуку партнера в Creature.update кожною істотою: вільні готові
+# істоти з'єднуються у пари взаємно найближчих у межах чутливості (через просторову сітку).
+# Результат не залежить від порядку оновлення.
+def has_valid_mate(creature):
+    partner = creature.mating_partner
+    return (partner is not None and not partner.is_dead and partner.ready_to_mate
+            and partner.mating_partner is creature)
+
+def match_mates(creature_list, rounds=None):
+    # rounds=None - поточне MATE_MATCH_ROUNDS (читається під час виклику: перевизначення та sweep)
+    if rounds is None: rounds = MATE_MATCH_ROUNDS
+    free = []
+    for c in creature_list:
+        if c.is_dead or not c.ready_to_mate:
+            continue
+        if has_valid_mate(c):
+            continue # Пара з минулих кроків ще прямує одне до одного
+        c.mating_partner = None
+        c.target_partner = None
+        free.append(c)
+
+    pairs = 0
+    grid = SpatialGrid()
+    for _ in range(rounds):
+        if len(free) < 2: break
+        grid.rebuild(free)
+        nearest = {c: grid.find_closest(c.pos, c.genes['sense']**2, exclude=c)[0] for c in free}
+        paired = set()
+        for c in free:
+            other = nearest[c]
+            if other is None or c in paired or other in paired or nearest.get(other) is not c:
+                continue
+            c.mating_partner = other
+            c.target_partner = other
+            other.mating_partner = c
+            other.target_partner = c
+            paired.add(c)
+            paired.add(other)
+        if not paired: break
+        pairs += len(paired) // 2
+        # Наступний раунд - для тих, чий найближчий сусід уже в парі
+        free = [c for c in free if c not in paired]
+    return pairs
+
+# --- Один Крок Симуляції ---
+def compact_removed(items, removed):
+    # Прибирає позначені об'єкти за O(n + k), зберігаючи порядок решти (і порядок оновлення).
+    # Повертає прибрані у порядку списку - звільнення дескрипторів не залежить від порядку множини.
+    kept, dropped = [], []
+    for item in items:
+        (dropped if item in removed else kept).append(item)
+    items[:] = kept
+    return dropped
+
+def step_simulation(dt, halo=()):
+    # halo - (їжа, істоти, хижаки) сусідніх тайлів: видимі для пошуку, але не оновлюються
+    global simulation_time, selected_agent
 
     # --- Очищення Глобальних Списків Змін ---
     creatures_to_remove_global.clear()
@@ -938,123 +3557,264 @@ while running:
     food_to_remove_global.clear()
     creatures_to_add_global.clear()
     predators_to_add_global.clear()
-
-    # --- Оновлення Стану ---
-    if not paused:
-        simulation_time += dt
-
+    creature_births.clear()
+    predator_births.clear()
+
+    prof = profiler.enabled
+    if prof:
+        t = time.perf_counter()
+        profiler.count('ticks')
+        profiler.count('creatures_updated', len(creatures))
+        profiler.count('predators_updated', len(predators))
+
+    simulation_time += dt
+    if USE_NUMPY_ENGINE:
+        world_index.stale = True
+    else:
+        world_index.rebuild(food_list, creatures, predators)
+        for grid, ghosts in zip((world_index.food, world_index.creatures, world_index.predators), halo):
+            for ghost in ghosts: grid.insert(ghost)
+    if prof: t = profiler.lap('index', t)
+    if USE_NUMPY_ENGINE:
+        engine_step_basic(dt) # Старіння, енергія, готовність та смерть - одним проходом на вид
+        if prof: t = profiler.lap('engine', t)
+
+    if USE_NUMPY_ENGINE:
+        engine_match_mates()
+    else:
+        match_mates(creatures)
+    if prof: t = profiler.lap('mating', t)
+
+    if USE_NUMPY_ENGINE:
+        ghosts = halo or ((), (), ())
+        engine_update_creatures(ghosts)
+        if prof: t = profiler.lap('creatures', t)
+        engine_update_predators(ghosts)
+        for arrays, removed in ((creature_arrays, creatures_to_remove_global),
+                                (predator_arrays, predators_to_remove_global)):
+            removed.update(arrays.views[slot] for slot in np.flatnonzero(arrays.dead[:arrays.count]).tolist())
+        if prof: t = profiler.lap('predators', t)
+    else:
         # Оновлення Істот
         for creature in creatures:
-            creature.update(dt, food_list, creatures, predators)
-            if creature.is_dead and creature not in creatures_to_remove_global:
-                 creatures_to_remove_global.append(creature)
+            creature.update(dt, food_list, creatures, predators, world_index)
+            world_index.creatures.move(creature)
+            if creature.is_dead:
+                 creatures_to_remove_global.add(creature)
+        if prof: t = profiler.lap('creatures', t)
 
         # Оновлення Хижаків
         for predator in predators:
-            predator.update(dt, creatures, predators)
-            if predator.is_dead and predator not in predators_to_remove_global:
-                 predators_to_remove_global.append(predator)
-
-        # Видалення мертвих/з'їдених
-        for item in food_to_remove_global:
-            if item in food_list: food_list.remove(item)
-        for agent in creatures_to_remove_global:
-            if agent in creatures: creatures.remove(agent)
-            if selected_agent == agent: selected_agent = None
-        for agent in predators_to_remove_global:
-            if agent in predators: predators.remove(agent)
-            if selected_agent == agent: selected_agent = None
-
-        # Додавання нових
-        creatures.extend(creatures_to_add_global)
-        predators.extend(predators_to_add_global)
-
-        # Обмеження популяцій
-        for pop_list, max_pop in [(creatures, MAX_CREATURES), (predators, MAX_PREDATORS)]:
-            if len(pop_list) > max_pop:
-                try: # Додаємо try-except на випадок помилки сортування, якщо об'єкти некоректні
-                     pop_list.sort(key=lambda x: x.energy if hasattr(x, 'energy') else 0)
-                     num_to_remove = len(pop_list) - max_pop
-                     # Перевіряємо, чи видаляється обраний агент
-                     for i in range(num_to_remove):
-                         if pop_list[i] == selected_agent:
-                             selected_agent = None
-                             break # Досить перевіряти, якщо знайшли
-                     del pop_list[:num_to_remove]
-                except AttributeError as e:
-                     print(f"Помилка сортування при обмеженні популяції: {e}")
-
-
-        # Додавання їжі
-        if len(food_list) < FOOD_COUNT // 2 and random.random() < 0.05:
-             for _ in range(10):
-                 if len(food_list) < FOOD_COUNT * 1.5 : food_list.append(Food(obstacles))
-
-        # --- Запис статистики для графіків ---
-        if simulation_time - last_log_time >= log_interval:
-            last_log_time = simulation_time
-            history_time.append(simulation_time)
-            history_creature_pop.append(len(creatures))
-            history_predator_pop.append(len(predators))
-            try: # Додаємо try-except на випадок пустої популяції або некоректних даних
-                history_avg_creature_speed.append(np.mean([c.genes['speed'] for c in creatures]) if creatures else 0)
-                history_avg_creature_sense.append(np.mean([c.genes['sense'] for c in creatures]) if creatures else 0)
-                history_avg_predator_speed.append(np.mean([p.genes['speed'] for p in predators]) if predators else 0)
-                history_avg_predator_sense.append(np.mean([p.genes['sense'] for p in predators]) if predators else 0)
-            except Exception as e:
-                 print(f"Помилка при розрахунку середніх значень генів: {e}")
-                 # Додаємо нулі або None, щоб не зламати графіки
-                 history_avg_creature_speed.append(0)
-                 history_avg_creature_sense.append(0)
-                 history_avg_predator_speed.append(0)
-                 history_avg_predator_sense.append(0)
-        # ------------------------------------
-
-
-    # --- Малювання ---
-    SCREEN.fill(BG_COLOR)
-    if obstacles: # Малюємо, тільки якщо є
-        for obs in obstacles: obs.draw(SCREEN)
-    if food_list:
-        for f in food_list: f.draw(SCREEN)
-
-    agents_to_draw = creatures + predators
-    # Використовуємо копію списку для безпечної ітерації, якщо він може змінюватись
-    for agent in list(agents_to_draw):
-        try: # Додаємо try-except на випадок, якщо агент некоректний
-             if agent != selected_agent:
-                  agent.draw(SCREEN, is_selected=False)
-        except AttributeError as e:
-            print(f"Помилка малювання агента (не вибраного): {e}")
-
+            predator.update(dt, creatures, predators, world_index)
+            world_index.predators.move(predator)
+            if predator.is_dead:
+                 predators_to_remove_global.add(predator)
+        if prof: t = profiler.lap('predators', t)
+
+    if USE_NUMPY_ENGINE:
+        engine_apply_movement(dt) # Рух, межі світу та витрата енергії - векторизовано
+        if prof: t = profiler.lap('engine', t)
+    if prof: profiler.count('neighbor_checks', world_index.neighbor_checks())
+
+    # Нащадки - до видалення, поки гени батьків, що загинули цього кроку, ще доступні
+    resolve_births()
+    if prof: t = profiler.lap('births', t)
+
+    # Видалення мертвих/з'їдених: один прохід ущільнення на список замість list.remove для кожного
+    if food_to_remove_global:
+        for item in compact_removed(food_list, food_to_remove_global):
+            renderer.mark_food(item)
+            entity_handles.release(item.handle)
+    for pop_list, removed, stats in [(creatures, creatures_to_remove_global, creature_gene_stats),
+                                     (predators, predators_to_remove_global, predator_gene_stats)]:
+        if not removed: continue
+        dropped = compact_removed(pop_list, removed)
+        stats.remove(gene_matrix(dropped))
+        lineage.die(lineage_ids(dropped), simulation_time)
+        release_agents(dropped)
+        if selected_agent in removed: selected_agent = None
+    if prof: t = profiler.lap('removal', t)
+
+    # Додавання нових (і в просторовий індекс - рендерер бачить їх ще до наступного кроку)
+    creatures.extend(creatures_to_add_global)
+    predators.extend(predators_to_add_global)
+    for agent in creatures_to_add_global: world_index.creatures.insert(agent)
+    for agent in predators_to_add_global: world_index.predators.insert(agent)
+    creature_gene_stats.add(gene_matrix(creatures_to_add_global))
+    predator_gene_stats.add(gene_matrix(predators_to_add_global))
+    if prof:
+        profiler.count('agents_born', len(creatures_to_add_global) + len(predators_to_add_global))
+        t = profiler.lap('add', t)
+
+    # Обмеження популяцій: народження вже перевіряють ліміт (population_has_room), тож сюди
+    # доходять лише надлишки від ручного додавання, завантаження чи переходу між тайлами.
+    # Частковий вибір (argpartition) знаходить лише надлишок з найменшою енергією за O(n),
+    # а ущільнення зберігає порядок оновлення решти.
+    for pop_list, max_pop, stats, grid in [(creatures, MAX_CREATURES, creature_gene_stats, world_index.creatures),
+                                           (predators, MAX_PREDATORS, predator_gene_stats, world_index.predators)]:
+        excess = len(pop_list) - max_pop
+        if excess <= 0: continue
+        energy = agent_energies(pop_list)
+        lowest = np.argpartition(energy, excess - 1)[:excess] if excess < len(pop_list) else np.arange(excess)
+        dropped = compact_removed(pop_list, {pop_list[i] for i in lowest.tolist()})
+        stats.remove(gene_matrix(dropped))
+        lineage.die(lineage_ids(dropped), simulation_time)
+        for agent in dropped: grid.remove(agent)
+        release_agents(dropped)
+        if selected_agent in dropped: selected_agent = None
+    if prof: t = profiler.lap('cap', t)
+
+    lineage.maybe_prune()
+    if prof: t = profiler.lap('lineage', t)
+
+    # Додавання їжі
+    if len(food_list) < FOOD_COUNT // 2 and random.random() < 0.05:
+         for _ in range(10):
+             if len(food_list) < FOOD_COUNT * 1.5 : spawn_food()
+    if prof: t = profiler.lap('food', t)
+
+    record_statistics()
+    if prof: profiler.lap('stats', t)
+
+def record_statistics(creature_pop=None, predator_pop=None):
+    # --- Запис статистики для графіків ---
+    # Розміри популяцій передає координатор тайлів (його власні списки порожні)
+    global last_log_time
+    if simulation_time - last_log_time >= log_interval:
+        last_log_time = simulation_time
+        # Середні, відхилення, квантилі та гістограми беруться з потокової статистики - без проходу
+        # по популяції (у тайлах - з об'єднаної статистики всіх тайлів)
+        moments = {}
+        for species, stats in (('creature', creature_gene_stats), ('predator', predator_gene_stats)):
+            quantiles = stats.quantiles(np.array(TELEMETRY_QUANTILES) / 100)
+            for g, gene in enumerate(stats.names):
+                moments[f'avg_{species}_{gene}'] = stats.gene_mean(gene)
+                moments[f'std_{species}_{gene}'] = stats.std(gene)
+                for q, value in zip(TELEMETRY_QUANTILES, quantiles[g].tolist()):
+                    moments[f'p{q}_{species}_{gene}'] = value
+                for b, count in enumerate(stats.hist[g].tolist()):
+                    moments[f'hist_{species}_{gene}_{b}'] = count
+        telemetry.append(time=simulation_time,
+                         creature_pop=len(creatures) if creature_pop is None else creature_pop,
+                         predator_pop=len(predators) if predator_pop is None else predator_pop, **moments)
+
+def get_history():
+    # Ряди статистики у вигляді словника масивів (для headless-запусків та аналізу)
+    return {name: telemetry.series(name) for name in telemetry.names}
+
+def gene_histogram_history(species, gene):
+    # Гістограми гена на кожному записі статистики: лічильники (точок x кошиків) та межі кошиків
+    counts = np.stack([telemetry.series(f'hist_{species}_{gene}_{b}') for b in range(GENE_HIST_BINS)], axis=1)
+    stats = creature_gene_stats if species == 'creature' else predator_gene_stats
+    return counts, stats.histogram(gene)[1]
+
+# --- Малювання ---
+def draw_frame():
+    # Тло, перешкоди та їжа беруться з кешованих шарів; поверх малюються агенти та HUD,
+    # а на екран виводяться лише змінені області. Час малювання отримує регулятор деталізації
+    t = time.perf_counter()
+    renderer.render(SCREEN, draw_overlays)
+    lod.observe(time.perf_counter() - t)
+    if profiler.enabled:
+        profiler.lap('render', t)
+        profiler.count('frames')
+
+def visible_bounds():
+    # Видима область із запасом на радіус чутливості (ореол агента за межею вікна)
+    # та на зсув позицій рушія NumPy після оновлення сітки
+    return camera.visible_bounds(max(CREATURE_MAX_SENSE, PREDATOR_MAX_SENSE) + GRID_CELL_SIZE)
+
+def visible_agents():
+    # Агенти, чий ореол може потрапити у вікно: запит до просторового індексу
+    bounds = visible_bounds()
+    world_index.refresh()
+    return world_index.creatures.query_rect(*bounds) + world_index.predators.query_rect(*bounds)
+
+def visible_points(arrays, bounds):
+    # Рушій NumPy: позиції видимих живих агентів виду векторною вибіркою, без обходу об'єктів
+    n = arrays.count
+    pos = arrays.pos[:n]
+    x0, y0, x1, y1 = bounds
+    mask = ~arrays.dead[:n] & (pos[:, 0] >= x0) & (pos[:, 0] < x1) & (pos[:, 1] >= y0) & (pos[:, 1] < y1)
+    return pos[mask]
+
+def draw_overlays(surface):
+    # Видимі агенти малюються з рівнем деталізації lod: спрайти (з ореолами чи без) одним
+    # викликом blits, пікселі або теплова карта. Обраний агент - завжди спрайтом і останнім,
+    # щоб бути зверху. Повертає змінені прямокутники.
+    t = time.perf_counter()
+    bounds = visible_bounds()
+    if USE_NUMPY_ENGINE:
+        points = [visible_points(arrays, bounds) for arrays in (creature_arrays, predator_arrays)]
+        level = lod.choose(len(points[0]) + len(points[1]))
+        visible = visible_agents() if level <= LOD_NO_HALO else []
+    else:
+        world_index.refresh()
+        visible = world_index.creatures.query_rect(*bounds)
+        n_creatures = len(visible)
+        visible += world_index.predators.query_rect(*bounds)
+        level = lod.choose(len(visible))
+        if level >= LOD_PIXELS:
+            points = [positions(visible[:n_creatures]), positions(visible[n_creatures:])]
+    if level >= LOD_PIXELS:
+        drawn = len(points[0]) + len(points[1])
+        if level == LOD_PIXELS:
+            rects = draw_pixels(surface, points, [(50, 200, 50), PREDATOR_COLOR])
+        else:
+            rects = draw_heatmap(surface, points, [1, 0]) # Істоти - зелений канал, хижаки - червоний
+        blit_list = []
+    else:
+        drawn = len(visible)
+        rects = []
+        blit_list = []
+        halos = level == LOD_FULL
+        for agent in visible:
+            try: # Додаємо try-except на випадок, якщо агент некоректний
+                 if agent != selected_agent:
+                      blit_list.extend(agent.sprite_blits(camera, halos))
+            except AttributeError as e:
+                print(f"Помилка малювання агента (не вибраного): {e}")
     if selected_agent:
          try:
-             selected_agent.draw(SCREEN, is_selected=True)
+             blit_list.extend(selected_agent.sprite_blits(camera))
          except AttributeError as e:
              print(f"Помилка малювання вибраного агента: {e}")
-
-
+    if blit_list: rects.extend(surface.blits(blit_list))
+    if selected_agent and not selected_agent.is_dead:
+        rects.append(selected_agent.draw_selection(surface, camera))
+    if profiler.enabled:
+        profiler.count('agents_drawn', drawn)
+        t = profiler.lap('draw_agents', t)
+
+    rects.extend(draw_hud(surface))
+    if profiler.enabled:
+        profiler.lap('hud', t)
+    return rects
+
+def draw_hud(surface):
     # --- Статистика та Інфо Панель ---
-    # ... (код відображення статистики та інфо панелі залишається майже без змін) ...
+    # Текст рендериться лише тоді, коли змінюється його значення (HudTextCache)
+    rects = []
+    text = hud_text_cache.render
     # Загальна статистика
-    creature_pop_text = FONT.render(f"Істоти: {len(creatures)}/{MAX_CREATURES} (Пок: {max_creature_generation})", True, (50, 200, 50))
-    predator_pop_text = FONT.render(f"Хижаки: {len(predators)}/{MAX_PREDATORS} (Пок: {max_predator_generation})", True, PREDATOR_COLOR)
-    food_text = FONT.render(f"Їжа: {len(food_list)}", True, FOOD_COLOR)
-    time_text = FONT.render(f"Час: {simulation_time:.1f}с", True, (200, 200, 200))
-    SCREEN.blit(creature_pop_text, (10, 10))
-    SCREEN.blit(predator_pop_text, (10, 35))
-    SCREEN.blit(food_text, (10, 60))
-    SCREEN.blit(time_text, (10, 85))
+    creature_pop_text = text('creatures', FONT, f"Істоти: {len(creatures)}/{MAX_CREATURES} (Пок: {max_creature_generation})", (50, 200, 50))
+    predator_pop_text = text('predators', FONT, f"Хижаки: {len(predators)}/{MAX_PREDATORS} (Пок: {max_predator_generation})", PREDATOR_COLOR)
+    food_text = text('food', FONT, f"Їжа: {len(food_list)}", FOOD_COLOR)
+    time_text = text('time', FONT, f"Час: {simulation_time:.1f}с", (200, 200, 200))
+    rects.append(surface.blit(creature_pop_text, (10, 10)))
+    rects.append(surface.blit(predator_pop_text, (10, 35)))
+    rects.append(surface.blit(food_text, (10, 60)))
+    rects.append(surface.blit(time_text, (10, 85)))
 
     # Інформація про обраного агента
     if selected_agent and hasattr(selected_agent, 'genes'): # Перевірка наявності атрибутів
         panel_width = 230
-        panel_height = 160
-        panel_x = WIDTH - panel_width - 10
+        panel_height = 180
+        panel_x = SCREEN_WIDTH - panel_width - 10
         panel_y = 10
         panel_surface = pygame.Surface((panel_width, panel_height), pygame.SRCALPHA)
         panel_surface.fill((*INFO_PANEL_COLOR, 200))
-        SCREEN.blit(panel_surface, (panel_x, panel_y))
+        rects.append(surface.blit(panel_surface, (panel_x, panel_y)))
 
         agent_type_str = "Істота" if isinstance(selected_agent, Creature) else "Хижак"
         max_age = selected_agent.max_age if hasattr(selected_agent, 'max_age') else 0
@@ -1067,25 +3827,1023 @@ while running:
             f"Швидкість: {selected_agent.genes.get('speed', 0):.2f}",
             f"Чутливість: {selected_agent.genes.get('sense', 0):.1f}",
             f"Готовий спар.: {'Так' if getattr(selected_agent, 'ready_to_mate', False) else 'Ні'}",
-            f"Кулдаун: {getattr(selected_agent, 'mating_cooldown_timer', 0):.1f}с"
+            f"Кулдаун: {getattr(selected_agent, 'mating_cooldown_timer', 0):.1f}с",
+            f"Лінія: #{selected_agent.lineage_id} (клада #{lineage_root(selected_agent.lineage_id)})"
         ]
 
         for i, line in enumerate(lines):
             try:
-                text_surf = INFO_FONT.render(line, True, INFO_TEXT_COLOR)
-                SCREEN.blit(text_surf, (panel_x + 10, panel_y + 5 + i * 20))
+                text_surf = text(('info', i), INFO_FONT, line, INFO_TEXT_COLOR)
+                surface.blit(text_surf, (panel_x + 10, panel_y + 5 + i * 20))
             except pygame.error as e: print(f"Помилка рендерингу тексту інфо-панелі: {e}")
 
 
+    speed = SPEED_MULTIPLIERS[speed_index]
+    speed_text = text('speed', FONT, f"Темп: {f'{speed}x' if speed else 'макс'}", (200, 200, 200))
+    rects.append(surface.blit(speed_text, (10, 110)))
+    if (WIDTH, HEIGHT) != (SCREEN_WIDTH, SCREEN_HEIGHT) or camera.zoom != 1.0:
+        camera_text = text('camera', FONT, f"Масштаб: {camera.zoom:.2f}x ({camera.x:.0f}, {camera.y:.0f})", (200, 200, 200))
+        rects.append(surface.blit(camera_text, (10, 135)))
+    if lod.forced is not None or lod.level != LOD_FULL:
+        mode = "авто" if lod.forced is None else "вручну"
+        lod_text = text('lod', FONT, f"Деталізація: {LOD_NAMES[lod.level]} ({mode})", (200, 200, 200))
+        rects.append(surface.blit(lod_text, (10, 160)))
+
+    if paused:
+        pause_text_render = text('pause', FONT, "ПАУЗА", (255, 0, 0))
+        pause_rect = pause_text_render.get_rect(center=(SCREEN_WIDTH // 2, 25))
+        rects.append(surface.blit(pause_text_render, pause_rect))
+
+    if show_charts:
+        chart_height = len(live_charts.charts) * (CHART_HEIGHT + CHART_TITLE_HEIGHT)
+        rects.extend(live_charts.draw(surface, 10, SCREEN_HEIGHT - chart_height - 10))
+    if show_profile and profiler.summary:
+        overlay = profile_overlay.surface()
+        rects.append(surface.blit(overlay, (SCREEN_WIDTH - overlay.get_width() - 10, SCREEN_HEIGHT - overlay.get_height() - 10)))
+    return rects
+
+class ProfileOverlay:
+    # Таблиця останнього вікна профайлера; перемальовується лише з новим підсумком
+    def __init__(self):
+        self.seq = None
+        self.cached = None
+
+    def surface(self):
+        if self.seq == profiler.summary_seq: return self.cached
+        summary = profiler.summary
+        duration_ms = summary['duration'] * 1000
+        ticks = max(summary['counters']['ticks'], 1)
+        lines = [f"Профіль за {summary['duration']:.1f}с: мс/виклик, виклики, частка"]
+        for phase in profiler.phases:
+            calls = summary['calls'][phase]
+            if not calls: continue
+            ms = summary['ms'][phase]
+            lines.append(f"{phase}: {ms / calls:.3f} x{calls} ({ms / duration_ms:.0%})")
+        for name in profiler.counter_names:
+            value = summary['counters'][name]
+            per_tick = '' if name in ('ticks', 'frames') else f" ({value / ticks:.1f}/крок)"
+            lines.append(f"{name}: {value}{per_tick}")
+        rendered = [INFO_FONT.render(line, True, INFO_TEXT_COLOR) for line in lines]
+        width = max(r.get_width() for r in rendered) + 16
+        panel = pygame.Surface((width, 18 * len(rendered) + 10), pygame.SRCALPHA)
+        panel.fill((*INFO_PANEL_COLOR, 220))
+        for i, r in enumerate(rendered): panel.blit(r, (8, 5 + i * 18))
+        self.seq, self.cached = profiler.summary_seq, panel
+        return panel
+
+profile_overlay = ProfileOverlay()
+
+# --- Обробка Подій ---
+SPEED_KEYS = {pygame.K_1: 0, pygame.K_2: 1, pygame.K_3: 2, pygame.K_4: 3}
+
+def handle_events(mouse_pos):
+    global running, paused, selected_agent, speed_index, show_charts, show_profile
+    for event in pygame.event.get():
+        if event.type == pygame.QUIT:
+            running = False
+        if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+            renderer.request_full_update()
+        if event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_SPACE: paused = not paused
+            if event.key == pygame.K_g: show_charts = not show_charts
+            if event.key == pygame.K_o:
+                show_profile = not show_profile
+                profiler.enable(show_profile)
+            if event.key == pygame.K_f:
+                 for _ in range(20):
+                     if len(food_list) < FOOD_COUNT * 2: spawn_food()
+            if event.key == pygame.K_c:
+                 for _ in range(5):
+                     if len(creatures) < MAX_CREATURES:
+                         creatures.append(make_creature(obstacles))
+                         world_index.creatures.insert(creatures[-1])
+                         creature_gene_stats.add(gene_matrix(creatures[-1:]))
+                         found_lineages(creatures[-1:], 'creature')
+            if event.key == pygame.K_p:
+                 if len(predators) < MAX_PREDATORS:
+                     predators.append(make_predator(obstacles))
+                     world_index.predators.insert(predators[-1])
+                     predator_gene_stats.add(gene_matrix(predators[-1:]))
+                     found_lineages(predators[-1:], 'predator')
+            if event.key == pygame.K_s: autosaver.save_async(DEFAULT_SAVE_FILE)
+            if event.key == pygame.K_l:
+                autosaver.wait() # Щоб не читати файл, який ще пишеться
+                load_simulation_state()
+            if event.key in SPEED_KEYS: speed_index = SPEED_KEYS[event.key]
+            if event.key == pygame.K_HOME: camera.reset()
+            if event.key == pygame.K_z: camera.fit()
+            if event.key == pygame.K_v: lod.cycle()
+            if event.key == pygame.K_m: print_memory_report()
+
+        if event.type == pygame.MOUSEWHEEL:
+            camera.zoom_at(CAMERA_ZOOM_STEP ** event.y, pygame.mouse.get_pos())
+        if event.type == pygame.MOUSEMOTION and event.buttons[2]:
+            camera.pan(-event.rel[0], -event.rel[1]) # Перетягування правою кнопкою
+
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            if event.button == 1:
+                clicked_agent = None
+                world_pos = camera.to_world(mouse_pos)
+                pick_radius = max(CREATURE_RADIUS, PREDATOR_RADIUS) + 1
+                # Спочатку перевіряємо хижаків, потім істот - лише поруч із курсором
+                world_index.refresh()
+                for grid in (world_index.predators, world_index.creatures):
+                    for agent, _ in grid.query_radius(world_pos, pick_radius):
+                        if agent.is_clicked(world_pos):
+                            clicked_agent = agent
+                    if clicked_agent: break
+                selected_agent = clicked_agent
+
+def pan_camera(frame_dt):
+    # Прокрутка стрілками, поки клавіші утримуються
+    keys = pygame.key.get_pressed()
+    dx = keys[pygame.K_RIGHT] - keys[pygame.K_LEFT]
+    dy = keys[pygame.K_DOWN] - keys[pygame.K_UP]
+    if dx or dy:
+        camera.pan(dx * CAMERA_PAN_SPEED * frame_dt, dy * CAMERA_PAN_SPEED * frame_dt)
+
+# --- ГОЛОВНИЙ ЦИКЛ ---
+def interactive_frame(frame_dt, speed, accumulator, mouse_pos):
+    # Один кадр вікна: події, підкроки симуляції, автозбереження, малювання.
+    # Повертає накопичений, ще не просимульований час
+    # Клавіша O вмикає профайлер посеред кадру: час подій міряємо, лише якщо він працював до них
+    timed = profiler.enabled
+    if timed: t = time.perf_counter()
+    handle_events(mouse_pos)
+    pan_camera(frame_dt)
+    if timed: profiler.lap('events', t)
+
+    # --- Оновлення Стану ---
+    # Фіксований крок SIM_DT: за кадр виконується K підкроків, проміжні стани не малюються
     if paused:
-        pause_text_render = FONT.render("ПАУЗА", True, (255, 0, 0))
-        pause_rect = pause_text_render.get_rect(center=(WIDTH // 2, 25))
-        SCREEN.blit(pause_text_render, pause_rect)
+        accumulator = 0.0
+    elif speed:
+        accumulator += frame_dt * speed
+        substeps = min(int(accumulator / SIM_DT), MAX_SUBSTEPS_PER_FRAME)
+        for _ in range(substeps):
+            step_simulation(SIM_DT)
+        accumulator -= substeps * SIM_DT
+        if accumulator >= SIM_DT:
+            accumulator = 0.0 # CPU не встигає - відкидаємо борг, а не накопичуємо його
+    else:
+        frame_end = time.perf_counter() + MAX_SPEED_FRAME_BUDGET
+        while time.perf_counter() < frame_end:
+            step_simulation(SIM_DT)
+
+    if not paused:
+        timed = profiler.enabled
+        if timed: t = time.perf_counter()
+        autosaver.tick() # Лише копія стану; запис - у фоновому потоці
+        if timed: profiler.lap('autosave', t)
+    draw_frame() # Сам виводить на екран лише змінені області
+    profiler.maybe_flush()
+    return accumulator
+
+def run_interactive(resume=False):
+    # resume - продовжити з останньої контрольної точки автозбереження
+    global running
+    init_display()
+    if resume:
+        load_checkpoint()
+    else:
+        load_simulation_state() # Спробувати завантажити стан на початку
+
+    running = True
+    accumulator = 0.0
+    while running:
+        speed = SPEED_MULTIPLIERS[speed_index]
+        # У режимі "макс" не обмежуємо FPS: кадр лише показує поточний стан
+        frame_dt = (CLOCK.tick(60) if speed else CLOCK.tick()) / 1000.0
+        frame_dt = min(frame_dt, 0.1)
+        mouse_pos_tuple = pygame.mouse.get_pos() # Отримуємо як кортеж
+        try:
+            # Конвертуємо в Vector2 для використання у функціях
+            mouse_pos = pygame.Vector2(mouse_pos_tuple)
+        except TypeError:
+             mouse_pos = pygame.Vector2(0,0) # За замовчуванням, якщо позиція некоректна
+
+        accumulator = interactive_frame(frame_dt, speed, accumulator, mouse_pos)
+
+    # --- Завершення Pygame та Побудова Графіків ---
+    autosaver.wait()
+    pygame.quit()
+    print("Завершення симуляції...")
+    plot_simulation_data()
+    print("Програма завершена.")
+
+# --- Режим Без Вікна (Headless) ---
+def run_headless(steps=None, duration=None, dt=SIM_DT, load_file=None, seed=None,
+                 autosave=None, resume=False):
+    # Крокує світ без вікна, малювання та обмеження FPS - настільки швидко, наскільки дозволяє CPU.
+    # steps - кількість кроків, duration - тривалість у секундах симуляції (одне з двох).
+    # autosave - інтервал контрольних точок у секундах реального часу (None - без автозбереження),
+    # resume - почати з останньої контрольної точки.
+    if steps is None and duration is None:
+        raise ValueError("Потрібно вказати steps або duration")
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+    if resume:
+        load_checkpoint()
+    elif load_file:
+        load_simulation_state(load_file)
+    else:
+        init_new_world()
+    if autosave:
+        autosaver.interval = autosave
+
+    step = 0
+    end_time = simulation_time + duration if duration is not None else None
+    while True:
+        if steps is not None and step >= steps: break
+        if end_time is not None and simulation_time >= end_time: break
+        step_simulation(dt)
+        step += 1
+        if autosave:
+            if profiler.enabled: t = time.perf_counter()
+            autosaver.tick()
+            if profiler.enabled: profiler.lap('autosave', t)
+        profiler.maybe_flush()
+    autosaver.wait()
+    if profiler.enabled: profiler.flush() # Останнє неповне вікно
+    return get_history()
+
+# --- Перебір Параметрів (Sweep) ---
+# Сітка або випадкова вибірка перевизначень глобальних констант (CREATURE_MUTATION_RATE,
+# FOOD_COUNT, ...), для кожної конфігурації - кілька headless-повторів у пулі процесів.
+# Лише параметри, які симуляція читає під час роботи. Решта констант або вже використана при
+# імпорті (GRID_CELL_SIZE - у world_index, GENE_HIST_BINS, TELEMETRY_CAPACITY, OBSTACLE_MAP_CELL_SIZE -
+# у значеннях за замовчуванням), або службова (SNAPSHOT_VERSION, BENCH_*, LOD_*, SCREEN_*):
+# їх перевизначення нічого б не змінило, а sweep звітував би про результат зміни, якої не було.
+SIMULATION_PARAMETERS = (
+    'WIDTH', 'HEIGHT', 'NUM_OBSTACLES', 'OBSTACLE_MIN_SIZE', 'OBSTACLE_MAX_SIZE',
+    'FOOD_COUNT', 'FOOD_ENERGY', 'FOOD_RADIUS', 'MATE_MATCH_ROUNDS',
+    'INITIAL_CREATURES', 'MAX_CREATURES', 'CREATURE_INITIAL_ENERGY', 'CREATURE_ENERGY_DECAY',
+    'CREATURE_MOVE_COST', 'CREATURE_REPRODUCTION_THRESHOLD', 'CREATURE_REPRODUCTION_READY_THRESHOLD',
+    'CREATURE_REPRODUCTION_COST', 'CREATURE_MATING_COOLDOWN', 'CREATURE_MAX_AGE',
+    'CREATURE_MIN_SPEED', 'CREATURE_MAX_SPEED', 'CREATURE_MIN_SENSE', 'CREATURE_MAX_SENSE',
+    'CREATURE_MUTATION_RATE', 'CREATURE_MUTATION_STRENGTH', 'CREATURE_MATING_RANGE',
+    'CREATURE_SEPARATION_RADIUS', 'CREATURE_SEPARATION_FORCE', 'CREATURE_RADIUS',
+    'INITIAL_PREDATORS', 'MAX_PREDATORS', 'PREDATOR_INITIAL_ENERGY', 'PREDATOR_ENERGY_DECAY',
+    'PREDATOR_MOVE_COST', 'PREDATOR_REPRODUCTION_THRESHOLD', 'PREDATOR_REPRODUCTION_READY_THRESHOLD',
+    'PREDATOR_REPRODUCTION_COST', 'PREDATOR_MATING_COOLDOWN', 'PREDATOR_HUNT_ENERGY_GAIN', 'PREDATOR_MAX_AGE',
+    'PREDATOR_MIN_SPEED', 'PREDATOR_MAX_SPEED', 'PREDATOR_MIN_SENSE', 'PREDATOR_MAX_SENSE',
+    'PREDATOR_MUTATION_RATE', 'PREDATOR_MUTATION_STRENGTH',
+    'PREDATOR_SEPARATION_RADIUS', 'PREDATOR_SEPARATION_FORCE', 'PREDATOR_RADIUS',
+)
+
+def sweepable_parameters():
+    # Поточні значення параметрів, які можна перевизначати (sweep, --world, бенчмарки, тайли)
+    return {name: globals()[name] for name in SIMULATION_PARAMETERS}
+
+def validate_overrides(overrides):
+    # Перевіряє імена та зводить значення до типу параметра (FOOD_COUNT=50.0 -> 50)
+    allowed = sweepable_parameters()
+    for name in overrides:
+        if name not in allowed:
+            raise KeyError(f"Параметр {name} не можна перевизначити (див. SIMULATION_PARAMETERS)")
+    return {name: type(allowed[name])(value) for name, value in overrides.items()}
+
+def apply_overrides(overrides):
+    globals().update(validate_overrides(overrides))
+
+def sweep_configurations(grid=None, ranges=None, samples=0, seed=None):
+    # grid: {ім'я: [значення, ...]} - повний декартів добуток;
+    # ranges: {ім'я: (мін, макс)} - samples випадкових точок (цілі для цілих параметрів)
+    rng = random.Random(seed)
+    grid_configs = [{}]
+    if grid:
+        names = list(grid)
+        grid_configs = [dict(zip(names, values)) for values in itertools.product(*(grid[n] for n in names))]
+    if not ranges:
+        return grid_configs
+    defaults = sweepable_parameters()
+    configs = []
+    for base in grid_configs:
+        for _ in range(samples):
+            config = dict(base)
+            for name, (low, high) in ranges.items():
+                if isinstance(defaults.get(name), int):
+                    config[name] = rng.randint(int(low), int(high))
+                else:
+                    config[name] = rng.uniform(low, high)
+            configs.append(config)
+    return configs
+
+_sweep_defaults = {}
+
+def _sweep_init():
+    # Процеси пулу виконують кілька завдань поспіль: запам'ятовуємо параметри на старті,
+    # щоб перевизначення одного завдання не переходили в наступне
+    _sweep_defaults.update(sweepable_parameters())
+
+def _sweep_worker(overrides, seed, steps, duration, dt):
+    # Виконується в окремому процесі: глобальні параметри змінюються лише в ньому
+    globals().update(_sweep_defaults)
+    apply_overrides(overrides)
+    history = run_headless(steps=steps, duration=duration, dt=dt, seed=seed)
+    # Лічильники гістограм на кожну точку роздули б JSON результатів; квантилі лишаються
+    return {name: [float(v) for v in series] for name, series in history.items()
+            if name not in TELEMETRY_HIST_SERIES}
+
+def aggregate_replicates(histories):
+    # Середнє та стандартне відхилення кожного ряду по повторах (обрізаних до найкоротшого)
+    summary = {}
+    for name in histories[0]:
+        length = min(len(h[name]) for h in histories)
+        data = np.array([h[name][:length] for h in histories], dtype=float).reshape(len(histories), length)
+        summary[name] = {'mean': data.mean(axis=0).tolist(), 'std': data.std(axis=0).tolist(),
+                         'final_mean': float(data[:, -1].mean()) if length else None}
+    return summary
+
+def run_sweep(configs, replicates=3, steps=None, duration=None, dt=SIM_DT, seed=0,
+              workers=None, output="sweep_results.json"):
+    # Повтор r кожної конфігурації стартує з зерна seed + r (спільні випадкові числа для порівняння)
+    if steps is None and duration is None:
+        raise ValueError("Потрібно вказати steps або duration")
+    # Помилка в імені - до запуску пулу, а не в кожному процесі
+    configs = [validate_overrides(config) for config in configs]
+    jobs = [(i, r) for i in range(len(configs)) for r in range(replicates)]
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_sweep_init) as pool:
+        futures = {job: pool.submit(_sweep_worker, configs[job[0]], seed + job[1], steps, duration, dt)
+                   for job in jobs}
+        results = {job: future.result() for job, future in futures.items()}
+
+    report = {
+        'steps': steps, 'duration': duration, 'dt': dt, 'seed': seed, 'replicates': replicates,
+        'elapsed': time.perf_counter() - started,
+        'configs': [],
+    }
+    for i, config in enumerate(configs):
+        histories = [results[(i, r)] for r in range(replicates)]
+        report['configs'].append({
+            'overrides': config,
+            'seeds': [seed + r for r in range(replicates)],
+            'summary': aggregate_replicates(histories),
+            'replicates': histories,
+        })
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False)
+        print(f"Результати {len(configs)} конфігурацій x {replicates} повторів збережено у {output}")
+    return report
+
+def parse_sweep_values(specs, ranges=False):
+    # "NAME=1,2,3" -> {NAME: [1.0, 2.0, 3.0]}; з ranges=True "NAME=0.1:0.9" -> {NAME: (0.1, 0.9)}
+    parsed = {}
+    for spec in specs or []:
+        name, _, values = spec.partition('=')
+        if ranges:
+            low, _, high = values.partition(':')
+            parsed[name.strip()] = (float(low), float(high))
+        else:
+            parsed[name.strip()] = [float(v) for v in values.split(',') if v.strip()]
+    return parsed
+
+# --- Розбиття Світу на Тайли ---
+# Світ ділиться на сітку тайлів, кожен тайл крокує власний процес-працівник зі звичайним
+# step_simulation. Після кроку працівник віддає координатору агентів і їжу, що перетнули межу
+# тайлу (переходять до нового власника), смугу шириною TILE_HALO біля своїх меж (сусіди бачать
+# її як копії лише для сприйняття) та звіти про з'їдені чи вполювані копії - власник застосовує
+# їх на наступному кроці. Координатор лише маршрутизує повідомлення та об'єднує статистику.
+# Наближення: пари для спарювання утворюються в межах тайлу, а їжа чи здобич на межі зрідка
+# може дістатися одночасно агентам двох тайлів (звіт запізнюється на крок).
+TILE_HALO = 160          # ширина смуги сусіднього тайлу (пікс.) - не менше максимальної чутливості
+TILE_LINEAGE_SHIFT = 40  # ідентифікатори родоводу тайлу i починаються з i << TILE_LINEAGE_SHIFT
+TILE_KINDS = ('food', 'creatures', 'predators')
+# Параметри, що діляться між тайлами порівну (решта - однакові для всіх)
+TILE_SPLIT_PARAMETERS = ('INITIAL_CREATURES', 'INITIAL_PREDATORS', 'FOOD_COUNT', 'MAX_CREATURES', 'MAX_PREDATORS')
+
+class TileLayout:
+    # Сітка nx x ny тайлів однакового розміру поверх WIDTH x HEIGHT
+    def __init__(self, nx, ny):
+        self.nx, self.ny = nx, ny
+        self.width, self.height = WIDTH / nx, HEIGHT / ny
+
+    def __len__(self):
+        return self.nx * self.ny
+
+    def bounds(self, tile):
+        x0, y0 = tile % self.nx * self.width, tile // self.nx * self.height
+        return x0, y0, x0 + self.width, y0 + self.height
+
+    def owner(self, pos):
+        # Тайл-власник кожної позиції масиву (n, 2)
+        cx = np.clip((pos[:, 0] // self.width).astype(np.int64), 0, self.nx - 1)
+        cy = np.clip((pos[:, 1] // self.height).astype(np.int64), 0, self.ny - 1)
+        return cy * self.nx + cx
+
+    def near(self, tile, pos, margin):
+        # Позиції всередині тайлу, розширеного на margin з кожного боку (від'ємний - звуженого)
+        x0, y0, x1, y1 = self.bounds(tile)
+        return ((pos[:, 0] >= x0 - margin) & (pos[:, 0] < x1 + margin) &
+                (pos[:, 1] >= y0 - margin) & (pos[:, 1] < y1 + margin))
+
+def parse_dimensions(spec):
+    # "3x2" -> (3, 2); "4" -> (4, 4)
+    nx, _, ny = spec.lower().partition('x')
+    return int(nx), int(ny or nx)
+
+class HaloEntity:
+    # Копія об'єкта сусіднього тайлу лише для сприйняття: позиція, радіус та прапорець смерті.
+    # Має локальний дескриптор (цілі агентів - дескриптори) і звільняється одразу після кроку.
+    __slots__ = ('pos', 'radius', 'is_dead', 'owner', 'remote_handle', 'handle')
+
+    def __init__(self, x, y, radius, owner, remote_handle):
+        self.pos = pygame.Vector2(x, y)
+        self.radius = radius
+        self.is_dead = False
+        self.owner = owner
+        self.remote_handle = remote_handle
+        self.handle = entity_handles.register(self)
+
+def adopt_agents(cls, view_cls, arrays, columns):
+    # Агенти, що прийшли з іншого тайлу: стан із колонок, нові локальні дескриптори,
+    # посилання на цілі скинуто (дескриптори іншого процесу тут нічого не означають)
+    n = len(columns['energy'])
+    constants = cls.species_constants()
+    genes = columns['genes']
+    colors = cls.colors_for(*(genes[:, GENE_NAMES.index(g)] for g in ('speed', 'sense'))) or [constants['color']] * n
+    lineages = columns['lineage'].tolist()
+    agents = []
+    for i in range(n):
+        if USE_NUMPY_ENGINE:
+            agent = view_cls.__new__(view_cls)
+            slot = arrays.add(agent)
+            agent.bind(arrays, slot)
+            for name in AGENT_COLUMNS: getattr(arrays, name)[slot] = columns[name][i]
+            arrays.genes[slot] = genes[i]
+        else:
+            agent = cls.__new__(cls)
+            for column, attr in AGENT_COLUMNS.items():
+                if column not in ('pos', 'direction'): setattr(agent, attr, columns[column][i].item())
+            agent.pos = pygame.Vector2(columns['pos'][i].tolist())
+            agent.direction = pygame.Vector2(columns['direction'][i].tolist())
+            agent.genes = dict(zip(GENE_NAMES, genes[i].tolist()))
+        agent.color = colors[i]
+        agent.lineage_id = lineages[i]
+        agent.handle = entity_handles.register(agent)
+        agents.append(agent)
+    return agents
+
+class TileWorker:
+    # Стан світу процесу-працівника - звичайні глобальні змінні модуля, обмежені одним тайлом
+    def __init__(self, tile, layout):
+        self.tile = tile
+        self.layout = layout
+
+    def step(self, dt, immigrants, halo, reports):
+        self.apply_reports(reports)
+        self.adopt(immigrants)
+        ghosts = self.make_ghosts(halo)
+        before = len(creatures) + len(predators)
+        step_simulation(dt, ghosts)
+        births = len(creatures_to_add_global) + len(predators_to_add_global)
+        deaths = before + births - len(creatures) - len(predators)
+        victims = {}
+        for kind, group in zip(TILE_KINDS, ghosts):
+            for ghost in group:
+                if ghost.is_dead:
+                    victims.setdefault(ghost.owner, {}).setdefault(kind, []).append(ghost.remote_handle)
+                entity_handles.release(ghost.handle)
+        outbox = self.outbox()
+        outbox['reports'] = victims
+        outbox['stats'].update(births=births, deaths=deaths)
+        return outbox
+
+    def apply_reports(self, reports):
+        # Наші об'єкти, які на попередньому кроці з'їли чи вполювали агенти сусідніх тайлів
+        eaten = set()
+        for handle in reports.get('food', ()):
+            food = entity_handles.get(handle)
+            if isinstance(food, Food) and not food.is_dead:
+                food.is_dead = True
+                eaten.add(food)
+        if eaten:
+            for item in compact_removed(food_list, eaten): entity_handles.release(item.handle)
+        for handle in reports.get('creatures', ()):
+            prey = entity_handles.get(handle)
+            if prey is not None and not prey.is_dead:
+                prey.is_dead = True # Прибирається звичайним шляхом на цьому кроці
+
+    def adopt(self, immigrants):
+        for item in immigrants.get('food', ()):
+            food_list.append(Food.restore(*item))
+        for kind, species, pop_list, stats, cls, view_cls, arrays in (
+                ('creatures', 'creature', creatures, creature_gene_stats, Creature, CreatureView, creature_arrays),
+                ('predators', 'predator', predators, predator_gene_stats, Predator, PredatorView, predator_arrays)):
+            columns = immigrants.get(kind)
+            if columns is None: continue
+            stats.add(columns['genes'])
+            # Ідентифікатори родоводу іншого тайлу тут невідомі: агент отримує локальний рядок із
+            # посиланням на попередній, інакше кожен його нащадок ставав би засновником нової клади
+            ids = lineage.arrive(species, columns['genes'], columns['lineage'],
+                                 columns['lineage_root'], columns['lineage_born'])
+            pop_list.extend(adopt_agents(cls, view_cls, arrays, dict(columns, lineage=ids)))
+
+    def make_ghosts(self, halo):
+        ghosts = []
+        for kind, radius in zip(TILE_KINDS, (FOOD_RADIUS, CREATURE_RADIUS, PREDATOR_RADIUS)):
+            entries = halo.get(kind)
+            if entries is None:
+                ghosts.append([])
+                continue
+            ghosts.append([HaloEntity(x, y, radius, owner, handle) for (x, y), owner, handle in
+                           zip(entries['pos'].tolist(), entries['owner'].tolist(), entries['handle'].tolist())])
+        return ghosts
+
+    def outbox(self):
+        # Агенти та їжа за межами тайлу йдуть до нового власника, смуга біля меж - сусідам
+        global selected_agent
+        emigrants, boundary = {}, {}
+        for kind, items in zip(TILE_KINDS, (food_list, creatures, predators)):
+            pos = positions(items)
+            leaving = self.layout.owner(pos) != self.tile
+            movers = [item for item, gone in zip(items, leaving) if gone]
+            if kind == 'food':
+                emigrants[kind] = pos[leaving]
+                for item in compact_removed(items, set(movers)):
+                    renderer.mark_food(item)
+                    entity_handles.release(item.handle)
+            else:
+                emigrants[kind] = columns = agent_columns(movers, ())
+                stats = creature_gene_stats if kind == 'creatures' else predator_gene_stats
+                stats.remove(columns['genes'])
+                # Клада та час народження їдуть разом з агентом (новий тайл заводить для нього рядок)
+                rows = lineage.rows(columns['lineage'])
+                known = rows >= 0
+                columns['lineage_root'] = np.where(known, lineage.root[rows], NO_LINEAGE)
+                columns['lineage_born'] = np.where(known, lineage.born[rows], simulation_time)
+                # Родовід тайлу більше не бачить емігрантів: рядки закриваються, щоб їх можна було обрізати
+                lineage.die(emigrants[kind]['lineage'], simulation_time)
+                release_agents(compact_removed(items, set(movers)))
+                if selected_agent in movers: selected_agent = None
+            pos = pos[~leaving]
+            edge = ~self.layout.near(self.tile, pos, -TILE_HALO)
+            boundary[kind] = {'pos': pos[edge],
+                              'handle': np.fromiter((item.handle for item in items), np.int64, len(items))[edge]}
+        return {'emigrants': emigrants, 'boundary': boundary, 'reports': {}, 'stats': {
+            'creatures': len(creatures), 'predators': len(predators), 'food': len(food_list),
+            'births': 0, 'deaths': 0,
+            'generations': (max_creature_generation, max_predator_generation),
+            'moments': {species: (stats.count, stats.mean, stats.m2, stats.hist) for species, stats in
+                        (('creature', creature_gene_stats), ('predator', predator_gene_stats))},
+        }}
+
+def _tile_worker(conn, tile, shape, parameters, numpy_engine, obstacle_rects, seed):
+    # Виконується в окремому процесі: ініціалізує свою частку світу та крокує за командами
+    global USE_NUMPY_ENGINE
+    apply_overrides(parameters)
+    USE_NUMPY_ENGINE = numpy_engine
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+    lineage.id_base = tile << TILE_LINEAGE_SHIFT
+    # Початкові агенти розкидані по всьому світу - перший обмін передає їх власникам
+    init_new_world(obstacle_rects)
+    worker = TileWorker(tile, TileLayout(*shape))
+    conn.send(worker.outbox())
+    while True:
+        message = conn.recv()
+        if message is None: break
+        conn.send(worker.step(*message))
+    conn.close()
+
+def _concat_columns(parts):
+    if not parts: return None
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+def route_tile_messages(layout, outboxes):
+    # Вихідні повідомлення працівників -> (іммігранти, копії смуги, звіти) для кожного тайлу
+    n = len(layout)
+    immigrants = [{kind: [] for kind in TILE_KINDS} for _ in range(n)]
+    halo = [{kind: [] for kind in TILE_KINDS} for _ in range(n)]
+    reports = [{} for _ in range(n)]
+    for source, outbox in enumerate(outboxes):
+        for kind in TILE_KINDS:
+            moving = outbox['emigrants'][kind]
+            pos = moving if kind == 'food' else moving['pos']
+            if len(pos):
+                owners = layout.owner(pos)
+                for target in np.unique(owners).tolist():
+                    mask = owners == target
+                    immigrants[target][kind].append(pos[mask] if kind == 'food' else
+                                                    {name: column[mask] for name, column in moving.items()})
+            edge = outbox['boundary'][kind]
+            if not len(edge['pos']): continue
+            for target in range(n):
+                if target == source: continue
+                mask = layout.near(target, edge['pos'], TILE_HALO)
+                if mask.any():
+                    halo[target][kind].append({'pos': edge['pos'][mask], 'handle': edge['handle'][mask],
+                                               'owner': np.full(int(mask.sum()), source, np.int64)})
+        for owner, kinds in outbox['reports'].items():
+            for kind, handles in kinds.items():
+                reports[owner].setdefault(kind, []).extend(handles)
+    for target in range(n):
+        food = immigrants[target]['food']
+        immigrants[target] = {'food': np.concatenate(food).tolist() if food else [],
+                              'creatures': _concat_columns(immigrants[target]['creatures']),
+                              'predators': _concat_columns(immigrants[target]['predators'])}
+        halo[target] = {kind: _concat_columns(halo[target][kind]) for kind in TILE_KINDS}
+    return list(zip(immigrants, halo, reports))
+
+def record_tile_statistics(outboxes):
+    # Глобальна статистика з тайлів: моменти генів об'єднуються формулою Чана.
+    # Агенти в дорозі між тайлами теж рахуються - їх уже немає у старому і ще немає в новому.
+    global max_creature_generation, max_predator_generation
+    stats = [outbox['stats'] for outbox in outboxes]
+    totals = {key: sum(s[key] for s in stats) for key in ('creatures', 'predators', 'food', 'births', 'deaths')}
+    for species, kind, gene_stats in (('creature', 'creatures', creature_gene_stats),
+                                      ('predator', 'predators', predator_gene_stats)):
+        gene_stats.reset()
+        for outbox in outboxes:
+            gene_stats.merge(*outbox['stats']['moments'][species])
+            gene_stats.add(outbox['emigrants'][kind]['genes'])
+            totals[kind] += len(outbox['emigrants'][kind]['genes'])
+    totals['food'] += sum(len(outbox['emigrants']['food']) for outbox in outboxes)
+    max_creature_generation = max(s['generations'][0] for s in stats)
+    max_predator_generation = max(s['generations'][1] for s in stats)
+    record_statistics(totals['creatures'], totals['predators'])
+    return totals
+
+def run_tiled(tiles=(2, 2), steps=None, duration=None, dt=SIM_DT, seed=None):
+    # Headless-запуск світу, розбитого на tiles = (nx, ny) процесів; повертає ряди статистики,
+    # як run_headless, та підсумки останнього кроку (популяції, народження, смерті)
+    global simulation_time, last_log_time
+    if steps is None and duration is None:
+        raise ValueError("Потрібно вказати steps або duration")
+    layout = TileLayout(*tiles)
+    n = len(layout)
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+    # Перешкоди спільні для всіх тайлів - генеруються тут і розсилаються працівникам
+    obstacle_rects = [tuple(Obstacle().rect) for _ in range(NUM_OBSTACLES)]
+    base = sweepable_parameters()
+    connections, processes = [], []
+    for tile in range(n):
+        parameters = dict(base)
+        for name in TILE_SPLIT_PARAMETERS: # Остача - першим тайлам
+            parameters[name] = base[name] // n + (1 if tile < base[name] % n else 0)
+        parent, child = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=_tile_worker, daemon=True, args=(
+            child, tile, tiles, parameters, USE_NUMPY_ENGINE, obstacle_rects,
+            None if seed is None else seed + tile + 1))
+        process.start()
+        child.close()
+        connections.append(parent)
+        processes.append(process)
+
+    simulation_time = 0.0
+    last_log_time = -log_interval
+    reset_gene_ranges()
+    telemetry.clear()
+    try:
+        outboxes = [conn.recv() for conn in connections]
+        totals = record_tile_statistics(outboxes)
+        step = 0
+        end_time = duration
+        while True:
+            if steps is not None and step >= steps: break
+            if end_time is not None and simulation_time >= end_time: break
+            for conn, inbox in zip(connections, route_tile_messages(layout, outboxes)):
+                conn.send((dt, *inbox))
+            outboxes = [conn.recv() for conn in connections]
+            simulation_time += dt
+            step += 1
+            totals = record_tile_statistics(outboxes)
+    finally:
+        for conn in connections:
+            try: conn.send(None)
+            except (BrokenPipeError, OSError): pass
+        for process in processes:
+            process.join(timeout=5)
+    return get_history(), totals
+
+# --- Звіт про Пам'ять ---
+# Оцінка за sys.getsizeof: сам об'єкт плюс усе, що лежить у його слотах (вектори, гени, числа).
+# Спільні значення (кольори, ключі генів) рахуються один раз; масиви виду (рушій NumPy) -
+# за nbytes, індекси (дескриптори та просторові сітки) - окремим рядком.
+def slot_values(obj):
+    for klass in type(obj).__mro__:
+        for name in klass.__dict__.get('__slots__', ()):
+            try: yield klass.__dict__[name].__get__(obj, klass)
+            except AttributeError: pass # Слот не заповнено або затінено властивістю
+
+def value_bytes(value, seen):
+    if id(value) in seen: return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(value_bytes(k, seen) + value_bytes(v, seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(value_bytes(v, seen) for v in value)
+    return size
+
+def entities_bytes(items, seen, skip=()):
+    total = sys.getsizeof(items)
+    for obj in items:
+        total += sys.getsizeof(obj)
+        for value in slot_values(obj):
+            if value is not None and not isinstance(value, skip):
+                total += value_bytes(value, seen)
+    return total
+
+def arrays_bytes(arrays):
+    return (sum(getattr(arrays, name).nbytes for name in SpeciesArrays.FIELDS)
+            + sys.getsizeof(arrays.views))
+
+def grid_bytes(grid, seen):
+    return value_bytes(grid.cells, seen) + value_bytes(grid.cell_of, seen)
+
+def memory_report():
+    # Рядки (назва, кількість, байти) для їжі, видів та спільних індексів
+    seen = set()
+    rows = [('їжа', len(food_list), entities_bytes(food_list, seen))]
+    for name, agents, arrays in [('істоти', creatures, creature_arrays), ('хижаки', predators, predator_arrays)]:
+        size = entities_bytes(agents, seen, skip=(SpeciesArrays,))
+        if USE_NUMPY_ENGINE: size += arrays_bytes(arrays)
+        rows.append((name, len(agents), size))
+    index = (value_bytes(entity_handles.objects, {id(obj) for obj in entity_handles.objects})
+             + value_bytes(entity_handles.generations, seen) + value_bytes(entity_handles.free, seen))
+    for grid in (world_index.food, world_index.creatures, world_index.predators):
+        # Об'єкти в клітинках уже пораховані у своїх рядках
+        index += grid_bytes(grid, seen | {id(item) for bucket in grid.cells.values() for item in bucket})
+    rows.append(('індекси', len(entity_handles), index))
+    # Карти перешкод ростуть з площею світу, а не з кількістю агентів
+    maps = sum(occ.state.nbytes + occ.in_x.nbytes + occ.free_ends.nbytes + value_bytes(occ.edge_rects, seen)
+               for occ in obstacle_map.by_radius.values())
+    rows.append(('перешкоди', len(obstacles), maps))
+    return rows
+
+def print_memory_report():
+    rows = memory_report()
+    engine = "рушій NumPy" if USE_NUMPY_ENGINE else "об'єктний рушій"
+    print(f"Пам'ять ({engine}, оцінка sys.getsizeof):")
+    for name, count, size in rows:
+        print(f"  {name:>9}: {count:9d} шт. {size / 2**20:9.1f} МБ  {size / max(count, 1):7.0f} Б/шт.")
+    count = sum(count for name, count, _ in rows[:3])
+    size = sum(size for _, _, size in rows)
+    print(f"  {'разом':>9}: {count:9d} шт. {size / 2**20:9.1f} МБ  {size / max(count, 1):7.0f} Б/шт.")
+    return rows
+
+# --- Бенчмарки ---
+# Сценарії з фіксованим зерном на 100 ... 100k агентів. Площа світу та кількість перешкод
+# ростуть разом з агентами (сталa щільність), інакше сусідів стає O(n) і крок - O(n²).
+# Для кожного розміру: пік пам'яті (tracemalloc на побудові та першому кроці), кроки/с та
+# мс/крок по фазах (профайлер), час збереження/завантаження знімка. Сценарій повторюється
+# BENCH_REPEATS разів з того ж зерна, і кожна метрика береться найкращою з повторів (а
+# збереження/завантаження ще й з BENCH_IO_REPEATS замірів у кожному): одиничні заміри
+# коливались на 50-80%. Порівняння з базовим файлом показує
+# зміну кожної метрики у відсотках.
+BENCH_SIZES = (100, 1000, 10000, 100000)
+BENCH_SEED = 12345
+BENCH_AREA_PER_AGENT = 5000 # пікс.² світу на агента
+BENCH_TICK_BUDGET = 20000   # агенто-кроків на сценарій; кроків = max(BENCH_MIN_TICKS, budget // n)
+BENCH_MIN_TICKS = 3
+BENCH_REPEATS = 3           # повторів сценарію; метрики - найкращі з повторів
+BENCH_IO_REPEATS = 5        # замірів збереження/завантаження в кожному повторі (короткі, тож найшумніші)
+BENCH_TOLERANCE = 0.25      # погіршення понад 25% вважається регресією (шум вимірювань ~10-20%)
+BENCH_TIME_FLOOR = 0.005    # різниця часу збереження/завантаження менше 5 мс - не регресія
+BENCH_BASELINE_FILE = "benchmark_baseline.json"
+# Метрики для порівняння: (ключ, True - чим більше, тим краще)
+BENCH_METRICS = (('ticks_per_sec', True), ('peak_mb', False), ('save_s', False), ('load_s', False))
+
+def benchmark_overrides(n):
+    # Параметри світу для сценарію з n агентами (90% істот, 10% хижаків)
+    area = n * BENCH_AREA_PER_AGENT
+    width = int(math.sqrt(area * 4 / 3))
+    height = int(area / width)
+    return {
+        'WIDTH': width, 'HEIGHT': height,
+        'NUM_OBSTACLES': max(1, round(NUM_OBSTACLES * area / (1000 * 750))),
+        'INITIAL_CREATURES': n - n // 10, 'INITIAL_PREDATORS': n // 10,
+        'MAX_CREATURES': 2 * n, 'MAX_PREDATORS': 2 * n,
+        'FOOD_COUNT': n // 2,
+    }
+
+def best_of(samples):
+    # Найкраще значення кожної метрики серед повторів сценарію: шум лише погіршує заміри
+    best = dict(samples[0])
+    for metric, higher_is_better in BENCH_METRICS:
+        values = [sample[metric] for sample in samples]
+        best[metric] = max(values) if higher_is_better else min(values)
+    best['ms_per_tick'] = {phase: min(sample['ms_per_tick'].get(phase, math.inf) for sample in samples)
+                           for phase in samples[0]['ms_per_tick']}
+    best['repeats'] = len(samples)
+    return best
+
+def run_benchmark_scenario(n, numpy_engine, ticks=None, repeats=BENCH_REPEATS):
+    global USE_NUMPY_ENGINE
+    ticks = ticks or max(BENCH_MIN_TICKS, BENCH_TICK_BUDGET // n)
+    overrides = benchmark_overrides(n)
+    saved = {name: globals()[name] for name in list(overrides) + ['USE_NUMPY_ENGINE']}
+    try:
+        apply_overrides(overrides)
+        USE_NUMPY_ENGINE = numpy_engine
+        return best_of([measure_benchmark_scenario(n, ticks) for _ in range(max(1, repeats))])
+    finally:
+        globals().update(saved)
+
+def measure_benchmark_scenario(n, ticks):
+    # Один прогін сценарію з поточними параметрами світу (їх виставляє run_benchmark_scenario)
+    profiler_state = (profiler.enabled, profiler.path)
+    try:
+        random.seed(BENCH_SEED)
+        np.random.seed(BENCH_SEED)
+
+        tracemalloc.start()
+        init_new_world()
+        step_simulation(SIM_DT)
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+
+        profiler.path = None
+        profiler.enabled = False
+        profiler.enable(True)
+        started = time.perf_counter()
+        for _ in range(ticks):
+            step_simulation(SIM_DT)
+        elapsed = time.perf_counter() - started
+        ms_per_tick = {phase: profiler.times[phase] * 1000 / ticks
+                       for phase in profiler.phases if profiler.calls[phase]}
+        profiler.enabled, profiler.path = profiler_state
+
+        save_s = load_s = math.inf
+        with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()):
+            filename = os.path.join(directory, 'bench.npz')
+            for _ in range(BENCH_IO_REPEATS):
+                started = time.perf_counter()
+                save_simulation_state(filename)
+                save_s = min(save_s, time.perf_counter() - started)
+                started = time.perf_counter()
+                load_simulation_state(filename)
+                load_s = min(load_s, time.perf_counter() - started)
+            snapshot_mb = os.path.getsize(filename) / 2**20
+        return {'agents': n, 'world': [WIDTH, HEIGHT], 'ticks': ticks,
+                'ticks_per_sec': ticks / elapsed, 'ms_per_tick': ms_per_tick, 'peak_mb': peak_mb,
+                'save_s': save_s, 'load_s': load_s, 'snapshot_mb': snapshot_mb}
+    finally:
+        if tracemalloc.is_tracing(): tracemalloc.stop()
+        profiler.enabled, profiler.path = profiler_state
+
+def compare_benchmarks(results, baseline, tolerance=BENCH_TOLERANCE):
+    # Рядки (сценарій, метрика, база, зараз, зміна) та список регресій
+    rows, regressions = [], []
+    for key, current in results.items():
+        base = baseline.get(key)
+        if base is None: continue
+        for metric, higher_is_better in BENCH_METRICS:
+            old, new = base.get(metric), current.get(metric)
+            if not old or new is None: continue
+            change = new / old - 1
+            rows.append((key, metric, old, new, change))
+            if metric.endswith('_s') and abs(new - old) < BENCH_TIME_FLOOR: continue
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append((key, metric, old, new, change))
+    return rows, regressions
+
+def run_benchmarks(sizes=BENCH_SIZES, engines=('object', 'numpy'), baseline_file=BENCH_BASELINE_FILE,
+                   output=None, update_baseline=False, repeats=BENCH_REPEATS):
+    # Повертає (звіт, регресії); звіт пишеться в output, з update_baseline - і в базовий файл
+    # Повтори йдуть колами по всіх сценаріях, а не підряд: повільний період машини зачіпає
+    # різні повтори різних сценаріїв, і найкращий з повторів лишається чистим
+    samples = {}
+    for _ in range(max(1, repeats)):
+        for engine in engines:
+            for n in sizes:
+                samples.setdefault(f"{engine}/{n}", []).append(
+                    run_benchmark_scenario(n, numpy_engine=engine == 'numpy', repeats=1))
+    results = {}
+    for key, runs in samples.items():
+        result = results[key] = best_of(runs)
+        phases = ", ".join(f"{p} {ms:.2f}" for p, ms in
+                           sorted(result['ms_per_tick'].items(), key=lambda item: -item[1])[:4])
+        print(f"{key:>13}: {result['ticks_per_sec']:9.2f} кроків/с, пік {result['peak_mb']:8.1f} МБ, "
+              f"збереження {result['save_s'] * 1000:7.1f} мс, завантаження {result['load_s'] * 1000:7.1f} мс "
+              f"| мс/крок: {phases}")
+    report = {'python': platform.python_version(), 'numpy': np.__version__,
+              'machine': platform.platform(), 'results': results}
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    regressions = []
+    if baseline_file and os.path.exists(baseline_file) and not update_baseline:
+        with open(baseline_file, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        rows, regressions = compare_benchmarks(results, baseline)
+        print(f"\nПорівняння з {baseline_file} (допуск {BENCH_TOLERANCE:.0%}):")
+        for key, metric, old, new, change in rows:
+            flag = "  <-- регресія" if (key, metric, old, new, change) in regressions else ""
+            print(f"{key:>13} {metric:>14}: {old:10.4g} -> {new:10.4g} ({change:+.1%}){flag}")
+    if update_baseline and baseline_file:
+        with open(baseline_file, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Базові результати записано у {baseline_file}")
+    return report, regressions
+
+def main():
+    global USE_NUMPY_ENGINE
+    parser = argparse.ArgumentParser(description="Розширена еволюційна симуляція (Pygame)")
+    parser.add_argument('--headless', action='store_true', help="запуск без вікна на максимальній швидкості")
+    parser.add_argument('--steps', type=int, help="кількість кроків (headless)")
+    parser.add_argument('--duration', type=float, help="тривалість у секундах симуляції (headless)")
+    parser.add_argument('--dt', type=float, default=SIM_DT, help="крок симуляції у секундах (headless)")
+    parser.add_argument('--seed', type=int, help="зерно генератора випадкових чисел (headless)")
+    parser.add_argument('--load', help="файл збереження для старту (headless)")
+    parser.add_argument('--autosave', type=float, metavar='SECONDS',
+                        help=f"інтервал автозбереження у {AUTOSAVE_DIR}/ (за замовчуванням: {AUTOSAVE_INTERVAL:g}с у вікні, вимкнено в headless)")
+    parser.add_argument('--resume', action='store_true', help="продовжити з останньої контрольної точки")
+    parser.add_argument('--world', metavar='WxH',
+                        help="розмір світу в пікселях (напр. 4000x3000); вікно лишається 1000x750")
+    parser.add_argument('--tiles', metavar='NXxNY',
+                        help="headless: розбити світ на NX x NY тайлів, кожен у своєму процесі (напр. 2x2)")
+    parser.add_argument('--numpy-engine', action='store_true',
+                        help="рушій NumPy: стан агентів у масивах виду, векторизований крок (бенчмарки обирають рушій через --bench-engine)")
+    parser.add_argument('--profile', metavar='FILE',
+                        help="профілювати фази та щосекунди писати підсумок у FILE (.json - останнє вікно, .csv - рядок на вікно)")
+    parser.add_argument('--telemetry-dir', default=TELEMETRY_DIR,
+                        help=f"каталог для сегментів історії (.npy по {TELEMETRY_CHUNK} точок); без нього історія в пам'яті")
+    parser.add_argument('--sweep-grid', action='append', metavar='NAME=V1,V2,...',
+                        help="sweep: значення параметра для повної сітки (можна повторювати)")
+    parser.add_argument('--sweep-range', action='append', metavar='NAME=MIN:MAX',
+                        help="sweep: діапазон параметра для випадкової вибірки (можна повторювати)")
+    parser.add_argument('--samples', type=int, default=10, help="sweep: кількість випадкових точок")
+    parser.add_argument('--replicates', type=int, default=3, help="sweep: повторів на конфігурацію")
+    parser.add_argument('--workers', type=int, help="sweep: кількість процесів (за замовчуванням - усі ядра)")
+    parser.add_argument('--output', default="sweep_results.json", help="sweep: файл результатів")
+    parser.add_argument('--benchmark', action='store_true', help="запустити бенчмарки та порівняти з базовими результатами")
+    parser.add_argument('--bench-sizes', default=",".join(map(str, BENCH_SIZES)),
+                        help="бенчмарк: кількості агентів через кому")
+    parser.add_argument('--bench-engine', choices=('object', 'numpy', 'both'), default='both',
+                        help="бенчмарк: рушій")
+    parser.add_argument('--bench-repeats', type=int, default=BENCH_REPEATS,
+                        help="бенчмарк: повторів кожного сценарію (метрики - найкращі з повторів)")
+    parser.add_argument('--baseline', default=BENCH_BASELINE_FILE, help="бенчмарк: файл базових результатів")
+    parser.add_argument('--update-baseline', action='store_true', help="бенчмарк: записати результати як базові")
+    parser.add_argument('--bench-output', help="бенчмарк: файл звіту (JSON)")
+    parser.add_argument('--memory-report', action='store_true',
+                        help="headless: вивести пам'ять на об'єкт і на вид після запуску (без --steps - одразу після створення світу)")
+    args = parser.parse_args()
+    if args.numpy_engine: USE_NUMPY_ENGINE = True
+    if args.world:
+        world_width, world_height = parse_dimensions(args.world)
+        apply_overrides({'WIDTH': world_width, 'HEIGHT': world_height})
+    if args.telemetry_dir: telemetry.set_directory(args.telemetry_dir)
+    if args.profile: profiler.enable(path=args.profile)
+
+    if args.benchmark:
+        engines = ('object', 'numpy') if args.bench_engine == 'both' else (args.bench_engine,)
+        sizes = [int(v) for v in args.bench_sizes.split(',') if v.strip()]
+        _, regressions = run_benchmarks(sizes, engines, baseline_file=args.baseline,
+                                        output=args.bench_output, update_baseline=args.update_baseline,
+                                        repeats=args.bench_repeats)
+        if regressions:
+            raise SystemExit(1)
+        return
 
-    pygame.display.flip()
+    if args.sweep_grid or args.sweep_range:
+        if args.steps is None and args.duration is None:
+            parser.error("для sweep потрібно вказати --steps або --duration")
+        configs = sweep_configurations(parse_sweep_values(args.sweep_grid),
+                                       parse_sweep_values(args.sweep_range, ranges=True),
+                                       samples=args.samples, seed=args.seed)
+        run_sweep(configs, replicates=args.replicates, steps=args.steps, duration=args.duration,
+                  dt=args.dt, seed=args.seed or 0, workers=args.workers, output=args.output)
+        return
 
-# --- Завершення Pygame та Побудова Графіків ---
-pygame.quit()
-print("Завершення симуляції...")
-plot_simulation_data()
-print("Програма завершена.")
\ No newline at end of file
+    if not args.headless:
+        if args.autosave is not None: autosaver.interval = args.autosave
+        run_interactive(resume=args.resume)
+        return
+
+    if args.steps is None and args.duration is None:
+        if not args.memory_report:
+            parser.error("для --headless потрібно вказати --steps або --duration")
+        args.steps = 0
+    started = time.perf_counter()
+    if args.tiles:
+        if args.load or args.resume or args.autosave or args.memory_report:
+            parser.error("--tiles не підтримує --load, --resume, --autosave та --memory-report")
+        history, totals = run_tiled(parse_dimensions(args.tiles), steps=args.steps, duration=args.duration,
+                                    dt=args.dt, seed=args.seed)
+        elapsed = time.perf_counter() - started
+        print(f"Симульовано {simulation_time:.1f}с за {elapsed:.2f}с реального часу "
+              f"({simulation_time / max(elapsed, 1e-9):.0f}x) на {args.tiles} тайлах.")
+        print(f"Істоти: {totals['creatures']}, Хижаки: {totals['predators']}, Їжа: {totals['food']}, "
+              f"точок історії: {len(history['time'])}")
+        return
+    history = run_headless(steps=args.steps, duration=args.duration, dt=args.dt,
+                           load_file=args.load, seed=args.seed, autosave=args.autosave, resume=args.resume)
+    elapsed = time.perf_counter() - started
+    print(f"Симульовано {simulation_time:.1f}с за {elapsed:.2f}с реального часу "
+          f"({simulation_time / max(elapsed, 1e-9):.0f}x).")
+    print(f"Істоти: {len(creatures)}, Хижаки: {len(predators)}, Їжа: {len(food_list)}, "
+          f"точок історії: {len(history['time'])}")
+    if args.memory_report: print_memory_report()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+import os
+import random
+import threading
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import numpy as np
+import pygame
+import pytest
+
+import evo_with_gemini_v2 as sim
+
+
+def run_steps(steps):
+    for _ in range(steps):
+        sim.step_simulation(sim.SIM_DT)
+
+
+def assert_same_arrays(expected, actual):
+    assert set(actual) == set(expected)
+    for key, arr in expected.items():
+        np.testing.assert_array_equal(actual[key], arr, err_msg=key)
+
+
+# --- Автозбереження ---
+def test_checkpoint_delta_round_trip(tmp_path):
+    # Повна точка + дві дельти до неї: найновіша дельта відтворює знімок світу байт у байт
+    random.seed(1)
+    np.random.seed(1)
+    sim.init_new_world()
+    saver = sim.Autosaver(directory=str(tmp_path), interval=0, full_every=3)
+    for _ in range(3):
+        run_steps(120)
+        saver.checkpoint()
+        saver.wait()
+        expected = sim.snapshot_arrays()
+
+    kinds = [kind for _, kind, _ in sim.list_checkpoints(str(tmp_path))]
+    assert kinds == ['full', 'delta', 'delta']
+    path, data = sim.read_checkpoint_data(str(tmp_path))
+    assert path.endswith('_delta.npz')
+    assert_same_arrays(expected, data)
+
+    # Дельта містить лише зміни: перешкоди не пишуться, історія - тільки хвостом
+    with np.load(path) as delta:
+        assert 'obstacles.rects' not in delta.files
+        assert any(key.startswith('tail.history.') for key in delta.files)
+
+    sim.restore_snapshot(data)
+    assert_same_arrays(expected, sim.snapshot_arrays())
+
+
+def test_autosaver_busy_until_queued_write_finishes(tmp_path, monkeypatch):
+    # Попередній запис завершується саме між постановкою нової точки в чергу і записом:
+    # tick() не повинен додати ще одну точку, поки нова чекає в черзі
+    writes = threading.Semaphore(0)
+    write = sim.write_snapshot_atomic
+
+    def blocked_write(filename, data):
+        writes.acquire()
+        write(filename, data)
+    monkeypatch.setattr(sim, 'write_snapshot_atomic', blocked_write)
+
+    sim.init_new_world()
+    saver = sim.Autosaver(directory=str(tmp_path), interval=1e-9)
+    saver.checkpoint()
+    ensure_worker = saver._ensure_worker
+
+    def finish_previous():
+        ensure_worker()
+        writes.release()
+        saver.jobs.join()
+    saver._ensure_worker = finish_previous
+    saver.checkpoint()
+    assert saver.busy
+    assert not saver.tick()
+
+    writes.release()
+    saver.wait()
+    assert not saver.busy
+    assert len(sim.list_checkpoints(str(tmp_path))) == 2
+
+
+def test_apply_checkpoint_delta_appends_history_tail():
+    base = {'history.time': np.arange(3.0), 'food.pos': np.zeros((2, 2)), 'meta.version': np.array(1)}
+    data = {'history.time': np.arange(5.0), 'food.pos': np.ones((3, 2)), 'meta.version': np.array(1)}
+    delta = sim.checkpoint_delta(data, base, base_seq=7)
+    np.testing.assert_array_equal(delta['tail.history.time'], [3.0, 4.0])
+    assert int(delta['delta.base_seq']) == 7
+    assert_same_arrays(data, sim.apply_checkpoint_delta(base, delta))
+
+
+# --- Статистика генів ---
+def test_gene_statistics_remove_matches_numpy():
+    # Додавання та видалення пакетами різного розміру (обернене злиття Чана) проти повного перерахунку
+    rng = np.random.default_rng(7)
+    ranges = sim.creature_genome().ranges()
+    low = np.array([ranges[g][0] for g in ranges])
+    high = np.array([ranges[g][1] for g in ranges])
+    values = rng.uniform(low, high, size=(600, len(ranges)))
+    stats = sim.GeneStatistics(ranges)
+    for batch in np.array_split(values, [1, 50, 300]):
+        stats.add(batch)
+
+    alive = np.ones(len(values), dtype=bool)
+    for size in (1, 7, 120, 200):
+        dead = rng.choice(np.flatnonzero(alive), size, replace=False)
+        alive[dead] = False
+        stats.remove(values[dead])
+        kept = values[alive]
+        assert stats.count == len(kept)
+        for g, gene in enumerate(ranges):
+            assert np.isclose(stats.gene_mean(gene), kept[:, g].mean())
+            assert np.isclose(stats.std(gene), kept[:, g].std())
+            assert stats.histogram(gene)[0].sum() == len(kept)
+
+    stats.remove(values[alive])
+    assert stats.count == 0
+    assert stats.gene_mean('speed') == 0.0
+
+
+def test_statistics_row_stores_quantiles_and_histograms():
+    # Кожен запис статистики - перцентилі генів (з точністю до кошика) та лічильники гістограми
+    random.seed(6)
+    np.random.seed(6)
+    sim.init_new_world()
+    run_steps(120)
+    sim.last_log_time = sim.simulation_time - sim.log_interval
+    sim.record_statistics()
+
+    history = sim.get_history()
+    speed = sim.gene_matrix(sim.creatures)[:, sim.GENE_NAMES.index('speed')]
+    counts, edges = sim.gene_histogram_history('creature', 'speed')
+    assert counts.shape == (len(history['time']), sim.GENE_HIST_BINS)
+    np.testing.assert_array_equal(counts[-1], np.histogram(speed, bins=edges)[0])
+    width = edges[1] - edges[0]
+    for q in sim.TELEMETRY_QUANTILES:
+        assert abs(history[f'p{q}_creature_speed'][-1] - np.percentile(speed, q)) <= width
+
+
+# --- Рушій NumPy ---
+def test_point_grid_matches_brute_force():
+    # Запити для всього масиву проти повного перебору: найближча допустима точка та розштовхування
+    rng = np.random.default_rng(5)
+    points = rng.uniform(-40, 400, size=(300, 2))
+    radius = rng.uniform(5, 120, size=len(points))
+    valid = rng.random(len(points)) > 0.2
+    grid = sim.PointGrid(points, cell_size=50)
+    closest, dist_sq = grid.nearest(points, radius, valid=valid, exclude=np.arange(len(points)))
+    vectors, counts = grid.separation(points, 30.0, exclude=np.arange(len(points)))
+
+    d_sq = ((points[:, None, :] - points[None, :, :]) ** 2).sum(axis=2)
+    np.fill_diagonal(d_sq, np.inf)
+    masked = np.where(valid[None, :] & (d_sq < radius[:, None] ** 2), d_sq, np.inf)
+    expected = np.where(np.isfinite(masked.min(axis=1)), masked.argmin(axis=1), -1)
+    np.testing.assert_array_equal(closest, expected)
+    np.testing.assert_allclose(dist_sq[expected >= 0], masked.min(axis=1)[expected >= 0])
+    near = d_sq < 30.0 ** 2
+    np.testing.assert_array_equal(counts, near.sum(axis=1))
+    weights = np.where(near, 1 / np.maximum(d_sq, 0.1), 0)
+    np.testing.assert_allclose(vectors, (weights[:, :, None] * (points[:, None, :] - points[None, :, :])).sum(axis=1))
+
+
+def test_engine_restore_writes_arrays(monkeypatch):
+    # Знімок відновлюється прямо в масиви виду: цілі, дескриптори та родовід - з колонок,
+    # колір представлення - з генів при першому читанні
+    monkeypatch.setattr(sim, 'USE_NUMPY_ENGINE', True)
+    random.seed(4)
+    np.random.seed(4)
+    sim.init_new_world()
+    run_steps(60)
+    expected = sim.snapshot_arrays()
+    colors = [agent.color for agent in sim.creatures]
+
+    sim.restore_snapshot(expected)
+    assert_same_arrays(expected, sim.snapshot_arrays())
+    assert [agent.color for agent in sim.creatures] == colors
+    for agent in sim.creatures + sim.predators:
+        assert sim.entity_handles.get(agent.handle) is agent
+    run_steps(1)
+
+
+# --- Перебір параметрів ---
+def test_overrides_only_accept_runtime_parameters():
+    assert sim.validate_overrides({'FOOD_COUNT': 50.0, 'MATE_MATCH_ROUNDS': 1}) == {'FOOD_COUNT': 50, 'MATE_MATCH_ROUNDS': 1}
+    # Прив'язані при імпорті та службові константи: перевизначення нічого б не змінило
+    for name in ('GRID_CELL_SIZE', 'GENE_HIST_BINS', 'TELEMETRY_CAPACITY', 'OBSTACLE_MAP_CELL_SIZE',
+                 'SNAPSHOT_VERSION', 'BENCH_SEED', 'SCREEN_WIDTH'):
+        with pytest.raises(KeyError):
+            sim.validate_overrides({name: 1})
+
+
+# --- Тайли ---
+def test_tile_immigrants_keep_their_clade():
+    # Іммігранти з іншого тайлу отримують локальні рядки родоводу; їхні нащадки лишаються у кладі
+    random.seed(3)
+    np.random.seed(3)
+    sim.lineage.id_base = 0
+    sim.init_new_world()
+    worker = sim.TileWorker(0, sim.TileLayout(2, 1))
+    worker.outbox()
+    columns = sim.agent_columns(sim.creatures[:3], ())
+    foreign = (1 << sim.TILE_LINEAGE_SHIFT) + np.arange(3)
+    root = (1 << sim.TILE_LINEAGE_SHIFT) + 99
+    columns.update(lineage=foreign, lineage_root=np.full(3, root), lineage_born=np.zeros(3))
+    worker.step(sim.SIM_DT, {'creatures': columns}, {}, {})
+
+    rows = np.flatnonzero(np.isin(sim.lineage.parents[:sim.lineage.count, 0], foreign))
+    np.testing.assert_array_equal(sim.lineage.parents[rows, 0], foreign)
+    np.testing.assert_array_equal(sim.lineage.root[rows], root)
+    child = sim.lineage.birth('creature', columns['genes'][0], sim.lineage.id[rows[0]], time=1.0)
+    assert sim.lineage.root[sim.lineage.rows([child])[0]] == root
+    assert len(sim.lineage.alive_rows()) == len(sim.creatures) + len(sim.predators) + 1
+
+
+# --- Вікно ---
+def press(key):
+    pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key=key, mod=0, unicode=''))
+
+
+def test_profiler_toggled_mid_frame():
+    # Клавіша O вмикає/вимикає профайлер під час обробки подій того самого кадру
+    sim.init_display()
+    random.seed(2)
+    np.random.seed(2)
+    sim.init_new_world()
+    sim.profiler.enable(False)
+    sim.show_profile = False
+    mouse = pygame.Vector2(0, 0)
+
+    press(pygame.K_o)
+    accumulator = sim.interactive_frame(1 / 60, 1, 0.0, mouse)
+    assert sim.profiler.enabled
+    accumulator = sim.interactive_frame(1 / 60, 1, accumulator, mouse)
+    assert sim.profiler.calls['events'] == 1
+
+    press(pygame.K_o)
+    sim.interactive_frame(1 / 60, 1, accumulator, mouse)
+    assert not sim.profiler.enabled